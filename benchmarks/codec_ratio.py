@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Benchmark the lossless time-predictive codec (issformat.tpcEncode) against gzip on SST/BST-like float data
+
+Reports the compression ratio and the encode and decode throughput of zlib on the raw bytes, zlib after an
+HDF5-style byte shuffle, and the time-predictive codec (integer difference with, or XOR with, the previous
+integration, byte planes, zlib), for a synthetic BST data set or for a raw BST/SST file given as argument.
+The ratio of every codec is bounded by the noise of the data, see --noise.
+"""
+
+# python 2 and 3 support
+from __future__ import print_function
+
+import os
+import sys
+import time
+import zlib
+
+import numpy as np
+
+REPODIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPODIR)
+
+import issformat
+from compression_threads import syntheticBST
+
+def shuffleEncode(block, level):
+    block = np.ascontiguousarray(block)
+    return zlib.compress(np.ascontiguousarray(block.view(np.uint8).reshape(-1, block.dtype.itemsize).T), level)
+
+def shuffleDecode(buf, dtype, shape):
+    planes = np.frombuffer(zlib.decompress(buf), dtype=np.uint8).reshape(dtype.itemsize, -1)
+    return np.ascontiguousarray(planes.T).view(dtype).reshape(shape)
+
+CODECS = [
+    ('zlib', lambda block, level: zlib.compress(np.ascontiguousarray(block), level),
+             lambda buf, dtype, shape: np.frombuffer(zlib.decompress(buf), dtype=dtype).reshape(shape)),
+    ('shuffle + zlib', shuffleEncode, shuffleDecode),
+    ('tpc', issformat.tpcEncode, issformat.tpcDecode),
+]
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    o = OptionParser()
+    o.set_usage('%prog [options] [raw BST or SST file]')
+    o.set_description(__doc__)
+    o.add_option('-n', '--nints', dest='nints', default=8192, type=int,
+        help = 'Number of synthetic BST integrations, default: 8192')
+    o.add_option('--noise', dest='noise', default=0.01, type=float,
+        help = 'Relative noise of the synthetic BST integrations, default: 0.01')
+    o.add_option('-l', '--level', dest='level', default=6, type=int,
+        help = 'zlib compression level, default: 6')
+    o.add_option('--sclass', dest='sclass', default='BST',
+        help = 'Statistics class of the raw file argument, BST or SST, default: BST')
+    opts, args = o.parse_args(sys.argv[1:])
+
+    if len(args) > 0:
+        dd = issformat.sst2npy(args[0]) if opts.sclass.upper() == 'SST' else issformat.bst2npy(args[0])
+        source = args[0]
+    else:
+        import tempfile
+        fd, rawfile = tempfile.mkstemp(suffix='.dat')
+        os.close(fd)
+        try:
+            syntheticBST(rawfile, opts.nints, noise=opts.noise)
+            dd = np.array(issformat.bst2npy(rawfile))
+        finally:
+            os.remove(rawfile)
+        source = 'synthetic BST (noise %g)'%opts.noise
+
+    blockints = issformat._tpcBlockInts(dd.dtype, dd.shape[1:])
+    blocks = [dd[i0:i0 + blockints] for i0 in range(0, dd.shape[0], blockints)]
+    print('%s: %d integrations, %.1f MB, blocks of %d integrations, zlib level %d'%(source, dd.shape[0], dd.nbytes / 2.**20, blockints, opts.level))
+    print('%-16s %8s %14s %14s'%('codec', 'ratio', 'encode MB/s', 'decode MB/s'))
+    for name, encode, decode in CODECS:
+        t0 = time.time()
+        bufs = [encode(block, opts.level) for block in blocks]
+        tenc = time.time() - t0
+        t0 = time.time()
+        out = [decode(buf, block.dtype, block.shape) for buf, block in zip(bufs, blocks)]
+        tdec = time.time() - t0
+        assert all(np.array_equal(a.view(np.uint8), b.view(np.uint8)) for a, b in zip(out, blocks)), '%s is not lossless'%name
+        ratio = dd.nbytes / float(sum(len(buf) for buf in bufs))
+        print('%-16s %8.2f %14.1f %14.1f'%(name, ratio, dd.nbytes / 2.**20 / tenc, dd.nbytes / 2.**20 / tdec))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Benchmark the throughput of compressed HDF5 writes with the number of compression threads
+
+Writes a synthetic BST file (a slowly varying spectrum with noise) to a gzip compressed HDF5 file with
+statData.writeHDF5(compression=...) for a range of thread counts, and with the single threaded h5py filter
+pipeline for reference, and reports the write throughput and compression ratio.
+"""
+
+# python 2 and 3 support
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPODIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPODIR)
+
+import issformat
+
+def syntheticBST(filename, nints, nbeamlets=488, noise=0.01):
+    """Write a BST-like raw file, a bandpass which drifts slowly in time plus noise (standard deviation relative to the
+    power), rounded to integers as the station statistics are accumulated integer powers"""
+    bandpass = 1e6 * (1. + np.sin(np.linspace(0., 3. * np.pi, nbeamlets))**2)
+    nblock = 1024
+    with open(filename, 'wb') as fh:
+        for i0 in range(0, nints, nblock):
+            n = min(nblock, nints - i0)
+            drift = 1. + 0.1 * np.sin(2. * np.pi * (i0 + np.arange(n)) / 3600.)[:, None]
+            np.round(bandpass * drift * (1. + noise * np.random.randn(n, nbeamlets))).astype('<f8').tofile(fh)
+
+def writeReference(rawfile, filename, level, shuffle):
+    """Compressed write through the h5py filter pipeline"""
+    h5py = issformat.h5py
+    s = issformat.BST(rawfile=rawfile)
+    dtype, recshape = s._rawRecord()
+    nints = s.rawInts()
+    with h5py.File(filename, 'w') as h5:
+        dset = issformat._createDataset(h5, (nints,) + recshape, dtype, level, shuffle)
+        issformat._copyRawToDataset(rawfile, dtype, recshape, dset)
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    o = OptionParser()
+    o.set_usage('%prog [options]')
+    o.set_description(__doc__)
+    o.add_option('-n', '--nints', dest='nints', default=86400, type=int,
+        help = 'Number of BST integrations, default: 86400 (a day of 1 s integrations, 337 MB)')
+    o.add_option('-l', '--level', dest='level', default=4, type=int,
+        help = 'gzip compression level, default: 4')
+    o.add_option('--shuffle', dest='shuffle', action='store_true',
+        help = 'Apply the shuffle filter before compression')
+    o.add_option('-t', '--threads', dest='threads', default=None,
+        help = 'Comma separated list of thread counts, default: 1, 2, 4, ... up to the number of CPUs')
+    opts, args = o.parse_args(sys.argv[1:])
+
+    if opts.threads is None:
+        ncpu = os.cpu_count() if hasattr(os, 'cpu_count') else 1
+        threads = [2**p for p in range(int(np.log2(ncpu)) + 1)]
+        if threads[-1] != ncpu: threads.append(ncpu)
+    else: threads = [int(t) for t in opts.threads.split(',')]
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        rawfile = os.path.join(tmpdir, 'bench_bst.dat')
+        syntheticBST(rawfile, opts.nints)
+        rawsize = os.path.getsize(rawfile)
+        h5file = os.path.join(tmpdir, 'bench_bst.h5')
+
+        print('%d integrations, %.1f MB raw, gzip level %d, shuffle %s'%(opts.nints, rawsize / 2.**20, opts.level, bool(opts.shuffle)))
+        print('%-20s %10s %10s %8s'%('writer', 'seconds', 'MB/s', 'ratio'))
+
+        t0 = time.time()
+        writeReference(rawfile, h5file, opts.level, opts.shuffle)
+        dt = time.time() - t0
+        print('%-20s %10.2f %10.1f %8.2f'%('h5py filter', dt, rawsize / 2.**20 / dt, rawsize / float(os.path.getsize(h5file))))
+
+        for nthreads in threads:
+            s = issformat.BST(rawfile=rawfile)
+            t0 = time.time()
+            s.writeHDF5(h5file, compression=opts.level, shuffle=opts.shuffle, nthreads=nthreads)
+            dt = time.time() - t0
+            print('%-20s %10.2f %10.1f %8.2f'%('%d threads'%nthreads, dt, rawsize / 2.**20 / dt, rawsize / float(os.path.getsize(h5file))))
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Benchmark the start up latency of issformat and issConverter.py
+
+Measures the wall clock time of:
+* importing issformat (h5py is imported lazily) and importing issformat and h5py
+* converting a small SST file to JSON and HDF5 with issConverter.py, directly and through a conversion daemon (--socket)
+"""
+
+# python 2 and 3 support
+from __future__ import print_function
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPODIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONVERTER = os.path.join(REPODIR, 'scripts', 'issConverter.py')
+
+def timeCommand(cmd, nruns, cwd, env):
+    """Median wall clock time of a command in ms"""
+    times = []
+    for run in range(nruns):
+        t0 = time.time()
+        subprocess.check_call(cmd, cwd=cwd, env=env, stdout=open(os.devnull, 'w'))
+        times.append((time.time() - t0) * 1e3)
+    return np.median(times)
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    o = OptionParser()
+    o.set_usage('%prog [options]')
+    o.set_description(__doc__)
+    o.add_option('-n', '--nruns', dest='nruns', default=10, type=int,
+        help = 'Number of runs of each command, default: 10')
+    opts, args = o.parse_args(sys.argv[1:])
+
+    tmpdir = tempfile.mkdtemp()
+    env = dict(os.environ)
+    env['PYTHONPATH'] = REPODIR + os.pathsep + env.get('PYTHONPATH', '')
+
+    rawfile = '20140430_153356_sst_rcu024.dat'
+    np.random.rand(60, 512).tofile(os.path.join(tmpdir, rawfile)) # a minute of 1 s SST integrations
+    convert = [CONVERTER, '--standard', '--rawfile', rawfile, '-o', 'json,hdf5', '--force']
+    sockfile = os.path.join(tmpdir, 'iss.sock')
+
+    daemon = subprocess.Popen([sys.executable, CONVERTER, '--serve', sockfile], cwd=tmpdir, env=env, stdout=open(os.devnull, 'w'))
+    try:
+        while not os.path.exists(sockfile): time.sleep(0.05)
+
+        results = [
+            ('python start up', [sys.executable, '-c', 'pass']),
+            ('import issformat', [sys.executable, '-c', 'import issformat']),
+            ('import issformat, h5py', [sys.executable, '-c', 'import issformat, h5py']),
+            ('issConverter.py --help', [sys.executable, CONVERTER, '--help']),
+            ('issConverter.py SST -> JSON, HDF5', [sys.executable] + convert),
+            ('issConverter.py --socket SST -> JSON, HDF5', [sys.executable] + convert + ['--socket', sockfile]),
+        ]
+        print('%-45s %10s'%('command', 'median ms'))
+        for name, cmd in results:
+            print('%-45s %10.1f'%(name, timeCommand(cmd, opts.nruns, tmpdir, env)))
+    finally:
+        daemon.terminate()
+        daemon.wait()
+        shutil.rmtree(tmpdir)
@@ -7,16 +7,39 @@ HDF5 wrapper support is optional
 # python 2 and 3 support
 from __future__ import print_function
 
+import collections
+import contextlib
+import copy
 import datetime
+import hashlib
+import importlib
+import io
+import itertools
 import json
 import numpy as np
 import os
+import threading
+import zlib
 
+class _LazyModule(object):
+    """Module proxy, the module is imported on first attribute access
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None: self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+# h5py is only imported when HDF5 files are used, metadata only users do not pay its import time
 try:
-    import h5py
-    H5SUPPORT = True
-except ImportError:
-    H5SUPPORT = False
+    from importlib.util import find_spec
+    H5SUPPORT = not (find_spec('h5py') is None)
+except ImportError: # python 2
+    import pkgutil
+    H5SUPPORT = not (pkgutil.find_loader('h5py') is None)
+h5py = _LazyModule('h5py')
 
 VALIDSTATIONS = [ 'CS001', 'CS002', 'CS003', 'CS004', 'CS005', 'CS006', 'CS007',
                   'CS011', 'CS013', 'CS017', 'CS021', 'CS024', 'CS026', 'CS028',
@@ -27,8 +50,6 @@ VALIDSTATIONS = [ 'CS001', 'CS002', 'CS003', 'CS004', 'CS005', 'CS006', 'CS007',
                   'RS306', 'RS307', 'RS310', 'RS406', 'RS407', 'RS409', 'RS503',
                   'RS508', 'RS509', 'RS511', 'SE607', 'UK608']
 
-# TODO: unittests
-
 """
 From ASTRON Single Station wiki:
 HADEC or AZELGEO can be used to point to fixed position (north=0,0,AZELGEO, south=3.14159,0,AZELGEO, zenith=0,1.5708,AZELGEO).
@@ -39,11 +60,64 @@ See station_data_cookbook_v1.1.pdf for more details
 """
 COORD_SYSTEMS = ['J2000', 'HADEC', 'AZELGEO', 'ITRF', 'B1950', 'GALACTIC', 'ECLIPTIC', 'JUPITER', 'MARS', 'MERCURY', 'MOON', 'NEPTUNE', 'PLUTO', 'SATURN', 'SUN', 'URANUS', 'VENUS']
 
+def _toDatetime64(t):
+    """Convert a datetime, numpy datetime64 or 'YYYY-MM-DD HH:MM:SS' string to a datetime64[us]
+    """
+    return np.datetime64(t, 'us')
+
+def _integrationDelta(integration):
+    """Integration length in seconds as a timedelta64[us], rounded to the nearest microsecond
+    """
+    return np.timedelta64(int(np.round(integration * 1e6)), 'us')
+
+def _timeIndex(ts, integration, nints, start=None, stop=None):
+    """Range of the integrations [0, nints) of the time grid ts + i * integration overlapping a time range,
+    an integration partially inside the range is included, see statData.timeIndex()
+    ts: datetime64 of the first integration
+    integration: float, integration length in seconds
+
+    returns: (first integration, integration to stop at (exclusive))
+    """
+    ts = _toDatetime64(ts)
+    integration = _integrationDelta(integration)
+    if start is None: i0 = 0
+    else: i0 = int(np.floor((_toDatetime64(start) - ts) / integration))
+    if stop is None: i1 = nints
+    else: i1 = int(np.ceil((_toDatetime64(stop) - ts) / integration))
+    i0 = min(max(i0, 0), nints)
+    return i0, min(max(i1, i0), nints)
+
+def _tableCode(table, value, maxcodes):
+    """Index of a value in a table of the distinct values of a column, the value is appended if it is new
+    table: list, modified in place
+    maxcodes: int, maximum number of distinct values the column codes can hold
+    """
+    if value in table: return table.index(value)
+    if len(table) >= maxcodes: raise ValueError('more than %i distinct values of %s'%(maxcodes, value))
+    table.append(value)
+    return len(table) - 1
+
+def _rcuValue(rcus):
+    """'all', an RCU selection string or a list of RCU IDs, the comparable form of the RCUs of a beamlet"""
+    if isinstance(rcus, bytes): rcus = rcus.decode('utf-8')
+    if isinstance(rcus, str): return rcus
+    return [int(rcu) for rcu in np.ravel(rcus)]
+
 class statData(object):
     """ Statistics file super class all other classes inherit from
 
+    Metadata is stored compactly with __slots__ so that metadata of many files can be held in memory:
+    the RCU mode as a uint8 array, the HBA element configuration as one uint16 bitmask per tile (kept as the original
+    strings if they are not all four lower case hex characters, so the written form does not change).
+    The rcumode and hbaElements attributes decode them to the int/list forms written to JSON and HDF5,
+    modify them with the set methods (or by assignment), not in place.
+
     Attributes:
     """
+    # nants and npol are set by setArrayProp(), by ACC and XST on creation, and by any statData on request
+    __slots__ = ('station', '_rcumode', 'ts', '_hba', 'special', 'rawfile', '_pathrawfile', 'integration', 'rawhash', 'rawsize', 'rawmtime',
+                 'nants', 'npol')
+
     def __init__(self, station=None, rcumode=None, ts=None, hbaStr=None, special=None, rawfile=None, integration=1):
         
         self.setStation(station)
@@ -53,6 +127,7 @@ class statData(object):
         self.setSpecial(special)
         self.setRawFile(rawfile)
         self.setIntegration(integration)
+        self.setFingerprint()
 
     def setStation(self, station=None):
         #if not (station in VALIDSTATIONS): print('WARNING: %s not in valid station list.'%station)
@@ -62,22 +137,39 @@ class statData(object):
         """rcumode is either an integer (all RCUs are the same mode), a list of integers of length the number of RCUs, or None as a placeholder.
         """
         if rcumode is None:
-            self.rcumode = None
+            self._rcumode = None
+        elif isinstance(rcumode, float): # HDF5 version, np.nan
+            self._rcumode = None
         elif type(rcumode) is int:
-            self.rcumode = rcumode
+            self._rcumode = np.uint8(rcumode)
         elif type(rcumode) is np.int64: # HDF5 version
-            self.rcumode = int(rcumode)
+            self._rcumode = np.uint8(rcumode)
         elif type(rcumode) is np.ndarray: # HDF5 version
-            self.rcumode = rcumode.tolist()
+            self._rcumode = rcumode.astype(np.uint8)
+        elif type(rcumode) is str and ',' in rcumode: # comma separated list of RCU modes
+            self._rcumode = np.array(rcumode.split(','), dtype=int).astype(np.uint8)
         elif len(rcumode) == 1: # single RCUMODE (int), all RCUs are the same mode
-            self.rcumode = int(rcumode)
+            self._rcumode = np.uint8(int(rcumode[0]))
         else: # Mixed RCU mode (list of length the number of RCUs)
-            self.rcumode = list(map(int, rcumode))
+            self._rcumode = np.array(list(map(int, rcumode)), dtype=np.uint8)
+
+    @property
+    def rcumode(self):
+        """int (all RCUs are the same mode), list of int (mixed RCU modes) or None"""
+        if self._rcumode is None: return None
+        elif np.ndim(self._rcumode) == 0: return int(self._rcumode)
+        else: return self._rcumode.tolist()
+
+    @rcumode.setter
+    def rcumode(self, rcumode):
+        self.setRCUmode(rcumode)
 
     def setTimestamp(self, ts=None):
         # YYYY-MM-DD HH:MM:SS
         if (type(ts) is str) and (len(ts)==15): # string of format YYYYMMDD_HHMMSS
             self.ts = datetime.datetime(year=int(ts[:4]), month=int(ts[4:6]), day=int(ts[6:8]), hour=int(ts[9:11]), minute=int(ts[11:13]), second=int(ts[13:15]))
+        elif ts == 'None': # str(None) written when no timestamp is set
+            self.ts = None
         elif type(ts) is str: # YYYY-MM-DD HH:MM:SS HDF5 version
             self.ts = datetime.datetime.strptime(ts, '%Y-%m-%d %H:%M:%S')
         elif type(ts) is datetime.datetime:
@@ -116,12 +208,29 @@ class statData(object):
 
             rspctl --hbadelays=128,2,2,2,2,128,128,2,128,128,128,128,2,2,2,128
         """
-        if (hbaConfig is None) or np.isnan(hbaConfig):
-            self.hbaElements = None
-        elif type(hbaConfig) is list:
-            self.hbaElements = hbaConfig
-        else:
-            self.hbaElements = [hbaConfig[i:i+4] for i in range(0, len(hbaConfig), 4)]
+        if (hbaConfig is None) or isinstance(hbaConfig, float): # HDF5 version, np.nan
+            self._hba = None
+            return
+        elif type(hbaConfig) is np.ndarray: # HDF5 version
+            hbaConfig = [tile.decode('utf-8') if isinstance(tile, bytes) else str(tile) for tile in hbaConfig]
+        elif not (type(hbaConfig) is list):
+            hbaConfig = [hbaConfig[i:i+4] for i in range(0, len(hbaConfig), 4)]
+        # each tile string is four hex characters, one bit per element, packed only if the strings are decoded unchanged
+        try: packed = np.array([int(tile, 16) for tile in hbaConfig], dtype=np.uint16)
+        except (ValueError, TypeError, OverflowError): packed = None
+        if not (packed is None) and ['%04x'%tile for tile in packed] == list(hbaConfig): self._hba = packed
+        else: self._hba = list(hbaConfig)
+
+    @property
+    def hbaElements(self):
+        """list of four hex character strings, one per tile, or None"""
+        if self._hba is None: return None
+        elif isinstance(self._hba, list): return list(self._hba)
+        else: return ['%04x'%tile for tile in self._hba]
+
+    @hbaElements.setter
+    def hbaElements(self, hbaConfig):
+        self.setHBAelements(hbaConfig)
 
     def setSpecial(self, specialStr=None):
         #if type(specialStr) is str: self.special = specialStr
@@ -153,6 +262,19 @@ class statData(object):
         else: # integration in seconds
             self.integration = int(integration)
 
+    def setFingerprint(self, rawhash=None, rawsize=None, rawmtime=None):
+        """Content fingerprint of the raw data file, see rawFingerprint()
+        rawhash: str, 'sha256t:' + hex digest of the complete integrations in the raw data file, see _RawHasher
+        rawsize: int, raw data file size in bytes
+        rawmtime: float, raw data file modification time (seconds since the epoch)
+        """
+        if _unset(rawhash): self.rawhash = None # HDF5 version, np.nan
+        else: self.rawhash = str(rawhash)
+        if _unset(rawsize): self.rawsize = None
+        else: self.rawsize = int(rawsize)
+        if _unset(rawmtime): self.rawmtime = None
+        else: self.rawmtime = float(rawmtime)
+
     def setArrayProp(self, nants, npol):
         # TODO: this information could be extracted based on the station ID
         self.nants = nants
@@ -168,7 +290,11 @@ class statData(object):
         print('RAWFILE:', self.rawfile)
 
     def _buildDict(self):
-        self.metaDict = {
+        """Build the metadata dictionary written to JSON and HDF5
+
+        returns: dict
+        """
+        return {
             'datatype' : type(self).__name__,
             'station' : self.station,
             'rcumode' : self.rcumode,
@@ -176,7 +302,10 @@ class statData(object):
             'hbaelements' : self.hbaElements,
             'special' : self.special,
             'rawfile' : self.rawfile,
-            'integration' : self.integration
+            'integration' : self.integration,
+            'rawhash' : self.rawhash,
+            'rawsize' : self.rawsize,
+            'rawmtime' : self.rawmtime
         }
 
     def writeJSON(self, filename, printonly=False):
@@ -184,12 +313,306 @@ class statData(object):
         filename: filename to write JSON stream to
         printonly: boolean, if true only print the output dictionary and do not write to file
         """
-        self._buildDict()
+        metaDict = self._buildDict()
         if printonly:
-            print(json.dumps(self.metaDict, sort_keys=True, indent=4))
+            print(json.dumps(metaDict, sort_keys=True, indent=4))
         else:
             with open(filename, 'w') as fp:
-                json.dump(self.metaDict, fp, sort_keys=True, indent=4)
+                json.dump(metaDict, fp, sort_keys=True, indent=4)
+
+    def writeManifest(self, manifest):
+        """Append the metadata as a single compact record to a JSON-lines manifest file, see readManifest()
+        The record is indexed by its rawfile (or timestamp if no rawfile is set) in manifest + '.idx' for random access,
+        a later record with the same key replaces an earlier one. The index holds fixed size entries of the key hash and
+        record position sorted by hash, followed by up to IDXTAIL entries appended unsorted, see _indexLookup(). An index
+        which does not cover all records of the manifest (e.g. a manifest written before the index) is rebuilt from the
+        manifest first.
+        manifest: str, manifest filename, e.g. from manifestName()
+        """
+        metaDict = self._buildDict()
+        line = (json.dumps(metaDict, sort_keys=True, separators=(',', ':')) + '\n').encode('utf-8')
+        if self.rawfile is None: key = str(self.ts)
+        else: key = self.rawfile
+
+        with open(manifest, 'ab') as fp:
+            _lockFile(fp)
+            try:
+                fp.seek(0, os.SEEK_END)
+                offset = fp.tell()
+                if _indexSpan(manifest + '.idx') != (0, offset): _rebuildManifestIndex(manifest)
+                fp.write(line)
+                fp.flush()
+                _appendManifestIndex(manifest + '.idx', key, offset, len(line))
+            finally:
+                _unlockFile(fp)
+
+    @property
+    def metaDict(self):
+        """metadata dictionary, built on access rather than stored"""
+        return self._buildDict()
+
+    def _rawRecord(self):
+        """Data type and shape of a single integration in the raw data file, defined by each sub class
+        """
+        raise NotImplementedError
+
+    def rawInts(self):
+        """Number of complete integrations in the raw data file
+        """
+        dtype, recshape = self._rawRecord()
+        return _rawInts(self._pathrawfile, dtype, recshape)
+
+    def readRawRange(self, start=0, stop=None):
+        """Read a range of integrations from the raw data file
+        start: int, first integration to read, default: 0
+        stop: int, integration to stop reading at (exclusive), default: None, read to the end of the file
+
+        returns: (nints, ...) numpy array
+        """
+        dtype, recshape = self._rawRecord()
+        return _cached(self._pathrawfile, None, (dtype.str, recshape, start, stop),
+                       lambda: _readRawRange(self._pathrawfile, dtype, recshape, start, stop))
+
+    def rawFingerprint(self, rawfile=None):
+        """Compute the content fingerprint of the raw data file, the hash covers the complete integrations (the data
+        converted to HDF5), writeHDF5() computes the same hash while streaming the raw data
+        rawfile: str, raw data file, default: None, the rawfile of the instance
+
+        returns: (rawhash, rawsize, rawmtime), see setFingerprint()
+        """
+        if rawfile is None: rawfile = self._pathrawfile
+        st = os.stat(rawfile) # before reading, a change during the read shows up as a new mtime next time
+        dtype, recshape = self._rawRecord()
+        hasher = _RawHasher(dtype, recshape)
+        nints = _rawInts(rawfile, dtype, recshape)
+        nblock = _blockInts(dtype, recshape)
+        for i0 in range(0, nints, nblock):
+            hasher.update(_readRawRange(rawfile, dtype, recshape, i0, i0 + nblock))
+        return hasher.hexdigest(), st.st_size, st.st_mtime
+
+    def rawUnchanged(self, rawfile=None):
+        """True if the raw data file matches the stored fingerprint, the raw data is only hashed if the size or
+        modification time differ from the stored ones, on a hash match the size and modification time of the instance
+        are set to the current ones, store them with writeFingerprint() so the file is not hashed again next time
+        rawfile: str, raw data file, default: None, the rawfile of the instance
+
+        returns: boolean, False if no fingerprint is stored
+        """
+        if self.rawhash is None: return False
+        if rawfile is None: rawfile = self._pathrawfile
+        st = os.stat(rawfile)
+        if (st.st_size == self.rawsize) and (st.st_mtime == self.rawmtime): return True
+        rawhash, rawsize, rawmtime = self.rawFingerprint(rawfile)
+        if rawhash != self.rawhash: return False
+        self.setFingerprint(rawhash, rawsize, rawmtime)
+        return True
+
+    def integrationTimes(self, start=0, stop=None):
+        """Start times of the integrations [start, stop), integration i covers [ts + i * integration, ts + (i + 1) * integration)
+        stop: int, default: None, to the end of the raw data file
+
+        returns: datetime64[us] array
+        """
+        if stop is None: stop = self.rawInts()
+        return _toDatetime64(self.ts) + np.arange(start, stop) * _integrationDelta(self.integration)
+
+    def timeIndex(self, start=None, stop=None, nints=None):
+        """Convert a time range to the range of integrations overlapping it,
+        an integration partially inside the range (e.g. a range which is not a multiple of the integration length) is included
+        start: datetime, numpy datetime64 or 'YYYY-MM-DD HH:MM:SS' string, default: None, from the first integration
+        stop: same types as start, end of the range (exclusive), default: None, to the last integration
+        nints: int, number of integrations in the data set, default: None, the number of complete integrations in the raw data file
+
+        returns: (first integration, integration to stop at (exclusive))
+        """
+        if (self.ts is None) or (self.integration is None):
+            raise ValueError('timestamp and integration length are needed to index by time')
+        if nints is None: nints = self.rawInts()
+        return _timeIndex(self.ts, self.integration, nints, start, stop)
+
+    def rawByteRange(self, start=0, stop=None):
+        """Byte range of the integrations [start, stop) in the raw data file
+        stop: int, default: None, to the end of the raw data file
+
+        returns: (byte offset, number of bytes)
+        """
+        dtype, recshape = self._rawRecord()
+        recbytes = int(np.prod(recshape)) * dtype.itemsize
+        if stop is None: stop = self.rawInts()
+        return start * recbytes, (stop - start) * recbytes
+
+    def readTimeRange(self, start=None, stop=None, filename=None):
+        """Read the integrations overlapping a time range, only those integrations are read from the raw data file
+        or the 'data' dataset of an HDF5 file
+        start, stop: time range, see timeIndex()
+        filename: str, HDF5 file to read from, default: None, read from the raw data file
+
+        returns: datetime64[us] array of the integration start times, (nints, ...) numpy array
+        """
+        if filename is None:
+            i0, i1 = self.timeIndex(start, stop)
+            dd = self.readRawRange(i0, i1)
+        else:
+            with openHDF5(filename) as h5:
+                dset = _dataset(h5)
+                i0, i1 = self.timeIndex(start, stop, nints=dset.shape[0])
+                dd = _cached(filename, 'data', (i0, i1), lambda: dset[i0:i1])
+        return self.integrationTimes(i0, i1), dd
+
+    def writeTPC(self, filename, level=6, nthreads=None):
+        """Write metadata and the raw data, losslessly compressed with the time-predictive codec (see tpcEncode()), to a .tpc file
+        filename: str, output .tpc filename
+        level: int, zlib compression level (1-9)
+        nthreads: int, number of encoding threads, default: None, the number of CPUs
+
+        File layout: TPCMAGIC, the codec blocks each preceded by its length (uint64), a JSON footer (metadata dictionary,
+        dtype, shape, blockints and block offsets), the footer length (uint64) and TPCMAGIC, see readTPC()
+        """
+        if self.rawfile is None:
+            print('ERROR: rawfile not set, no data to write to', filename)
+            return 0
+
+        dtype, recshape = self._rawRecord()
+        nints = self.rawInts()
+        st = os.stat(self._pathrawfile)
+        hasher = _RawHasher(dtype, recshape)
+        encoder = _TPCEncoder(dtype, recshape, level, nthreads)
+        offsets = []
+        try:
+            with open(filename, 'wb') as fh:
+                fh.write(TPCMAGIC)
+                nblock = max(1, _blockInts(dtype, recshape) // encoder.blockints) * encoder.blockints
+                for i0 in range(0, nints, nblock):
+                    block = _readRawRange(self._pathrawfile, dtype, recshape, i0, min(i0 + nblock, nints))
+                    hasher.update(block)
+                    for payload in encoder.encode(block):
+                        offsets.append(fh.tell())
+                        fh.write(np.uint64(len(payload)).astype('<u8').tobytes())
+                        fh.write(payload)
+                self.setFingerprint(hasher.hexdigest(), st.st_size, st.st_mtime)
+                footer = json.dumps({'meta': self._buildDict(), 'dtype': dtype.str, 'shape': [nints] + list(recshape),
+                                     'blockints': encoder.blockints, 'offsets': offsets}).encode('utf-8')
+                fh.write(footer)
+                fh.write(np.uint64(len(footer)).astype('<u8').tobytes())
+                fh.write(TPCMAGIC)
+        finally:
+            encoder.close()
+
+        print('TPC: written to', filename)
+
+    def _setHDF5Attrs(self, dset, metaDict):
+        """Write the metadata dictionary to the attributes of an HDF5 dataset
+        """
+        #for key, val in metaDict.iteritems(): # py2 only
+        for key, val in metaDict.items():
+            if val is None: dset.attrs[key] = np.nan
+            else: dset.attrs[key] = val
+
+    def _writeHDF5Extras(self, h5):
+        """Write class specific products derived from the metadata to an open HDF5 file"""
+        pass
+
+    def writeHDF5(self, filename, nworkers=None, stats=False, flags=False, compression=None, shuffle=False, nthreads=None, codec=None):
+        """Write metadata and statistics data to HDF5 file
+        filename: str, output HDF5 filename
+        nworkers: int, number of worker processes, if greater than 1 the raw file is split by integration range into
+            per-worker shard files (filename base + .shardNNN.h5) which are presented as a single 'data' virtual
+            dataset in filename, the shard files must be kept next to filename, shard files of an earlier write of
+            filename which the new file does not use are removed, default: None (single process)
+            The data, fingerprint and flags are the same for any nworkers, the statistics means and variances are
+            merged across shards and are the same up to floating point rounding. Shard edges are aligned to the raw
+            data hash segments (about HASHBYTES of integrations) and flagging time windows, so a small raw file gives
+            fewer shards, and uses fewer worker processes, than nworkers, a warning is printed when it does.
+        The content fingerprint of the raw data file (see rawFingerprint()) is computed while streaming the raw data
+        and written with the metadata.
+        stats: boolean, if true (BST, SST and XST) compute summary statistics over time while streaming the raw data and
+            write them to the 'stats' group, see StreamStats and readStats(), default: False
+        flags: boolean, if true (BST and SST only) generate RFI flags while streaming the raw data and write them
+            bit-packed to the 'flags' dataset, see RFIFlagger and readFlags(), default: False
+        compression: int, gzip compression level (0-9) of the 'data' dataset, chunks are compressed by a pool of threads
+            and written with direct chunk writes, the file is a standard gzip filtered HDF5 file, default: None, no compression
+        shuffle: boolean, apply the HDF5 shuffle filter before gzip compression, default: False
+        nthreads: int, number of compression threads (per worker process), default: None, the number of CPUs
+        codec: str, 'tpc' to store the 'data' dataset with the lossless time-predictive codec (see tpcEncode()) instead of
+            gzip, single process only, overrides compression, default: None
+            The dataset holds one variable length uint8 element per codec block, its attributes give the shape, dtype and
+            block length of the data and the block format (TPCFORMAT), so other tools can read the blocks with HDF5 and
+            decode them with zlib, issformat readers decode it transparently. The compression ratio on SST/BST data is
+            close to shuffle + gzip (benchmarks/codec_ratio.py), use compression for files read by other tools.
+        """
+
+        if not H5SUPPORT:
+            print('ERROR: HDF5 is not supported, you need to install h5py')
+            return 0
+
+        shards = None
+        consumers = [] # block consumers, updated with every block of integrations streamed from the raw file
+        if self.rawfile is None:
+            print('WARNING: rawfile not set, writing HDF5 file with an empty dataset')
+            dd = np.zeros((1,) * len(self._dimLabels)) # place holder TODO: there is probably a better thing to do here
+        else:
+            dtype, recshape = self._rawRecord()
+            nints = self.rawInts()
+            st = os.stat(self._pathrawfile)
+            hasher = _RawHasher(dtype, recshape)
+            if stats:
+                if type(self).__name__ == 'ACC': print('WARNING: ACC files hold a single integration, no summary statistics written')
+                else: consumers.append(StreamStats(recshape))
+            if flags:
+                if len(recshape) == 1: consumers.append(RFIFlagger())
+                else: print('WARNING: RFI flagging is only supported for BST and SST data, no flags written')
+            if len(consumers) > 0:
+                head = self.readRawRange(0, PRIMEINTS)
+                for consumer in consumers: consumer.prime(head)
+            if not (codec is None) and not (nworkers is None) and nworkers > 1:
+                print('WARNING: codec encoded data is written by a single process')
+            elif not (nworkers is None) and nworkers > 1 and nints > 1:
+                if hasattr(h5py, 'VirtualLayout'):
+                    # shard edges on flagging time window boundaries give the same flags as a single process
+                    # and shard edges on hash segment boundaries let each worker hash its own range of the raw file
+                    twin = [consumer.twin for consumer in consumers if isinstance(consumer, RFIFlagger)]
+                    twin = twin[0] if len(twin) > 0 else None
+                    align = int(np.lcm(hasher.segints, twin or 1))
+                    # shards are written before the virtual dataset file is opened so no HDF5 file is open when forking
+                    shards = _writeShards(filename, self._pathrawfile, dtype, recshape, nints, nworkers, consumers + [hasher],
+                                          compression, shuffle, nthreads, align=align, lastalign=twin)
+                else: print('WARNING: h5py does not support virtual datasets, writing HDF5 file with a single process')
+
+        with openHDF5(filename, 'w') as h5:
+            h5.attrs['CLASS'] = type(self).__name__
+
+            if self.rawfile is None:
+                dset = h5.create_dataset('data', shape=dd.shape, dtype=dd.dtype)
+                dset[:] = dd[:]
+            elif shards is None:
+                dset = _createDataset(h5, (nints,) + recshape, dtype, compression, shuffle, codec, self._dimLabels)
+                if not (codec is None): compressor = _TPCWriter(dset, nthreads=nthreads)
+                elif not (dset.chunks is None): compressor = _ChunkCompressor(dset, shuffle, nthreads)
+                else: compressor = None
+                try:
+                    _copyRawToDataset(self._pathrawfile, dtype, recshape, dset, consumers=consumers + [hasher], compressor=compressor)
+                finally:
+                    if not (compressor is None): compressor.close()
+            else:
+                layout = h5py.VirtualLayout(shape=(nints,) + recshape, dtype=dtype)
+                for shardfile, start, stop, shardConsumers in shards:
+                    # relative source file names are resolved from the directory of the virtual dataset file
+                    layout[start:stop] = h5py.VirtualSource(os.path.basename(shardfile), 'data', shape=(stop - start,) + recshape)
+                    for consumer, shardConsumer in zip(consumers + [hasher], shardConsumers): consumer.merge(shardConsumer)
+                dset = h5.create_virtual_dataset('data', layout)
+
+            if codec is None or self.rawfile is None: # codec encoded data keeps the labels in the dimlabels attribute
+                for idx, label in enumerate(self._dimLabels): dset.dims[idx].label = label
+
+            if not (self.rawfile is None): self.setFingerprint(hasher.hexdigest(), st.st_size, st.st_mtime)
+            metaDict = self._buildDict()
+            self._setHDF5Attrs(dset, metaDict)
+            self._writeHDF5Extras(h5)
+
+            for consumer in consumers: consumer.writeHDF5(h5, self._dimLabels[1:])
+
+        _removeStaleShards(filename, [] if shards is None else [shard[0] for shard in shards])
+        print('HDF5: written to', filename)
 
 class ACC(statData):
     """ ACC cross-correlation class
@@ -199,6 +622,9 @@ class ACC(statData):
         nants: int, number of antennas in the array, default: 96
         npol: int, number of polarizations, default: 2
     """
+    __slots__ = ()
+    _dimLabels = ('time', 'subband', 'antpol1', 'antpol2')
+
     def __init__(self, station=None, rcumode=None, ts=None, hbaStr=None, special=None, rawfile=None, integration=1, nants=96, npol=2):
 
         self.setStation(station)
@@ -208,6 +634,7 @@ class ACC(statData):
         self.setSpecial(special)
         self.setRawFile(rawfile)
         self.setIntegration(integration)
+        self.setFingerprint()
         self.setArrayProp(nants, npol)
 
     def printMeta(self):
@@ -216,52 +643,19 @@ class ACC(statData):
         print('NANTS: %i NPOL: %i'%(self.nants, self.npol))
 
     def _buildDict(self):
-        super(ACC, self)._buildDict()
-
-    def writeHDF5(self, filename):
-        """Write metadata and statistics data to HDF5 file
-        filename: str, output HDF5 filename
-        """
-
-        if not H5SUPPORT:
-            print('ERROR: HDF5 is not supported, you need to install h5py')
-            return 0
-
-        if self.rawfile is None:
-            print('WARNING: rawfile not set, writing HDF5 file with an empty dataset')
-            dd = np.zeros((1, 1, 1, 1)) # place holder TODO: there is probably a better thing to do here
-        else:
-            dd = acc2npy(self._pathrawfile, nant=self.nants, npol=self.npol)
-
-        h5 = h5py.File(filename, 'w')
-
-        h5.attrs['CLASS'] = type(self).__name__
-        
-        dset = h5.create_dataset('data',
-                          shape = dd.shape,
-                          dtype = dd.dtype)
-
-        dset.dims[0].label = "time"
-        dset.dims[1].label = "subband"
-        dset.dims[2].label = "antpol1"
-        dset.dims[3].label = "antpol2"
+        return super(ACC, self)._buildDict()
 
-        #for key, val in self.metaDict.iteritems(): #py2 only
-        for key, val in self.metaDict.items():
-            if val is None: dset.attrs[key] = np.nan
-            else: dset.attrs[key] = val
-
-        dset[:] = dd[:]
-
-        h5.close()
-
-        print('HDF5: written to', filename)
+    def _rawRecord(self):
+        return _recordSpec('ACC', nant=self.nants, npol=self.npol)
 
 class BST(statData):
     """ BST beamlet statistics class
 
     Attributes:
     """
+    __slots__ = ('bitmode', 'pol', '_bid', '_btheta', '_bphi', '_bcoord', '_bsb', '_brcus', '_bcoordnames', '_brcusets')
+    _dimLabels = ('time', 'beamlet')
+
     def __init__(self, station=None, rcumode=None, ts=None, hbaStr=None, special=None, rawfile=None, integration=1, pol=None, bitmode=8):
 
         self.setStation(station)
@@ -271,9 +665,10 @@ class BST(statData):
         self.setSpecial(special)
         self.setRawFile(rawfile)
         self.setIntegration(integration)
+        self.setFingerprint()
         self.setBitmode(bitmode)
         self.setPol(pol)
-        self.beamlets = {}
+        self.clearBeamlets()
 
     def setBitmode(self, bitmode=None):
         if bitmode is None:
@@ -282,7 +677,8 @@ class BST(statData):
             self.bitmode = int(bitmode)
 
     def setPol(self, pol=None):
-        self.pol = pol
+        if isinstance(pol, float): self.pol = None # HDF5 version, np.nan
+        else: self.pol = pol
 
     def setBeamlet(self, bid, theta, phi, coord, sb, rcus=None):
         """
@@ -298,20 +694,60 @@ class BST(statData):
 
         if rcus is None: rcus = 'all'
         elif isinstance(rcus, float): rcus = 'all' # HDF5 version, np.nan
-        else: rcus = rcus
+        else: rcus = _rcuValue(rcus)
 
         if type(coord) is str:
             if not(coord.upper() in COORD_SYSTEMS): print('WARNING: coordinate system %s not in defined list of coordinate systems:'%(coord), COORD_SYSTEMS)
             coord = coord.upper()
 
 
-        self.beamlets[bid] = {
-            'theta' : theta,
-            'phi' : phi,
-            'coord' : coord,
-            'sb' : sb,
-            'rcus' : rcus
-        }
+        # beamlets are stored as columns, a beamlet ID which is already set is replaced
+        match = np.flatnonzero(self._bid == bid)
+        if len(match) > 0:
+            idx = match[0]
+        else:
+            idx = len(self._bid)
+            self._bid = np.append(self._bid, np.int16(bid))
+            self._btheta = np.append(self._btheta, 0.)
+            self._bphi = np.append(self._bphi, 0.)
+            self._bcoord = np.append(self._bcoord, np.uint8(0))
+            self._bsb = np.append(self._bsb, np.int16(0))
+            self._brcus = np.append(self._brcus, np.int16(0))
+        self._btheta[idx] = theta
+        self._bphi[idx] = phi
+        self._bcoord[idx] = _tableCode(self._bcoordnames, coord, 256)
+        self._bsb[idx] = sb
+        self._brcus[idx] = _tableCode(self._brcusets, rcus, 2**15)
+
+    def clearBeamlets(self):
+        """Remove all beamlets"""
+        self._bid = np.zeros(0, dtype=np.int16) # beamlet IDs
+        self._btheta = np.zeros(0)
+        self._bphi = np.zeros(0)
+        self._bcoord = np.zeros(0, dtype=np.uint8) # index into _bcoordnames
+        self._bsb = np.zeros(0, dtype=np.int16)
+        self._brcus = np.zeros(0, dtype=np.int16) # index into _brcusets
+        self._bcoordnames = [] # distinct coordinate systems of the beamlets
+        self._brcusets = [] # distinct RCUs of the beamlets, 'all' or an RCU list, usually a single entry
+
+    @property
+    def beamlets(self):
+        """dict of beamlet dicts (theta, phi, coord, sb, rcus) indexed by beamlet ID, built from the beamlet columns,
+        use setBeamlet() to modify beamlets"""
+        return dict((int(self._bid[idx]), {
+            'theta' : float(self._btheta[idx]),
+            'phi' : float(self._bphi[idx]),
+            'coord' : self._bcoordnames[self._bcoord[idx]],
+            'sb' : int(self._bsb[idx]),
+            'rcus' : copy.copy(self._brcusets[self._brcus[idx]])
+        }) for idx in range(len(self._bid)))
+
+    def beamletIndex(self):
+        """Grouping index of the beamlets by pointing and subband, see BeamletIndex
+
+        returns: BeamletIndex instance
+        """
+        return BeamletIndex.fromColumns(self._bid, self._btheta, self._bphi, self._bcoord, self._bsb, self._bcoordnames)
 
     def printMeta(self):
         super(BST, self).printMeta()
@@ -324,39 +760,21 @@ class BST(statData):
             print('BEAMLET%i'%key, val)
 
     def _buildDict(self):
-        super(BST, self)._buildDict()
-        self.metaDict['bitmode'] = self.bitmode
-        self.metaDict['beamlets'] = self.beamlets
-        self.metaDict['pol'] = self.pol
-
-    def writeHDF5(self, filename):
-        """Write metadata and statistics data to HDF5 file
-        filename: str, output HDF5 filename
-        """
-
-        if not H5SUPPORT:
-            print('ERROR: HDF5 is not supported, you need to install h5py')
-            return 0
+        metaDict = super(BST, self)._buildDict()
+        metaDict['bitmode'] = self.bitmode
+        metaDict['beamlets'] = self.beamlets
+        metaDict['pol'] = self.pol
+        return metaDict
 
-        if self.rawfile is None:
-            print('WARNING: rawfile not set, writing HDF5 file with an empty dataset')
-            dd = np.zeros((1, 1)) # place holder TODO: there is probably a better thing to do here
-        else:
-            dd = bst2npy(self._pathrawfile, bitmode=self.bitmode)
+    def _rawRecord(self):
+        return _recordSpec('BST', bitmode=self.bitmode)
 
-        h5 = h5py.File(filename, 'w')
+    def _writeHDF5Extras(self, h5):
+        if len(self._bid) > 0: self.beamletIndex().writeHDF5(h5)
 
-        h5.attrs['CLASS'] = type(self).__name__
-        
-        dset = h5.create_dataset('data',
-                          shape = dd.shape,
-                          dtype = dd.dtype)
-
-        dset.dims[0].label = "time"
-        dset.dims[1].label = "beamlet"
-
-        #for key, val in self.metaDict.iteritems(): # py2 only
-        for key, val in self.metaDict.items():
+    def _setHDF5Attrs(self, dset, metaDict):
+        #for key, val in metaDict.iteritems(): # py2 only
+        for key, val in metaDict.items():
             if val is None: dset.attrs[key] = np.nan
             elif key.startswith('beamlets'): # the beamlet dicts need to be unwound to store as HDF5 attributes
                 #for bkey, bval in val.iteritems(): # py2 only
@@ -370,17 +788,127 @@ class BST(statData):
                     else: dset.attrs['beamlet%03i_rcus'%bkey] = bval['rcus']
             else: dset.attrs[key] = val
 
-        dset[:] = dd[:]
+class BeamletIndex(object):
+    """ Grouping index of BST beamlets by pointing and subband, built from the beamlet metadata, see BST.beamletIndex()
 
-        h5.close()
+    The beamlets are ordered by pointing, then subband, the beamlets of pointing p are the data columns
+    columns[offsets[p]:offsets[p + 1]] observing subbands[offsets[p]:offsets[p + 1]].
 
-        print('HDF5: written to', filename)
+    Attributes:
+        pointings: list of (theta, phi, coord) tuples
+        offsets: (npointings + 1,) int array
+        columns: (nbeamlets,) int array, beamlet IDs, i.e. data columns
+        subbands: (nbeamlets,) int array, subband of each beamlet in columns
+    """
+    def __init__(self, pointings, offsets, columns, subbands):
+        self.pointings = [(float(theta), float(phi), str(coord)) for theta, phi, coord in pointings]
+        self.offsets = np.asarray(offsets, dtype=int)
+        self.columns = np.asarray(columns, dtype=int)
+        self.subbands = np.asarray(subbands, dtype=int)
+
+    @classmethod
+    def fromColumns(cls, bid, theta, phi, coord, sb, coordnames):
+        """Build the index from beamlet columns (beamlet ID, pointing theta, phi, coordinate system code, subband)
+        coordnames: list of the coordinate system of each code
+        """
+        ptab = np.zeros(len(bid), dtype=[('coord', np.uint8), ('theta', float), ('phi', float)])
+        names = sorted(coordnames)
+        rank = np.array([names.index(name) for name in coordnames], dtype=np.uint8) # pointings are ordered by name
+        ptab['coord'], ptab['theta'], ptab['phi'] = rank[np.asarray(coord, dtype=int)], theta, phi
+        uniq, pid = np.unique(ptab, return_inverse=True)
+        pid = np.ravel(pid)
+        order = np.lexsort((bid, sb, pid))
+        offsets = np.searchsorted(pid[order], np.arange(len(uniq) + 1))
+        pointings = [(p['theta'], p['phi'], names[p['coord']]) for p in uniq]
+        return cls(pointings, offsets, np.asarray(bid)[order], np.asarray(sb)[order])
+
+    def __len__(self):
+        return len(self.pointings)
+
+    def pointing(self, theta, phi=None, coord=None):
+        """Index of a pointing
+        theta: float, or a (theta, phi, coord) tuple, or an int pointing index which is returned as is
+        phi, coord: float and str, needed if theta is a float
+        """
+        if phi is None and coord is None:
+            if isinstance(theta, (int, np.integer)): return int(theta)
+            if not (isinstance(theta, (tuple, list)) and len(theta) == 3):
+                raise ValueError('a pointing is an int index, a (theta, phi, coord) tuple or theta, phi and coord, not %s'%repr(theta))
+            theta, phi, coord = theta
+        elif phi is None or coord is None:
+            raise ValueError('theta, phi and coord are all needed to select a pointing')
+        key = (float(theta), float(phi), str(coord).upper())
+        if not (key in self.pointings): raise KeyError('no beamlets with pointing (%f, %f, %s)'%key)
+        return self.pointings.index(key)
+
+    def beamlets(self, pointing):
+        """Beamlets of a pointing, ordered by subband
+        pointing: pointing index or (theta, phi, coord) tuple
+
+        returns: (nsb,) int array of the data columns, (nsb,) int array of the subbands
+        """
+        p = self.pointing(pointing)
+        return self.columns[self.offsets[p]:self.offsets[p + 1]], self.subbands[self.offsets[p]:self.offsets[p + 1]]
+
+    def subband(self, sb):
+        """Data columns of the beamlets observing a subband, ordered by pointing
+
+        returns: int array
+        """
+        return self.columns[self.subbands == sb]
+
+    def _select(self, pointings=None):
+        """Pointing indices, concatenated data columns and per-pointing lengths of a selection of pointings"""
+        if pointings is None: sel = list(range(len(self.pointings)))
+        else: sel = [self.pointing(p) for p in pointings]
+        cols = [self.columns[self.offsets[p]:self.offsets[p + 1]] for p in sel]
+        if len(cols) == 0: return sel, np.zeros(0, dtype=int), []
+        return sel, np.concatenate(cols), [len(c) for c in cols]
+
+    @staticmethod
+    def _split(gathered, lengths):
+        return np.split(gathered, np.cumsum(lengths)[:-1], axis=-1) if len(lengths) > 0 else []
+
+    def spectra(self, dd, pointings=None):
+        """Per-pointing spectra of BST data with a single gather of the beamlet columns
+        dd: (nints, nbeamlets) float array, see bst2npy()
+        pointings: list of pointing indices or (theta, phi, coord) tuples, default: None, all pointings
+
+        returns: list of (nints, nsb) arrays, one per pointing, the columns are ordered by subband, see beamlets()
+        """
+        sel, cols, lengths = self._select(pointings)
+        return self._split(np.take(dd, cols, axis=-1), lengths)
+
+    def writeHDF5(self, h5):
+        """Write the index to the 'beamletindex' group of an open HDF5 file, replacing an existing index"""
+        if 'beamletindex' in h5: del h5['beamletindex']
+        grp = h5.create_group('beamletindex')
+        grp.create_dataset('theta', data=np.array([p[0] for p in self.pointings], dtype=float))
+        grp.create_dataset('phi', data=np.array([p[1] for p in self.pointings], dtype=float))
+        grp.attrs['coord'] = [p[2] for p in self.pointings]
+        grp.create_dataset('offsets', data=self.offsets.astype(np.int32))
+        grp.create_dataset('columns', data=self.columns.astype(np.int16))
+        grp.create_dataset('subbands', data=self.subbands.astype(np.int16))
+
+    @classmethod
+    def readHDF5(cls, h5):
+        """Read the index from an open HDF5 file
+
+        returns: BeamletIndex instance, None if the file has no index
+        """
+        if not ('beamletindex' in h5): return None
+        grp = h5['beamletindex']
+        coords = [c.decode('utf-8') if isinstance(c, bytes) else c for c in grp.attrs['coord']]
+        return cls(zip(grp['theta'][()], grp['phi'][()], coords), grp['offsets'][()], grp['columns'][()], grp['subbands'][()])
 
 class SST(statData):
     """ SST subband statistics class
 
     Attributes:
     """
+    __slots__ = ('rcu',)
+    _dimLabels = ('time', 'subband')
+
     def __init__(self, station=None, rcumode=None, ts=None, hbaStr=None, special=None, rawfile=None, integration=1, rcu=None):
 
         self.setStation(station)
@@ -390,11 +918,14 @@ class SST(statData):
         self.setSpecial(special)
         self.setRawFile(rawfile)
         self.setIntegration(integration)
+        self.setFingerprint()
         self.setRCU(rcu)
 
     def setRCU(self, rcu=None):
         if rcu is None:
             self.rcu = None
+        elif isinstance(rcu, float) and np.isnan(rcu): # HDF5 version
+            self.rcu = None
         elif type(rcu) is np.int64: # HDF5 version
             self.rcu = int(rcu)
         else: # RCU ID
@@ -405,51 +936,21 @@ class SST(statData):
         print('RCU:', self.rcu)
 
     def _buildDict(self):
-        super(SST, self)._buildDict()
-        self.metaDict['rcu'] = self.rcu
-
-    def writeHDF5(self, filename):
-        """Write metadata and statistics data to HDF5 file
-        filename: str, output HDF5 filename
-        """
-
-        if not H5SUPPORT:
-            print('ERROR: HDF5 is not supported, you need to install h5py')
-            return 0
-
-        if self.rawfile is None:
-            print('WARNING: rawfile not set, writing HDF5 file with an empty dataset')
-            dd = np.zeros((1, 1)) # place holder TODO: there is probably a better thing to do here
-        else:
-            dd = sst2npy(self._pathrawfile)
-
-        h5 = h5py.File(filename, 'w')
-
-        h5.attrs['CLASS'] = type(self).__name__
-        
-        dset = h5.create_dataset('data',
-                          shape = dd.shape,
-                          dtype = dd.dtype)
-
-        dset.dims[0].label = "time"
-        dset.dims[1].label = "subband"
-
-        #for key, val in self.metaDict.iteritems(): # py2 only
-        for key, val in self.metaDict.items():
-            if val is None: dset.attrs[key] = np.nan
-            else: dset.attrs[key] = val
+        metaDict = super(SST, self)._buildDict()
+        metaDict['rcu'] = self.rcu
+        return metaDict
 
-        dset[:] = dd[:]
-
-        h5.close()
-
-        print('HDF5: written to', filename)
+    def _rawRecord(self):
+        return _recordSpec('SST')
 
 class XST(statData):
     """ XST cross-correlation class
 
     Attributes:
     """
+    __slots__ = ('sb',)
+    _dimLabels = ('time', 'subband', 'antpol1', 'antpol2')
+
     def __init__(self, station=None, rcumode=None, ts=None, hbaStr=None, special=None, rawfile=None, integration=None, sb=None, nants=96, npol=2):
 
         self.setStation(station)
@@ -459,12 +960,15 @@ class XST(statData):
         self.setSpecial(special)
         self.setRawFile(rawfile)
         self.setIntegration(integration)
+        self.setFingerprint()
         self.setSubband(sb)
         self.setArrayProp(nants, npol)
 
     def setSubband(self, sb=None):
         if sb is None:
             self.sb = None
+        elif isinstance(sb, float) and np.isnan(sb): # HDF5 version
+            self.sb = None
         else: # subband ID
             self.sb = int(sb)
 
@@ -475,47 +979,267 @@ class XST(statData):
         print('NANTS: %i NPOL: %i'%(self.nants, self.npol))
 
     def _buildDict(self):
-        super(XST, self)._buildDict()
-        self.metaDict['subband'] = self.sb
+        metaDict = super(XST, self)._buildDict()
+        metaDict['subband'] = self.sb
+        return metaDict
 
-    def writeHDF5(self, filename):
-        """Write metadata and statistics data to HDF5 file
-        filename: str, output HDF5 filename
-        """
+    def _rawRecord(self):
+        return _recordSpec('XST', nant=self.nants, npol=self.npol)
 
-        if not H5SUPPORT:
-            print('ERROR: HDF5 is not supported, you need to install h5py')
-            return 0
+class StreamStats(object):
+    """ Streaming summary statistics over time of each channel (subband, beamlet or baseline) of a statistics data set
 
-        if self.rawfile is None:
-            print('WARNING: rawfile not set, writing HDF5 file with an empty dataset')
-            dd = np.zeros((1, 1, 1, 1)) # place holder TODO: there is probably a better thing to do here
-        else:
-            dd = xst2npy(self._pathrawfile, nant=self.nants, npol=self.npol)
+    Statistics are accumulated block by block of integrations so the data set never needs to be in memory at once.
+    Complex (correlation) data is summarised by its amplitude.
 
-        h5 = h5py.File(filename, 'w')
+    Attributes:
+        count: int, number of integrations accumulated
+        mean, var, min, max: running mean, variance, minimum and maximum per channel
+        levels: quantile levels estimated from a per-channel histogram of log10 values
+        nbins: int, number of histogram bins per channel, the quantile resolution is 2 * ndex / nbins in log10
+        ndex: float, the histogram covers +/- ndex decades around the median of the priming integrations
+    """
+    def __init__(self, chanshape, levels=(0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99), nbins=256, ndex=3., maxcounts=2**26):
+        """
+        chanshape: tuple, shape of a single integration
+        maxcounts: int, quantiles are not estimated if the histogram would be larger than this number of counts (e.g. XST)
+        """
+        self.chanshape = tuple(chanshape)
+        self.levels = np.array(levels, dtype=float)
+        self.nbins = nbins
+        self.ndex = ndex
+        self.count = 0
+        nchan = int(np.prod(self.chanshape))
+        self.mean = np.zeros(nchan)
+        self._m2 = np.zeros(nchan) # sum of squared differences from the mean
+        self.min = np.full(nchan, np.inf)
+        self.max = np.full(nchan, -np.inf)
+        if nchan * nbins > maxcounts:
+            print('WARNING: %i channels is too many to estimate quantiles, only moments and extrema are computed'%nchan)
+            self.hist = None
+        else: self.hist = np.zeros(nchan * nbins, dtype=np.uint32)
+        self._lo = None # per-channel lower edge of the histogram in log10
+
+    def _values(self, block):
+        """(nints, nchan) real values of a block"""
+        block = np.reshape(block, (block.shape[0], int(np.prod(self.chanshape))))
+        if np.iscomplexobj(block): return np.abs(block)
+        else: return block.astype(float, copy=False)
+
+    def prime(self, block):
+        """Set the histogram range of each channel from the first integrations of the data set, an empty block
+        (a data set without integrations) is ignored"""
+        if block.shape[0] == 0: return
+        with np.errstate(divide='ignore', invalid='ignore'):
+            center = np.log10(np.median(self._values(block), axis=0))
+        center[~np.isfinite(center)] = 0.
+        self._lo = center - self.ndex
+
+    def update(self, block):
+        """Accumulate a (nints, ...) block of integrations"""
+        vals = self._values(block)
+        nb = vals.shape[0]
+        if nb == 0: return
+        if self._lo is None: self.prime(block)
+
+        # Chan et al. parallel update of the mean and variance
+        bmean = vals.mean(axis=0)
+        bm2 = ((vals - bmean)**2).sum(axis=0)
+        delta = bmean - self.mean
+        ntot = self.count + nb
+        self.mean += delta * nb / ntot
+        self._m2 += bm2 + delta**2 * self.count * nb / ntot
+        self.count = ntot
+
+        self.min = np.minimum(self.min, vals.min(axis=0))
+        self.max = np.maximum(self.max, vals.max(axis=0))
+
+        if not (self.hist is None):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                idx = np.floor((np.log10(vals) - self._lo) * (self.nbins / (2. * self.ndex)))
+            idx = np.clip(np.nan_to_num(idx, nan=0., neginf=0.), 0, self.nbins - 1).astype(np.intp)
+            idx += np.arange(vals.shape[1]) * self.nbins
+            self.hist += np.bincount(idx.ravel(), minlength=self.hist.size).astype(np.uint32)
+
+    def merge(self, other):
+        """Merge the statistics accumulated by another StreamStats instance primed with the same integrations"""
+        if other.count == 0: return
+        delta = other.mean - self.mean
+        ntot = self.count + other.count
+        self.mean += delta * other.count / ntot
+        self._m2 += other._m2 + delta**2 * self.count * other.count / ntot
+        self.count = ntot
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        if not (self.hist is None): self.hist += other.hist
+
+    @property
+    def var(self):
+        return self._m2 / max(self.count, 1)
+
+    def quantiles(self):
+        """Estimate the quantiles at self.levels from the histograms, linearly interpolated in log10 within a bin
+
+        returns: (nlevels, nchan) array
+        """
+        nchan = self.mean.size
+        if (self.hist is None) or (self.count == 0): return np.full((self.levels.size, nchan), np.nan)
+        hist = self.hist.reshape(nchan, self.nbins)
+        cdf = np.cumsum(hist, axis=1)
+        width = 2. * self.ndex / self.nbins
+        qs = np.empty((self.levels.size, nchan))
+        for lid, level in enumerate(self.levels):
+            target = level * self.count
+            idx = np.minimum((cdf < target).sum(axis=1), self.nbins - 1)
+            below = np.where(idx > 0, cdf[np.arange(nchan), idx - 1], 0)
+            frac = np.clip((target - below) / np.maximum(hist[np.arange(nchan), idx], 1), 0., 1.)
+            qs[lid] = 10.**(self._lo + (idx + frac) * width)
+        return np.clip(qs, self.min, self.max) # the end bins also hold the clipped out of range values
+
+    def writeHDF5(self, h5, dimLabels=()):
+        """Write the statistics to the 'stats' group of an open HDF5 file
+        dimLabels: list of str, dimension labels of a single integration
+        """
+        grp = h5.create_group('stats')
+        grp.attrs['count'] = self.count
+        grp.attrs['levels'] = self.levels
+        moments = [('mean', self.mean), ('var', self.var), ('min', self.min), ('max', self.max)]
+        if self.count == 0: moments = [(key, np.full_like(val, np.nan)) for key, val in moments] # no integrations
+        for key, val in moments:
+            dset = grp.create_dataset(key, data=np.reshape(val, self.chanshape))
+            for idx, label in enumerate(dimLabels): dset.dims[idx].label = label
+        dset = grp.create_dataset('quantiles', data=np.reshape(self.quantiles(), (self.levels.size,) + self.chanshape))
+        dset.dims[0].label = 'level'
+        for idx, label in enumerate(dimLabels): dset.dims[idx + 1].label = label
+
+MADSCALE = 1.4826 # median absolute deviation to standard deviation of a normal distribution
+
+def _median(x, axis):
+    """Lower median along an axis, keeping the axis, a single partition is much faster than numpy.median
+    """
+    k = (x.shape[axis] - 1) // 2
+    return np.take(np.partition(x, k, axis=axis), [k], axis=axis)
 
-        h5.attrs['CLASS'] = type(self).__name__
-        
-        dset = h5.create_dataset('data',
-                          shape = dd.shape,
-                          dtype = dd.dtype)
+def _madOutliers(x, axis, threshold):
+    """Flag values of x further than threshold robust standard deviations (MAD based) from the median along an axis
+    """
+    med = _median(x, axis)
+    dev = np.abs(x - med)
+    limit = _median(dev, axis)
+    limit *= threshold * MADSCALE
+    limit[limit == 0] = np.inf # a constant window has no outliers
+    return dev > limit, med
 
-        dset.dims[0].label = "time"
-        dset.dims[1].label = "subband"
-        dset.dims[2].label = "antpol1"
-        dset.dims[3].label = "antpol2"
+def _windowSpans(n, win):
+    """Split n samples into windows of win samples, the last window also holds the left over samples
 
-        #for key, val in self.metaDict.iteritems(): # py2 only
-        for key, val in self.metaDict.items():
-            if val is None: dset.attrs[key] = np.nan
-            else: dset.attrs[key] = val
+    returns: list of (start, stop, number of windows) spans of equal sized windows
+    """
+    nw = max(1, n // win)
+    spans = [(0, (nw - 1) * win, nw - 1), ((nw - 1) * win, n, 1)]
+    return [span for span in spans if span[1] > span[0]]
 
-        dset[:] = dd[:]
+def rfiFlags(dd, twin=64, fwin=32, threshold=5.):
+    """Vectorised robust RFI flagging of BST or SST power data
 
-        h5.close()
+    Each channel is flagged against the median and MAD of windows of twin integrations, then the spectra are
+    divided by the per-window channel medians (removing the bandpass) and flagged against the median and MAD of
+    windows of fwin channels.
 
-        print('HDF5: written to', filename)
+    dd: (nints, nchan) float array, BST or SST data
+    twin: int, number of integrations in a time window
+    fwin: int, number of channels in a frequency window
+    threshold: float, flagging threshold in robust standard deviations
+
+    returns: (nints, nchan) boolean array, True is flagged
+    """
+    dd = np.asarray(dd, dtype=np.float32) # single precision is plenty for flagging and halves the memory traffic
+    nints, nchan = dd.shape
+    flags = np.empty(dd.shape, dtype=bool)
+    norm = np.empty(dd.shape, dtype=np.float32)
+
+    for t0, t1, nw in _windowSpans(nints, twin):
+        win = dd[t0:t1].reshape(nw, -1, nchan)
+        wflags, med = _madOutliers(win, 1, threshold)
+        flags[t0:t1] = wflags.reshape(-1, nchan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(win, med, out=norm[t0:t1].reshape(nw, -1, nchan))
+    norm[~np.isfinite(norm)] = 0.
+
+    for c0, c1, nw in _windowSpans(nchan, fwin):
+        win = norm[:, c0:c1].reshape(nints, nw, -1)
+        wflags, med = _madOutliers(win, 2, threshold)
+        flags[:, c0:c1] |= wflags.reshape(nints, -1)
+
+    return flags
+
+class RFIFlagger(object):
+    """ Streaming RFI flag generation for BST and SST data, see rfiFlags()
+
+    Integrations are flagged in the same time windows as rfiFlags() on the whole data set, whatever the block sizes:
+    the integrations of an incomplete time window are kept until the next block, the last window of the data set,
+    which also holds the left over integrations, is flagged by finish(). Flags are bit-packed along the channel axis
+    (numpy.packbits, big bit order) and kept until written to the 'flags' dataset of an HDF5 file.
+
+    Attributes:
+        twin, fwin, threshold: rfiFlags() parameters
+        packed: list of (nints, ceil(nchan/8)) uint8 arrays, packed flags of each flagged run of windows
+        pending: (nints, nchan) array of the integrations not flagged yet, None if there are none
+        nchan: int, number of channels
+    """
+    def __init__(self, twin=64, fwin=32, threshold=5.):
+        self.twin = twin
+        self.fwin = fwin
+        self.threshold = threshold
+        self.packed = []
+        self.pending = None
+        self.nchan = None
+
+    def prime(self, block):
+        self.nchan = block.shape[1]
+
+    def update(self, block):
+        """Flag the complete time windows of a (nints, nchan) block of integrations and those kept from earlier blocks,
+        the last complete window is kept as it can absorb the left over integrations at the end of the data set"""
+        if block.shape[0] == 0: return
+        self.nchan = block.shape[1]
+        if self.pending is None: self.pending = np.array(block, dtype=np.float32)
+        else: self.pending = np.concatenate([self.pending, np.asarray(block, dtype=np.float32)], axis=0)
+        nw = self.pending.shape[0] // self.twin - 1
+        if nw > 0:
+            self._flag(self.pending[:nw * self.twin])
+            self.pending = self.pending[nw * self.twin:].copy()
+
+    def _flag(self, dd):
+        self.packed.append(np.packbits(rfiFlags(dd, self.twin, self.fwin, self.threshold), axis=1))
+
+    def finish(self):
+        """Flag the kept integrations as the last time window of the data set"""
+        if not (self.pending is None): self._flag(self.pending)
+        self.pending = None
+
+    def merge(self, other):
+        """Append the flags of another RFIFlagger instance which flagged the following integrations, the integrations
+        flagged by self must be a whole number of time windows, see _writeShards()"""
+        self.finish()
+        other.finish()
+        if not (other.nchan is None): self.nchan = other.nchan
+        self.packed.extend(other.packed)
+
+    def writeHDF5(self, h5, dimLabels=()):
+        """Write the bit-packed flags to the 'flags' dataset of an open HDF5 file
+        dimLabels: list of str, dimension labels of a single integration
+        """
+        self.finish()
+        if len(self.packed) > 0: packed = np.concatenate(self.packed, axis=0)
+        else: packed = np.zeros((0, ((self.nchan or 0) + 7) // 8), dtype=np.uint8) # no integrations
+        dset = h5.create_dataset('flags', data=packed)
+        dset.attrs['nchan'] = 0 if self.nchan is None else self.nchan
+        dset.attrs['twin'] = self.twin
+        dset.attrs['fwin'] = self.fwin
+        dset.attrs['threshold'] = self.threshold
+        dset.dims[0].label = 'time'
+        if len(dimLabels) > 0: dset.dims[1].label = dimLabels[0] + '_packed'
 
 def printHBAtile(hbaStr):
     """Print active HBA tile elements based on hex string
@@ -525,6 +1249,118 @@ def printHBAtile(hbaStr):
         print('%s {0:4b} |'.format(int(hbaStr[row],16))%(hbaStr[row]))
     print('________')
 
+def _fileSignature(path):
+    """Signature of the content of a file (device, inode, size, modification and change time), the nanosecond times and
+    the change time (updated by any write, also if the modification time is restored) catch in-place rewrites of the
+    same size within the modification time resolution
+    """
+    st = os.stat(path)
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+
+class HDF5Pool(object):
+    """ Bounded pool of open HDF5 files
+
+    Files opened read-only are kept open after use and shared, so metadata scans and lazy reads which touch the same
+    files repeatedly do not pay the open cost, the least recently used idle files are closed when more than maxfiles
+    are open. A pooled file which was replaced or modified since it was opened (inode, size, modification or change time
+    differ) is reopened. Files opened for writing are not pooled, they are closed at the end of the with block, an idle
+    pooled handle of the same file is closed first.
+    Pooled files are opened without HDF5 file locking so other processes can rewrite them, a file rewritten by
+    another process while it is being read gives undefined results.
+
+    Attributes:
+        maxfiles: int, maximum number of idle files kept open
+        opens, reuses: int, pool statistics
+    """
+    def __init__(self, maxfiles=64):
+        self.maxfiles = maxfiles
+        self.opens = 0
+        self.reuses = 0
+        self._files = collections.OrderedDict() # absolute path: [h5py.File, file signature, number of users]
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _checkFork(self):
+        if self._pid != os.getpid(): # handles inherited from the parent process are left to the parent
+            self._files = collections.OrderedDict()
+            self._pid = os.getpid()
+
+    def _evict(self):
+        for path in list(self._files.keys()):
+            if len(self._files) <= self.maxfiles: break
+            if self._files[path][2] == 0: self._files.pop(path)[0].close()
+
+    @staticmethod
+    def _openRead(filename):
+        # pooled files stay open, without HDF5 file locking they do not block other processes from rewriting the file
+        try: return h5py.File(filename, 'r', locking=False)
+        except TypeError: return h5py.File(filename, 'r') # h5py < 3.5
+
+    @contextlib.contextmanager
+    def open(self, filename, mode='r'):
+        """Context manager returning an open h5py.File, e.g. with pool.open(filename) as h5: ...
+        filename: str, path to HDF5
+        mode: str, h5py file mode, only 'r' handles are pooled
+        """
+        path = os.path.abspath(filename)
+        if mode != 'r':
+            with self._lock:
+                self._checkFork()
+                entry = self._files.get(path)
+                if not (entry is None):
+                    if entry[2] > 0: raise IOError('%s is open for reading, it can not be opened with mode %s'%(filename, mode))
+                    del self._files[path]
+                    entry[0].close()
+            h5 = h5py.File(filename, mode)
+            try: yield h5
+            finally: h5.close()
+            return
+
+        with self._lock:
+            self._checkFork()
+            sig = _fileSignature(path)
+            entry = self._files.pop(path, None)
+            if not (entry is None) and entry[1] != sig and entry[2] == 0: # changed on disk, reopen
+                entry[0].close()
+                entry = None
+            if entry is None:
+                entry = [self._openRead(filename), sig, 0]
+                self.opens += 1
+            else: self.reuses += 1
+            entry[2] += 1
+            self._files[path] = entry # most recently used files are at the end
+        try: yield entry[0]
+        finally:
+            with self._lock:
+                entry[2] -= 1
+                self._evict()
+
+    def closeAll(self):
+        """Close all idle pooled files"""
+        with self._lock:
+            self._checkFork()
+            for path in list(self._files.keys()):
+                if self._files[path][2] == 0: self._files.pop(path)[0].close()
+
+_hdf5Pool = HDF5Pool() # used for all HDF5 file access of the module
+
+def openHDF5(filename, mode='r'):
+    """Open an HDF5 file through the module HDF5 file pool, use as a context manager:
+    with openHDF5(filename) as h5: ...
+
+    returns: context manager of an h5py.File
+    """
+    return _hdf5Pool.open(filename, mode)
+
+def configureHDF5Pool(maxfiles=64):
+    """Set the number of idle HDF5 files kept open by the module file pool, 0 closes files after every use
+
+    returns: HDF5Pool instance
+    """
+    _hdf5Pool.maxfiles = maxfiles
+    with _hdf5Pool._lock: _hdf5Pool._evict()
+    return _hdf5Pool
+
 def readJSON(filename):
     """Read a JSON-formatted metadata file
 
@@ -535,6 +1371,13 @@ def readJSON(filename):
     with open(filename, 'r') as fp:
         metaDict = json.load(fp)
 
+    return _fromDict(metaDict)
+
+def _fromDict(metaDict):
+    """Build a statData class instance from a metadata dictionary, see statData._buildDict()
+
+    returns: statData class instance
+    """
     if metaDict['datatype'] == 'ACC':
         s = ACC()
     if metaDict['datatype'] == 'BST':
@@ -554,11 +1397,12 @@ def readJSON(filename):
     s.setIntegration(metaDict['integration'])
     s.setStation(metaDict['station'])
     s.setRCUmode(metaDict['rcumode'])
-    s.setTimestamp(datetime.datetime.strptime(metaDict['timestamp'], '%Y-%m-%d %H:%M:%S'))
+    if metaDict['timestamp'] != 'None': s.setTimestamp(datetime.datetime.strptime(metaDict['timestamp'], '%Y-%m-%d %H:%M:%S'))
     s.setHBAelements(metaDict['hbaelements'])
     s.setSpecial(metaDict['special'])
 
     s.setRawFile(metaDict['rawfile'])
+    s.setFingerprint(metaDict.get('rawhash'), metaDict.get('rawsize'), metaDict.get('rawmtime'))
 
     return s
 
@@ -574,169 +1418,1938 @@ def readHDF5(filename, getdata=False):
         print('ERROR: HDF5 is not supported, you need to install h5py')
         return 0
 
-    h5 = h5py.File(filename, 'r')
-    
-    if h5.attrs['CLASS']=='ACC':
-        s = ACC(station = h5['data'].attrs['station'],
-                rcumode = h5['data'].attrs['rcumode'],
-                ts = h5['data'].attrs['timestamp'],
-                hbaStr = h5['data'].attrs['hbaelements'],
-                special = h5['data'].attrs['special'],
-                rawfile = h5['data'].attrs['rawfile'],
-                integration = h5['data'].attrs['integration'])
-
-    elif h5.attrs['CLASS']=='BST':
-        s = BST(station = h5['data'].attrs['station'],
-                rcumode = h5['data'].attrs['rcumode'],
-                ts = h5['data'].attrs['timestamp'],
-                hbaStr = h5['data'].attrs['hbaelements'],
-                special = h5['data'].attrs['special'],
-                rawfile = h5['data'].attrs['rawfile'],
-                integration = h5['data'].attrs['integration'],
-                pol = h5['data'].attrs['pol'],
-                bitmode = h5['data'].attrs['bitmode'])
-
-        # Find all the beamlets
-        #for bkey in h5['data'].attrs.iterkeys(): # py2 only
-        for bkey in h5['data'].attrs.keys():
-            if bkey.endswith('_coord'): # a beamlet
-                bid = int(bkey[7:10])
-                s.setBeamlet(bid, theta = h5['data'].attrs['beamlet%03i_theta'%bid],
-                                  phi = h5['data'].attrs['beamlet%03i_phi'%bid],
-                                  coord = h5['data'].attrs['beamlet%03i_coord'%bid],
-                                  sb = h5['data'].attrs['beamlet%03i_sb'%bid],
-                                  rcus=h5['data'].attrs['beamlet%03i_rcus'%bid])
-
-    elif h5.attrs['CLASS']=='SST':
-        s = SST(station = h5['data'].attrs['station'],
-                rcumode = h5['data'].attrs['rcumode'],
-                ts = h5['data'].attrs['timestamp'],
-                hbaStr = h5['data'].attrs['hbaelements'],
-                special = h5['data'].attrs['special'],
-                rawfile = h5['data'].attrs['rawfile'],
-                rcu = h5['data'].attrs['rcu'])
-
-    elif h5.attrs['CLASS']=='XST':
-        s = XST(station = h5['data'].attrs['station'],
-                rcumode = h5['data'].attrs['rcumode'],
-                ts = h5['data'].attrs['timestamp'],
-                hbaStr = h5['data'].attrs['hbaelements'],
-                special = h5['data'].attrs['special'],
-                rawfile = h5['data'].attrs['rawfile'],
-                integration = h5['data'].attrs['integration'],
-                sb = h5['data'].attrs['subband'])
-    else:
-        print('ERROR: unknown class type')
-        return 0
-    
-    if getdata: dd = np.array(h5['data'])
+    with openHDF5(filename) as h5:
+        if 'data' in h5: attrs = h5['data'].attrs
+        else: attrs = h5['products'].attrs # polarisation products only, see polProductsHDF5()
+
+        if h5.attrs['CLASS']=='ACC':
+            s = ACC(station = attrs['station'],
+                    rcumode = attrs['rcumode'],
+                    ts = attrs['timestamp'],
+                    hbaStr = attrs['hbaelements'],
+                    special = attrs['special'],
+                    rawfile = attrs['rawfile'],
+                    integration = attrs['integration'])
+
+        elif h5.attrs['CLASS']=='BST':
+            s = BST(station = attrs['station'],
+                    rcumode = attrs['rcumode'],
+                    ts = attrs['timestamp'],
+                    hbaStr = attrs['hbaelements'],
+                    special = attrs['special'],
+                    rawfile = attrs['rawfile'],
+                    integration = attrs['integration'],
+                    pol = attrs['pol'],
+                    bitmode = attrs['bitmode'])
+
+            # Find all the beamlets
+            #for bkey in attrs.iterkeys(): # py2 only
+            for bkey in attrs.keys():
+                if bkey.endswith('_coord'): # a beamlet
+                    bid = int(bkey[7:10])
+                    s.setBeamlet(bid, theta = attrs['beamlet%03i_theta'%bid],
+                                      phi = attrs['beamlet%03i_phi'%bid],
+                                      coord = attrs['beamlet%03i_coord'%bid],
+                                      sb = attrs['beamlet%03i_sb'%bid],
+                                      rcus=attrs['beamlet%03i_rcus'%bid])
+
+        elif h5.attrs['CLASS']=='SST':
+            s = SST(station = attrs['station'],
+                    rcumode = attrs['rcumode'],
+                    ts = attrs['timestamp'],
+                    hbaStr = attrs['hbaelements'],
+                    special = attrs['special'],
+                    rawfile = attrs['rawfile'],
+                    integration = attrs['integration'],
+                    rcu = attrs['rcu'])
+
+        elif h5.attrs['CLASS']=='XST':
+            s = XST(station = attrs['station'],
+                    rcumode = attrs['rcumode'],
+                    ts = attrs['timestamp'],
+                    hbaStr = attrs['hbaelements'],
+                    special = attrs['special'],
+                    rawfile = attrs['rawfile'],
+                    integration = attrs['integration'],
+                    sb = attrs['subband'])
+        else:
+            print('ERROR: unknown class type')
+            return 0
+
+        s.setFingerprint(attrs.get('rawhash'), attrs.get('rawsize'), attrs.get('rawmtime'))
 
-    h5.close
+        if getdata and not ('data' in h5):
+            print('WARNING: %s has no data set, see readPolProducts()'%filename)
+            dd = None
+        elif getdata: dd = _cached(filename, 'data', None, lambda: _dataset(h5)[()])
 
     if getdata: return s, dd
     else: return s
 
-def read(filename, getdata=False):
-    """Wrapper function for readJSON() and readHDF5(), selects based on file extension (.json or .h5)
+def readStats(filename):
+    """Read the summary statistics written by writeHDF5(stats=True) without reading the data set
+    filename: str, path to HDF5
 
-    getdata: boolean, if true return the raw data as a numpy array also for HDF5
+    returns: dict with count, levels, mean, var, min, max and quantiles (nlevels, ...) numpy arrays, None if there are no statistics
+    """
+    if not H5SUPPORT:
+        print('ERROR: HDF5 is not supported, you need to install h5py')
+        return 0
+
+    with openHDF5(filename) as h5:
+        if not ('stats' in h5):
+            print('WARNING: %s has no summary statistics'%filename)
+            return None
+
+        grp = h5['stats']
+        stats = {'count': int(grp.attrs['count']), 'levels': np.array(grp.attrs['levels'])}
+        for key in ['mean', 'var', 'min', 'max', 'quantiles']: stats[key] = grp[key][()]
+
+    return stats
+
+def flagHDF5(filename, twin=64, fwin=32, threshold=5.):
+    """Generate RFI flags for the BST or SST data of an existing HDF5 file, streaming the data block by block,
+    and write them to the 'flags' dataset, replacing any existing flags
+    filename: str, path to HDF5
+    twin, fwin, threshold: see rfiFlags()
+    """
+    if not H5SUPPORT:
+        print('ERROR: HDF5 is not supported, you need to install h5py')
+        return 0
+
+    with openHDF5(filename, 'a') as h5:
+        if not (h5.attrs['CLASS'] in ['BST', 'SST']):
+            print('ERROR: RFI flagging is only supported for BST and SST data')
+            return 0
+
+        dset = _dataset(h5)
+        flagger = RFIFlagger(twin, fwin, threshold)
+        flagger.prime(np.empty((0,) + dset.shape[1:], dtype=dset.dtype))
+        nblock = _blockInts(dset.dtype, dset.shape[1:])
+        for i0 in range(0, dset.shape[0], nblock):
+            flagger.update(dset[i0:i0 + nblock])
+
+        if 'flags' in h5: del h5['flags']
+        flagger.writeHDF5(h5, [dset.dims[1].label])
+
+def readFlags(filename, start=0, stop=None):
+    """Read and unpack the RFI flags of an HDF5 file without reading the data set
+    filename: str, path to HDF5
+    start: int, first integration, default: 0
+    stop: int, integration to stop at (exclusive), default: None, to the last integration
+
+    returns: (nints, nchan) boolean array, True is flagged, None if there are no flags
+    """
+    if not H5SUPPORT:
+        print('ERROR: HDF5 is not supported, you need to install h5py')
+        return 0
+
+    def load():
+        with openHDF5(filename) as h5:
+            if not ('flags' in h5):
+                print('WARNING: %s has no RFI flags'%filename)
+                return None
+
+            nchan = int(h5['flags'].attrs['nchan'])
+            packed = h5['flags'][start:stop]
+
+        return np.unpackbits(packed, axis=1, count=nchan).astype(bool)
+
+    return _cached(filename, 'flags', (start, stop), load)
+
+POLPRODUCTS = {'linear': ('XX', 'XY', 'YX', 'YY'), 'stokes': ('I', 'Q', 'U', 'V'), 'I': ('I',)}
+
+def uniqueBaselines(nant):
+    """Antenna pairs of the unique baselines (including autocorrelations) of a correlation matrix, ant1 <= ant2
+
+    returns: (nbl, 2) int array, nbl = nant * (nant + 1) / 2
+    """
+    return np.transpose(np.triu_indices(nant))
+
+def polProducts(dd, npol=2, products='linear', unique=False):
+    """Per-baseline polarisation products of ACC/XST correlation matrices with interleaved polarisations, the matrices
+    are reshaped to (nant, npol, nant, npol) views, only the selected products are gathered
+    dd: (nints, nsb, nant*npol, nant*npol) complex array, see xst2npy() and acc2npy()
+    npol: int, number of polarizations
+    products: str, 'linear': the (npol, npol) correlation products (XX, XY, YX, YY), 'stokes': Stokes (I, Q, U, V),
+        'I': Stokes I only, Stokes parameters need npol=2
+    unique: boolean, if true only keep the unique baselines, see uniqueBaselines(), default: False, all (ant1, ant2) pairs
+
+    returns: complex array of shape (nints, nsb, nant, nant) or (nints, nsb, nbl) followed by (npol, npol) for 'linear',
+        (4,) for 'stokes' and nothing for 'I', the 'linear' products of all baselines are a view of dd
+    """
+    if not (products in POLPRODUCTS): raise ValueError('unknown polarisation products %s, use linear, stokes or I'%products)
+    if products != 'linear' and npol != 2: raise ValueError('Stokes parameters need 2 polarizations')
+    dd = np.asarray(dd)
+    nant = dd.shape[-1] // npol
+    vv = dd.reshape(dd.shape[:2] + (nant, npol, nant, npol)) # a view of the correlation matrices
+
+    if unique:
+        ant1, ant2 = np.triu_indices(nant)
+        pol = lambda p, q: vv[:, :, ant1, p, ant2, q] # one gather of the unique baselines per product
+    else:
+        if products == 'linear': return vv.transpose(0, 1, 2, 4, 3, 5)
+        pol = lambda p, q: vv[:, :, :, p, :, q]
+
+    if products == 'I': return pol(0, 0) + pol(1, 1)
+    if products == 'linear':
+        out = np.empty(dd.shape[:2] + (len(ant1), npol, npol), dtype=dd.dtype)
+        for p in range(npol):
+            for q in range(npol): out[..., p, q] = pol(p, q)
+        return out
+    xx, xy, yx, yy = pol(0, 0), pol(0, 1), pol(1, 0), pol(1, 1)
+    out = np.empty(xx.shape + (4,), dtype=dd.dtype)
+    out[..., 0] = xx + yy
+    out[..., 1] = xx - yy
+    out[..., 2] = xy + yx
+    out[..., 3] = 1j * (yx - xy)
+    return out
+
+def polProductsHDF5(source, filename, products='I', unique=True, compression=None):
+    """Reduce ACC/XST correlation matrices to per-baseline polarisation products (see polProducts()), streaming the data
+    block by block, and write them to the 'products' dataset of an HDF5 file, replacing any existing products
+    source: ACC or XST instance, the raw data file is read, or str, path to an HDF5 file, the 'data' dataset is read
+    filename: str, HDF5 file to write to, created if it does not exist, can be the source HDF5 file, without a 'data'
+        dataset (e.g. a Stokes I only archive) the metadata is read from the 'products' dataset by readHDF5()
+    products, unique: see polProducts(), the unique baseline antenna pairs are written to the 'baselines' dataset
+    compression: int, gzip compression level (0-9) of the 'products' dataset, default: None, no compression
+
+    returns: int, number of integrations written
+    """
+    if not H5SUPPORT:
+        print('ERROR: HDF5 is not supported, you need to install h5py')
+        return 0
+
+    if isinstance(source, statData):
+        s, h5src = source, None
+        if s.rawfile is None:
+            print('ERROR: rawfile not set, no data to reduce')
+            return 0
+        dtype, recshape = s._rawRecord()
+        nints = s.rawInts()
+    else:
+        s, h5src = readHDF5(source), os.path.abspath(source)
+        with openHDF5(source) as h5:
+            dset = _dataset(h5)
+            dtype, recshape, nints = dset.dtype, dset.shape[1:], dset.shape[0]
+    if not isinstance(s, (ACC, XST)):
+        print('ERROR: polarisation products are only supported for ACC and XST data')
+        return 0
+
+    nant = recshape[-1] // s.npol
+    if unique: labels = ('time', 'subband', 'baseline')
+    else: labels = ('time', 'subband', 'ant1', 'ant2')
+    if products == 'linear': labels += ('pol1', 'pol2')
+    elif products == 'stokes': labels += ('stokes',)
+    outshape = polProducts(np.zeros((0,) + tuple(recshape), dtype=dtype), s.npol, products, unique).shape[1:]
+
+    with openHDF5(filename, 'a') as h5:
+        def read(i0, i1):
+            if h5src is None: return s.readRawRange(i0, i1)
+            if h5src == os.path.abspath(filename): return _dataset(h5)[i0:i1]
+            with openHDF5(h5src) as src: return _dataset(src)[i0:i1]
+
+        if not ('CLASS' in h5.attrs): h5.attrs['CLASS'] = type(s).__name__
+        for name in ['products', 'baselines']:
+            if name in h5: del h5[name]
+        shape = (nints,) + outshape
+        if compression is None or nints == 0: dset = h5.create_dataset('products', shape=shape, dtype=dtype)
+        else: dset = h5.create_dataset('products', shape=shape, dtype=dtype, chunks=_chunkShape(shape, dtype.itemsize),
+                                       compression='gzip', compression_opts=compression)
+        nblock = _blockInts(dtype, recshape)
+        for i0 in range(0, nints, nblock):
+            i1 = min(i0 + nblock, nints)
+            dset[i0:i1] = polProducts(read(i0, i1), s.npol, products, unique)
+
+        for idx, label in enumerate(labels): dset.dims[idx].label = label
+        s._setHDF5Attrs(dset, s._buildDict())
+        dset.attrs['products'] = list(POLPRODUCTS[products])
+        dset.attrs['polproducts'] = products
+        dset.attrs['nants'] = nant
+        dset.attrs['npol'] = s.npol
+        if unique: h5.create_dataset('baselines', data=uniqueBaselines(nant).astype(np.int16))
+
+    return nints
+
+def readPolProducts(filename, start=0, stop=None):
+    """Read the polarisation products written by polProductsHDF5() without reading the data set
+    filename: str, path to HDF5
+    start: int, first integration, default: 0
+    stop: int, integration to stop at (exclusive), default: None, to the last integration
+
+    returns: complex array, see polProducts(), (nbl, 2) array of the baseline antenna pairs (None if all baselines are
+        kept), None if there are no products
+    """
+    if not H5SUPPORT:
+        print('ERROR: HDF5 is not supported, you need to install h5py')
+        return 0
+
+    with openHDF5(filename) as h5:
+        if not ('products' in h5):
+            print('WARNING: %s has no polarisation products'%filename)
+            return None
+        dd = _cached(filename, 'products', (start, stop), lambda: h5['products'][start:stop])
+        if 'baselines' in h5: baselines = h5['baselines'][()]
+        else: baselines = None
+
+    return dd, baselines
+
+def readBeamletSpectra(filename, pointings=None, start=0, stop=None):
+    """Read per-pointing (time, subband) spectra from the BST data of an HDF5 file, streaming the data set block by
+    block with a single gather of the selected beamlet columns per block, the beamlet index is read from the file
+    (see BeamletIndex) or built from the beamlet metadata of files written without one
+    filename: str, path to HDF5
+    pointings: list of pointing indices or (theta, phi, coord) tuples, default: None, all pointings
+    start: int, first integration, default: 0
+    stop: int, integration to stop at (exclusive), default: None, to the last integration
+
+    returns: BeamletIndex instance, list of (nints, nsb) float arrays, one per selected pointing, ordered by subband
+    """
+    if not H5SUPPORT:
+        print('ERROR: HDF5 is not supported, you need to install h5py')
+        return 0
+
+    with openHDF5(filename) as h5:
+        if h5.attrs['CLASS'] != 'BST':
+            print('ERROR: beamlet spectra are only supported for BST data')
+            return 0
+        index = BeamletIndex.readHDF5(h5)
+    if index is None: index = readHDF5(filename).beamletIndex()
+    sel, cols, lengths = index._select(pointings)
+
+    def load():
+        with openHDF5(filename) as h5:
+            dset = _dataset(h5)
+            i0, i1, _ = slice(start, stop).indices(dset.shape[0])
+            out = np.empty((max(i1 - i0, 0), len(cols)), dtype=dset.dtype)
+            nblock = _blockInts(dset.dtype, dset.shape[1:])
+            for b0 in range(i0, i1, nblock):
+                b1 = min(b0 + nblock, i1)
+                np.take(dset[b0:b1], cols, axis=1, out=out[b0 - i0:b1 - i0])
+        return out
+
+    gathered = _cached(filename, 'data', ('beamlets', tuple(cols), start, stop), load)
+    return index, index._split(gathered, lengths)
+
+METATABLE_DTYPE = np.dtype([
+    ('filename', 'O'),
+    ('datatype', 'U3'),
+    ('station', 'U8'),
+    ('timestamp', 'datetime64[s]'), # NaT if not set
+    ('rcumode', 'i2'), # most common mode for mixed RCU modes, -1 if not set
+    ('mixedrcumode', '?'),
+    ('integration', 'i4'), # -1 if not set
+    ('subband', 'i2'), # XST, -1 if not set
+    ('rcu', 'i2'), # SST, -1 if not set
+    ('pol', 'U1'), # BST, '' if not set
+    ('nints', 'i8'), # HDF5 only, number of integrations in the data set, -1 otherwise
+    ('rawfile', 'O')])
+
+def _unset(val):
+    """True if a metadata value is not set, None in JSON, np.nan in HDF5"""
+    return (val is None) or (isinstance(val, float) and np.isnan(val))
+
+def _metaRow(filename, meta, nints=-1):
+    """Convert a JSON metadata dictionary or HDF5 data attributes to a METATABLE_DTYPE row tuple
+    """
+    rcumode = meta.get('rcumode')
+    if _unset(rcumode): rcumode, mixed = -1, False
+    elif np.ndim(rcumode) == 0: rcumode, mixed = int(rcumode), False
+    else:
+        modes, counts = np.unique(np.asarray(rcumode, dtype=int), return_counts=True)
+        rcumode, mixed = int(modes[np.argmax(counts)]), len(modes) > 1
+
+    ts = meta.get('timestamp')
+    if _unset(ts) or ts == 'None': ts = np.datetime64('NaT')
+    else: ts = np.datetime64(str(ts).replace(' ', 'T'))
+
+    def intOrUnset(key):
+        val = meta.get(key)
+        if _unset(val): return -1
+        else: return int(val)
+
+    def strOrUnset(key):
+        val = meta.get(key)
+        if _unset(val): return ''
+        else: return str(val)
+
+    rawfile = meta.get('rawfile')
+    if _unset(rawfile): rawfile = None
+    else: rawfile = str(rawfile)
+
+    return (filename, strOrUnset('datatype'), strOrUnset('station'), ts, rcumode, mixed, intOrUnset('integration'),
+            intOrUnset('subband'), intOrUnset('rcu'), strOrUnset('pol'), nints, rawfile)
+
+def _readMetaRow(filename):
+    """Read the metadata of a JSON or HDF5 file into a METATABLE_DTYPE row tuple, without building a class instance
+    """
+    try:
+        if filename.endswith('.json'):
+            with open(filename, 'r') as fp:
+                return _metaRow(filename, json.load(fp))
+        elif filename.endswith('.h5'):
+            with openHDF5(filename) as h5:
+                meta = dict(h5['data'].attrs.items())
+                meta['datatype'] = h5.attrs['CLASS']
+                return _metaRow(filename, meta, _dataset(h5).shape[0])
+        else:
+            print('WARNING: file extension of %s not understood, only .json and .h5 file types are read'%filename)
+    except (IOError, OSError, ValueError, KeyError) as err:
+        print('WARNING: could not read metadata from %s:'%filename, err)
+    return _metaRow(filename, {})
+
+def readMetaTable(filenames, nthreads=8):
+    """Read the metadata of many JSON and HDF5 files with a pool of threads into a columnar table,
+    campaign-level selections can then be vectorised, e.g. table[(table['station'] == 'SE607') & (table['rcumode'] == 5)]
+    filenames: list of str, JSON (.json) and HDF5 (.h5) files
+    nthreads: int, number of reader threads
+
+    returns: numpy structured array of METATABLE_DTYPE, one row per file in the order of filenames,
+        unreadable files have an empty datatype
+    """
+    from multiprocessing.pool import ThreadPool
+
+    if not H5SUPPORT and any(fn.endswith('.h5') for fn in filenames):
+        print('ERROR: HDF5 is not supported, you need to install h5py')
+        return 0
+
+    pool = ThreadPool(nthreads)
+    try:
+        rows = pool.map(_readMetaRow, filenames, chunksize=max(1, len(filenames) // (4 * nthreads)))
+    finally:
+        pool.close()
+        pool.join()
+
+    return np.array(rows, dtype=METATABLE_DTYPE)
+
+def _lockFile(fp):
+    """Exclusive advisory lock on an open file, so several processes can append to the same manifest"""
+    try:
+        import fcntl
+        fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+    except ImportError: # no fcntl, not a POSIX system
+        pass
+
+def _unlockFile(fp):
+    try:
+        import fcntl
+        fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+    except ImportError:
+        pass
+
+def manifestName(s, directory='.', per='day', observation=None):
+    """Manifest filename for a statData instance
+    s: statData class instance with the timestamp set
+    directory: str, directory of the manifests
+    per: str, 'day' for one manifest per day (YYYYMMDD.jsonl), 'station' for one per station and day (STATION_YYYYMMDD.jsonl),
+        'observation' for one per observation (STATION_OBSERVATION_DATATYPE.jsonl)
+    observation: str, (per='observation') observation identifier shared by the files of an observation,
+        default: None, the timestamp of s (YYYYMMDD_HHMMSS), i.e. an observation of a single raw file
+
+    returns: str
+    """
+    day = s.ts.strftime('%Y%m%d')
+    if per == 'station': return os.path.join(directory, '%s_%s.jsonl'%(s.station, day))
+    elif per == 'observation':
+        if observation is None: observation = s.ts.strftime('%Y%m%d_%H%M%S')
+        return os.path.join(directory, '%s_%s_%s.jsonl'%(s.station, observation, type(s).__name__.lower()))
+    else: return os.path.join(directory, '%s.jsonl'%day)
+
+IDXMAGIC = b'ISSIDX1\n' # start of a manifest index file
+IDXTAIL = 256 # entries appended to a manifest index unsorted before they are merged into the sorted entries
+_IDXHEADER = np.dtype([('magic', 'S8'), ('nsorted', '<u8'), ('end', '<u8')])
+_IDXENTRY = np.dtype([('hash', '<u8'), ('offset', '<u8'), ('length', '<u8')])
+
+def _recordKey(rec):
+    """Index key of a manifest record dictionary, the rawfile, or the timestamp if no rawfile is set"""
+    if rec['rawfile'] is None: return rec['timestamp']
+    else: return rec['rawfile']
+
+def _keyHash(key):
+    """64 bit hash of a manifest record key, the same in every process"""
+    return int(np.frombuffer(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), dtype='<u8')[0])
+
+def _scanManifest(manifest):
+    """Index entries (key, offset, length) of the complete records of a manifest, read from the manifest itself,
+    blank lines are included in the entry of the record before them (after them at the start) so the entries are contiguous
+    """
+    entries = []
+    start = 0
+    end = 0
+    with open(manifest, 'rb') as fp:
+        for line in fp:
+            if not line.endswith(b'\n'): break # a partially written last record
+            end += len(line)
+            if not line.strip(): continue
+            entries.append([_recordKey(json.loads(line.decode('utf-8'))), start, end - start])
+            start = end
+    if len(entries) > 0: entries[-1][2] += end - start
+    return entries
+
+def _indexHeader(ip):
+    """Header of an open manifest index file, None if it is not one (e.g. a text index of an earlier version)"""
+    ip.seek(0)
+    raw = ip.read(_IDXHEADER.itemsize)
+    if len(raw) < _IDXHEADER.itemsize: return None
+    header = np.frombuffer(raw, dtype=_IDXHEADER).copy()
+    if header['magic'][0] != IDXMAGIC: return None
+    return header
+
+def _writeManifestIndex(idxfile, entries, end):
+    """Replace a manifest index file with the entries sorted by key hash (and record offset), the file is replaced in a
+    single step so readers see either the old or the new index
+    entries: _IDXENTRY array
+    end: int, end of the last record of the manifest covered by the entries
+    """
+    entries = entries[np.lexsort((entries['offset'], entries['hash']))]
+    tmpfile = idxfile + '.tmp'
+    with open(tmpfile, 'wb') as ip:
+        ip.write(np.array([(IDXMAGIC, len(entries), end)], dtype=_IDXHEADER).tobytes())
+        ip.write(entries.tobytes())
+    os.replace(tmpfile, idxfile)
+
+def _rebuildManifestIndex(manifest):
+    """Replace the index file of a manifest with one built from the manifest, call with the manifest locked
+    """
+    entries = _scanManifest(manifest)
+    end = entries[-1][1] + entries[-1][2] if len(entries) > 0 else 0
+    _writeManifestIndex(manifest + '.idx', np.array([(_keyHash(key), offset, length) for key, offset, length in entries],
+                                                    dtype=_IDXENTRY), end)
+
+def _appendManifestIndex(idxfile, key, offset, length):
+    """Append the entry of a record to a manifest index file, call with the manifest locked, once there are more than
+    IDXTAIL unsorted entries they are merged into the sorted entries
+    """
+    entry = np.array([(_keyHash(key), offset, length)], dtype=_IDXENTRY)
+    with open(idxfile, 'r+b') as ip:
+        header = _indexHeader(ip)
+        ip.seek(0, os.SEEK_END)
+        nentries = (ip.tell() - _IDXHEADER.itemsize) // _IDXENTRY.itemsize
+        if nentries - int(header['nsorted'][0]) < IDXTAIL:
+            ip.seek(_IDXHEADER.itemsize + nentries * _IDXENTRY.itemsize) # over a partially written entry
+            ip.write(entry.tobytes())
+            ip.flush()
+            header['end'] = offset + length # the entry is covered once the header is updated
+            ip.seek(0)
+            ip.write(header.tobytes())
+            return
+        ip.seek(_IDXHEADER.itemsize)
+        entries = np.frombuffer(ip.read(nentries * _IDXENTRY.itemsize), dtype=_IDXENTRY)
+    _writeManifestIndex(idxfile, np.concatenate([entries, entry]), offset + length)
+
+def _indexSpan(idxfile):
+    """(offset of the first record, end of the last record) covered by a manifest index file, None if there is no index
+    file of this version, the index always starts at the first record
+    """
+    if not os.path.exists(idxfile): return None
+    with open(idxfile, 'rb') as ip: header = _indexHeader(ip)
+    if header is None: return None
+    return 0, int(header['end'][0])
+
+def _indexLookup(manifest, key):
+    """Records of a manifest which may have a key, found with a binary search of the sorted entries of the index file and
+    a scan of the (at most IDXTAIL) unsorted ones, so a lookup reads O(log n) bytes of the index
+
+    returns: list of (offset, length), latest record first, or None if there is no index covering the manifest
+    """
+    try: ip = open(manifest + '.idx', 'rb')
+    except (IOError, OSError): return None
+    with ip:
+        header = _indexHeader(ip)
+        if (header is None) or (int(header['end'][0]) != os.path.getsize(manifest)): return None
+        nsorted = int(header['nsorted'][0])
+        nentries = (os.fstat(ip.fileno()).st_size - _IDXHEADER.itemsize) // _IDXENTRY.itemsize
+        h = _keyHash(key)
+
+        def entryAt(i):
+            ip.seek(_IDXHEADER.itemsize + i * _IDXENTRY.itemsize)
+            return np.frombuffer(ip.read(_IDXENTRY.itemsize), dtype=_IDXENTRY)[0]
+        lo, hi = 0, nsorted
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if int(entryAt(mid)['hash']) < h: lo = mid + 1
+            else: hi = mid
+        found = []
+        while lo < nsorted:
+            entry = entryAt(lo)
+            if int(entry['hash']) != h: break
+            found.append((int(entry['offset']), int(entry['length'])))
+            lo += 1
+        ip.seek(_IDXHEADER.itemsize + nsorted * _IDXENTRY.itemsize)
+        tail = np.frombuffer(ip.read((nentries - nsorted) * _IDXENTRY.itemsize), dtype=_IDXENTRY)
+    found += [(int(entry['offset']), int(entry['length'])) for entry in tail[tail['hash'] == h]]
+    return sorted(found, reverse=True)
+
+_manifestScans = {} # manifest filename: (manifest size, {key: (offset, length)}), manifests without a complete index
+
+def _manifestRecord(manifest, key):
+    """Metadata dictionary of the latest record of a manifest with a key, None if the key is not in the manifest,
+    if there is no index file or it does not cover all records of the manifest the records are found from the manifest
+    """
+    found = _indexLookup(manifest, key)
+    if found is None: # no index, e.g. a manifest assembled by hand, or an index of only some of the records
+        msize = os.path.getsize(manifest)
+        scan = _manifestScans.get(manifest)
+        if scan is None or scan[0] != msize:
+            scan = (msize, dict((k, (offset, length)) for k, offset, length in _scanManifest(manifest)))
+            _manifestScans[manifest] = scan
+        found = [scan[1][key]] if key in scan[1] else []
+    with open(manifest, 'rb') as fp:
+        for offset, length in found: # records of other keys with the same hash are skipped
+            fp.seek(offset)
+            rec = json.loads(fp.read(length).decode('utf-8'))
+            if _recordKey(rec) == key: return rec
+    return None
+
+def readManifest(manifest, record=None):
+    """Read metadata records from a JSON-lines manifest written with statData.writeManifest()
+    manifest: str, manifest filename
+    record: str, key (rawfile, or timestamp if the rawfile is not set) of a single record to read, default: None, read all records
+
+    returns: statData class instance if record is set (None if the record is not in the manifest), else a list of statData class instances
+    """
+    if record is None:
+        with open(manifest, 'rb') as fp:
+            return [_fromDict(json.loads(line.decode('utf-8'))) for line in fp if line.strip()]
+
+    rec = _manifestRecord(manifest, record)
+    if rec is None:
+        print('WARNING: record %s not in manifest %s'%(record, manifest))
+        return None
+    return _fromDict(rec)
+
+def writeFingerprint(filename, s):
+    """Replace the raw data fingerprint stored in an existing .json, .h5 or .tpc file with the one of a statData instance,
+    the data and the other metadata of the file are not changed, see statData.rawUnchanged()
+    filename: str, path to .json, .h5 or .tpc file
+    s: statData instance
+    """
+    fingerprint = {'rawhash': s.rawhash, 'rawsize': s.rawsize, 'rawmtime': s.rawmtime}
+    if filename.endswith('.json'):
+        with open(filename, 'r') as fp: metaDict = json.load(fp)
+        metaDict.update(fingerprint)
+        with open(filename, 'w') as fp: json.dump(metaDict, fp, sort_keys=True, indent=4)
+    elif filename.endswith('.h5'):
+        if not H5SUPPORT:
+            print('ERROR: HDF5 is not supported, you need to install h5py')
+            return 0
+        with openHDF5(filename, 'r+') as h5:
+            dset = h5['data'] if 'data' in h5 else h5['products']
+            for key, val in fingerprint.items(): dset.attrs[key] = np.nan if val is None else val
+    elif filename.endswith('.tpc'):
+        with open(filename, 'r+b') as fh:
+            footer = _tpcFooter(fh)
+            fh.seek(-(8 + len(TPCMAGIC)), os.SEEK_END)
+            nfooter = int(np.frombuffer(fh.read(8), dtype='<u8')[0])
+            fh.seek(-(8 + len(TPCMAGIC) + nfooter), os.SEEK_END)
+            footer['meta'].update(fingerprint)
+            footer = json.dumps(footer).encode('utf-8')
+            fh.write(footer)
+            fh.write(np.uint64(len(footer)).astype('<u8').tobytes())
+            fh.write(TPCMAGIC)
+            fh.truncate()
+    else:
+        print('ERROR: file extension not understood, only .json, .h5 and .tpc files store a fingerprint.')
+
+def read(filename, getdata=False, record=None):
+    """Wrapper function for readJSON(), readHDF5(), readTPC() and readManifest(), selects based on file extension (.json, .h5, .tpc or .jsonl)
+
+    getdata: boolean, if true return the raw data as a numpy array also for HDF5 and .tpc
+    record: str, (.jsonl) key of a single manifest record to read, see readManifest()
     """
     if filename.endswith('.json'): return readJSON(filename)
-    elif filename.endswith('.h5'): return readHDF5(filename, getdata=False)
+    elif filename.endswith('.h5'): return readHDF5(filename, getdata=getdata)
+    elif filename.endswith('.tpc'): return readTPC(filename, getdata=getdata)
+    elif filename.endswith('.jsonl'): return readManifest(filename, record=record)
     else:
-        print('ERROR: file extension not understood, only .json and .h5 file types work with this function.')
+        print('ERROR: file extension not understood, only .json, .h5, .tpc and .jsonl file types work with this function.')
+
+class Observation(object):
+    """ Time-ordered sequence of same-configuration BST (or single RCU SST) files presented as one continuous time series
+
+    Integrations are placed on the time grid ts + i * integration of the first file, an index of the grid range
+    covered by each file is built when the Observation is created and slices only read the files they intersect.
+    Gaps between files are filled with the fill value, integrations of a file overlapping the previous file are skipped.
+
+    Attributes:
+        members: list of statData instances, ordered by timestamp
+        sources: list of str, HDF5 file to read each member from, None to read from the raw data file
+        starts, stops: int arrays, time grid range [start, stop) covered by each member
+        offsets: int array, first integration read from each member (non-zero if it overlaps the previous member)
+        gaps: list of (start, stop) time grid ranges not covered by any file
+        overlaps: list of (member index, number of integrations skipped)
+        fill: value of the integrations in gaps
+    """
+    def __init__(self, files, fill=np.nan):
+        """files: list of statData instances and/or filenames (.json, .h5 or .jsonl, all records of a manifest are used),
+            the rawfile of a JSON or manifest record is looked for in the directory of the metadata file if it
+            is not found from the working directory
+        fill: value of the integrations in gaps, default: NaN
+        """
+        self.members = []
+        self.sources = []
+        nints = []
+        for fn in files:
+            if isinstance(fn, statData): items, source = [fn], None
+            elif fn.endswith('.h5'): items, source = [readHDF5(fn)], fn
+            elif fn.endswith('.jsonl'): items, source = readManifest(fn), None
+            else: items, source = [read(fn)], None
+            for s in items:
+                if source is None:
+                    if s.rawfile is None: raise ValueError('%s has no raw data file'%s.ts)
+                    if not isinstance(fn, statData) and not os.path.exists(s._pathrawfile):
+                        s.setRawFile(os.path.join(os.path.dirname(fn), s.rawfile))
+                    nints.append(s.rawInts())
+                else:
+                    with openHDF5(source) as h5: nints.append(_dataset(h5).shape[0])
+                self.members.append(s)
+                self.sources.append(source)
+        if len(self.members) == 0: raise ValueError('an Observation needs at least one file')
+
+        first = self.members[0]
+        for s in self.members:
+            if not (type(s).__name__ in ['BST', 'SST']): raise ValueError('only BST and SST files can be joined in an Observation')
+            if (s.ts is None) or (s.integration is None): raise ValueError('timestamp and integration length are needed to join files')
+            if self._config(s) != self._config(first):
+                raise ValueError('%s configuration %s differs from %s'%(s.rawfile, self._config(s), self._config(first)))
+
+        order = np.argsort([_toDatetime64(s.ts) for s in self.members], kind='stable')
+        self.members = [self.members[i] for i in order]
+        self.sources = [self.sources[i] for i in order]
+        nints = np.array(nints, dtype=np.int64)[order]
+
+        # time grid index of the first integration of each file
+        ts0 = _toDatetime64(self.members[0].ts)
+        integration = _integrationDelta(self.members[0].integration)
+        grid = np.array([int(np.round((_toDatetime64(s.ts) - ts0) / integration)) for s in self.members], dtype=np.int64)
+
+        self.starts = np.zeros(len(self.members), dtype=np.int64)
+        self.stops = np.zeros(len(self.members), dtype=np.int64)
+        self.offsets = np.zeros(len(self.members), dtype=np.int64)
+        self.gaps = []
+        self.overlaps = []
+        end = 0
+        for idx in range(len(self.members)):
+            if grid[idx] > end: self.gaps.append((int(end), int(grid[idx])))
+            elif grid[idx] < end: self.overlaps.append((idx, int(min(end - grid[idx], nints[idx]))))
+            self.starts[idx] = max(grid[idx], end)
+            self.offsets[idx] = self.starts[idx] - grid[idx]
+            self.stops[idx] = max(grid[idx] + nints[idx], self.starts[idx]) # a file inside the previous one covers nothing
+            end = self.stops[idx]
+        self.nints = int(end)
+        self.fill = fill
+
+        self.dtype, self.recshape = self.members[0]._rawRecord()
+
+    @staticmethod
+    def _config(s):
+        """Configuration which must be the same for all files of an Observation"""
+        if type(s).__name__ == 'BST': return (s.station, s.integration, s.bitmode, s.pol)
+        else: return (s.station, s.integration, s.rcu)
+
+    def __len__(self):
+        return self.nints
+
+    @property
+    def shape(self):
+        return (self.nints,) + self.recshape
+
+    def times(self, start=0, stop=None):
+        """Start times of the time grid integrations [start, stop), see statData.integrationTimes()
+
+        returns: datetime64[us] array
+        """
+        if stop is None: stop = self.nints
+        return self.members[0].integrationTimes(start, stop)
+
+    def timeIndex(self, start=None, stop=None):
+        """Convert a time range to the range of time grid integrations overlapping it, see statData.timeIndex()
+
+        returns: (first integration, integration to stop at (exclusive))
+        """
+        return self.members[0].timeIndex(start, stop, nints=self.nints)
+
+    def _readMember(self, idx, start, stop):
+        """Read the integrations [start, stop) of a member file"""
+        if self.sources[idx] is None: return self.members[idx].readRawRange(start, stop)
+        def load():
+            with openHDF5(self.sources[idx]) as h5: return _dataset(h5)[start:stop]
+        return _cached(self.sources[idx], 'data', (int(start), int(stop)), load)
+
+    def read(self, start=0, stop=None):
+        """Read the time grid integrations [start, stop), only the files intersecting the range are read
+        stop: int, default: None, to the end of the observation
 
-def acc2npy(filename, nant=96, npol=2):
+        returns: (nints, ...) numpy array
+        """
+        if stop is None: stop = self.nints
+        start, stop = min(max(start, 0), self.nints), min(max(stop, 0), self.nints)
+        stop = max(start, stop)
+        dd = np.full((stop - start,) + self.recshape, self.fill, dtype=self.dtype)
+        # files are ordered and do not overlap on the grid, so the intersecting files are a contiguous run
+        first = np.searchsorted(self.stops, start, side='right')
+        last = np.searchsorted(self.starts, stop, side='left')
+        for idx in range(first, last):
+            i0, i1 = max(start, self.starts[idx]), min(stop, self.stops[idx])
+            if i1 <= i0: continue
+            fstart = self.offsets[idx] + (i0 - self.starts[idx])
+            dd[i0 - start:i1 - start] = self._readMember(idx, fstart, fstart + (i1 - i0))
+        return dd
+
+    def readTimeRange(self, start=None, stop=None):
+        """Read the integrations overlapping a time range, see statData.readTimeRange()
+
+        returns: datetime64[us] array of the integration start times, (nints, ...) numpy array
+        """
+        i0, i1 = self.timeIndex(start, stop)
+        return self.times(i0, i1), self.read(i0, i1)
+
+    def __getitem__(self, key):
+        """Slice along time, obs[i0:i1:step] or obs[i, ...], only the integrations in the slice range are read"""
+        if isinstance(key, tuple): key, rest = key[0], key[1:]
+        else: rest = ()
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.nints)
+            if step < 0: # read the covered range forward, then reverse
+                dd = self.read(stop + 1, start + 1)[::step]
+            else: dd = self.read(start, stop)[::step]
+            return dd[(slice(None),) + rest]
+        else:
+            idx = int(key)
+            if idx < 0: idx += self.nints
+            if not (0 <= idx < self.nints): raise IndexError('integration %i out of range'%key)
+            return self.read(idx, idx + 1)[(0,) + rest]
+
+class StationJoin(object):
+    """ Time-aligned join of the BST/SST statistics of several stations on a shared time grid
+
+    Each station is an Observation of its files. The shared grid has the integration length of the station with the
+    longest integration (or a given length), the integrations of stations with shorter integrations are resampled by
+    averaging (or summing) the integrations in each grid integration, the grid integration length must be a whole
+    multiple of their integration length. By default the grid covers the time range common to all stations, with
+    union=True it covers the time range of any station and the integrations a station does not cover are filled.
+
+    Attributes:
+        stations: list of station IDs
+        observations: dict of Observation instances by station ID
+        ts: datetime64[us], start time of the shared time grid
+        integration: float, grid integration length in seconds
+        nints: int, number of grid integrations
+        factors: dict of the number of station integrations in a grid integration by station ID
+        origins: dict of the station integration at the start of the grid by station ID, negative if the station
+            starts after the grid (union=True)
+        fill: value of the integrations not covered by a station
+    """
+    def __init__(self, stations, integration=None, union=False, resample='mean', fill=np.nan, nthreads=None):
+        """stations: dict of file lists (see Observation) or Observation instances by station ID, or a list of them,
+            the station ID is then taken from the metadata
+        integration: float, grid integration length in seconds, default: None, the longest station integration length
+        union: boolean, if true the grid covers the time range of any station, default: False, the common time range
+        resample: str, 'mean' or 'sum' of the station integrations in a grid integration, None to require that all
+            stations have the grid integration length, default: 'mean'
+        fill: value of the integrations not covered by a station, default: NaN
+        nthreads: int, number of threads reading the stations in parallel, default: None, one per station
+        """
+        if not (resample in ['mean', 'sum', None]): raise ValueError('unknown resample method %s, use mean, sum or None'%resample)
+        if isinstance(stations, dict): items = list(stations.items())
+        else: items = [(None, files) for files in stations]
+
+        self.stations = []
+        self.observations = {}
+        for station, files in items:
+            obs = files if isinstance(files, Observation) else Observation(files, fill=fill)
+            if station is None: station = obs.members[0].station
+            if station in self.observations: raise ValueError('station %s is given more than once'%station)
+            if not (station in VALIDSTATIONS): print('WARNING: %s not in valid station list.'%station)
+            self.stations.append(station)
+            self.observations[station] = obs
+        if len(self.stations) == 0: raise ValueError('a StationJoin needs at least one station')
+
+        usec = lambda seconds: int(np.round(seconds * 1e6))
+        if integration is None: integration = max(obs.members[0].integration for obs in self.observations.values())
+        self.integration = integration
+        dt = usec(integration)
+        starts = [_toDatetime64(obs.members[0].ts) for obs in self.observations.values()]
+        stops = [start + obs.nints * np.timedelta64(usec(obs.members[0].integration), 'us')
+                 for start, obs in zip(starts, self.observations.values())]
+        if union:
+            self.ts = min(starts)
+            span = (max(stops) - self.ts) / np.timedelta64(1, 'us')
+            self.nints = int(-(-span // dt))
+        else:
+            self.ts = max(starts)
+            span = (min(stops) - self.ts) / np.timedelta64(1, 'us')
+            self.nints = max(0, int(span // dt))
+
+        self.factors = {}
+        self.origins = {}
+        for station, start in zip(self.stations, starts):
+            sdt = usec(self.observations[station].members[0].integration)
+            if dt % sdt != 0:
+                raise ValueError('the grid integration (%f s) is not a multiple of the %s integration'%(integration, station))
+            if dt != sdt and resample is None:
+                raise ValueError('%s integration length differs from the grid integration, set resample to join them'%station)
+            offset = (self.ts - start) / np.timedelta64(1, 'us') / sdt
+            if abs(offset - np.round(offset)) > 0.01:
+                print('WARNING: %s integrations are offset by %.2f integrations from the grid, using the nearest'%(station, offset - np.round(offset)))
+            self.factors[station] = dt // sdt
+            self.origins[station] = int(np.round(offset))
+        self.resample = resample
+        self.fill = fill
+        self.nthreads = nthreads
+
+    def __len__(self):
+        return self.nints
+
+    def times(self, start=0, stop=None):
+        """Start times of the grid integrations [start, stop)
+
+        returns: datetime64[us] array
+        """
+        if stop is None: stop = self.nints
+        return self.ts + np.arange(start, stop) * _integrationDelta(self.integration)
+
+    def timeIndex(self, start=None, stop=None):
+        """Convert a time range to the range of grid integrations overlapping it, see statData.timeIndex()
+
+        returns: (first integration, integration to stop at (exclusive))
+        """
+        return _timeIndex(self.ts, self.integration, self.nints, start, stop)
+
+    def _readStation(self, station, start, stop):
+        """Read the grid integrations [start, stop) of a station, resampled to the grid integration length"""
+        obs = self.observations[station]
+        k = self.factors[station]
+        a, b = self.origins[station] + start * k, self.origins[station] + stop * k
+        i0, i1 = min(max(a, 0), obs.nints), min(max(b, 0), obs.nints)
+        if i0 == a and i1 == b: dd = obs.read(i0, i1)
+        else:
+            dd = np.full((b - a,) + obs.recshape, self.fill, dtype=obs.dtype)
+            if i1 > i0: dd[i0 - a:i1 - a] = obs.read(i0, i1)
+        if k == 1: return dd
+        dd = dd.reshape((stop - start, k) + obs.recshape)
+        if self.resample == 'sum': return dd.sum(axis=1)
+        return dd.mean(axis=1)
+
+    def _range(self, start, stop):
+        if stop is None: stop = self.nints
+        start, stop = min(max(start, 0), self.nints), min(max(stop, 0), self.nints)
+        return start, max(start, stop)
+
+    def read(self, start=0, stop=None):
+        """Read the grid integrations [start, stop) of all stations, see blocks() to stream long ranges
+        stop: int, default: None, to the end of the grid
+
+        returns: datetime64[us] array of the grid integration start times, dict of (nints, ...) numpy arrays by station ID
+        """
+        start, stop = self._range(start, stop)
+        if stop == start: return self.times(start, stop), dict((station, self._readStation(station, start, stop)) for station in self.stations)
+        blocks = self.blocks(start, stop, nblock=stop - start)
+        try: return next(blocks)
+        finally: blocks.close()
+
+    def readTimeRange(self, start=None, stop=None):
+        """Read the grid integrations overlapping a time range of all stations, see read() and timeIndex()"""
+        return self.read(*self.timeIndex(start, stop))
+
+    def blocks(self, start=0, stop=None, nblock=None):
+        """Stream the aligned grid integrations [start, stop) of all stations block by block, the stations are read by a
+        pool of threads and the next block is read while the current block is processed
+        stop: int, default: None, to the end of the grid
+        nblock: int, number of grid integrations per block, default: None, about BLOCKBYTES of the largest station record
+
+        yields: datetime64[us] array of the grid integration start times, dict of (nblock, ...) numpy arrays by station ID
+        """
+        from multiprocessing.pool import ThreadPool
+
+        start, stop = self._range(start, stop)
+        if nblock is None:
+            nblock = min(max(1, _blockInts(obs.dtype, obs.recshape) // self.factors[station])
+                         for station, obs in self.observations.items())
+
+        pool = ThreadPool(self.nthreads or len(self.stations))
+        try:
+            def fetch(i0):
+                return [pool.apply_async(self._readStation, (station, i0, min(i0 + nblock, stop))) for station in self.stations]
+            pending = fetch(start) if start < stop else []
+            for i0 in range(start, stop, nblock):
+                i1 = min(i0 + nblock, stop)
+                block = dict(zip(self.stations, [result.get() for result in pending]))
+                if i1 < stop: pending = fetch(i1) # read ahead while the caller processes this block
+                yield self.times(i0, i1), block
+        finally:
+            pool.close()
+            pool.join()
+
+BLOCKBYTES = 2**26 # target size of the blocks of integrations streamed from raw files, in bytes
+PRIMEINTS = 16 # number of integrations at the start of a raw file used to prime block consumers
+CHUNKBYTES = 2**20 # target size of the chunks of compressed HDF5 datasets, in bytes
+
+class BlockCache(object):
+    """ Size-bounded least recently used cache of numpy arrays
+
+    Attributes:
+        maxbytes: int, the least recently used arrays are evicted when the cache holds more than maxbytes
+        nbytes: int, bytes currently held
+        hits, misses: int, cache statistics
+    """
+    def __init__(self, maxbytes=2**30):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        """Return the cached array for key, calling factory() to compute it on a miss, cached arrays are read-only,
+        an array larger than maxbytes is returned without caching it
+        """
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                val = self._entries.pop(key)
+                self._entries[key] = val # most recently used entries are at the end
+                return val
+            self.misses += 1
+        val = factory() # outside the lock, other threads can use the cache during a read
+        if not isinstance(val, np.ndarray): return val
+        val.flags.writeable = False
+        if val.nbytes > self.maxbytes: return val
+        with self._lock:
+            if not (key in self._entries): self.nbytes += val.nbytes
+            self._entries[key] = val
+            self._evict()
+        return val
+
+    def _evict(self):
+        while self.nbytes > self.maxbytes and len(self._entries) > 0:
+            _, old = self._entries.popitem(last=False)
+            self.nbytes -= old.nbytes
+
+    def resize(self, maxbytes):
+        with self._lock:
+            self.maxbytes = maxbytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """returns: dict with hits, misses, nbytes, maxbytes and entries (number of cached arrays)"""
+        return {'hits': self.hits, 'misses': self.misses, 'nbytes': self.nbytes, 'maxbytes': self.maxbytes, 'entries': len(self._entries)}
+
+_blockCache = None # decoded block cache shared by the readers, see enableCache()
+
+def enableCache(maxbytes=2**30):
+    """Cache the arrays returned by the readers (statData.readRawRange(), readTimeRange(), Observation, readHDF5(getdata=True),
+    readFlags() and the *2npy() readers), keyed by the file signature (see _fileSignature()), dataset and slice, so repeated
+    reads of the same data come from memory, a modified file is read again, the streaming writers bypass the cache
+    Arrays returned while the cache is enabled are read-only, copy them to modify them.
+    maxbytes: int, cache size in bytes, an existing cache is resized
+
+    returns: BlockCache instance, see BlockCache.stats()
+    """
+    global _blockCache
+    if _blockCache is None: _blockCache = BlockCache(maxbytes)
+    else: _blockCache.resize(maxbytes)
+    return _blockCache
+
+def disableCache():
+    """Disable and empty the block cache"""
+    global _blockCache
+    _blockCache = None
+
+def _cached(filename, dataset, sel, factory):
+    """Read through the block cache if it is enabled
+    filename: str, file read by factory
+    dataset: str, HDF5 dataset name, None for raw files
+    sel: hashable description of the selection (slice, dtype, shape) read by factory
+    """
+    cache = _blockCache
+    if cache is None: return factory()
+    return cache.get((os.path.abspath(filename), _fileSignature(filename), dataset, sel), factory)
+
+def _nbeamlets(bitmode=8):
+    """Number of BST beamlets for a beamlet bit-mode
+    """
+    if bitmode==16: return 244
+    elif bitmode==8: return 488
+    elif bitmode==4: return 976
+    else:
+        print('WARNING: bit-mode %s not standard, only (16, 8, 4) in use, defaulting to 8 bit.'%str(bitmode))
+        return 488
+
+def _recordSpec(sclass, nant=96, npol=2, bitmode=8):
+    """Data type and shape of a single integration in a raw statistics file
+    sclass: str, statistics class, ACC, BST, SST or XST
+    nant: int, number of antennas/tiles in the array (ACC, XST)
+    npol: int, number of polarizations (ACC, XST)
+    bitmode: int, beamlet bit-mode (BST)
+
+    returns: numpy dtype, shape tuple
+    """
+    nantpol = nant * npol
+    # raw files are little-endian, explicit byte order gives the same arrays on any host
+    if sclass == 'ACC': return np.dtype('<c16'), (512, nantpol, nantpol) # ACC have 512 subbands and a single integration
+    elif sclass == 'BST': return np.dtype('<f8'), (_nbeamlets(bitmode),)
+    elif sclass == 'SST': return np.dtype('<f8'), (512,) # SST have 512 subbands
+    elif sclass == 'XST': return np.dtype('<c16'), (1, nantpol, nantpol) # XST only have a single subband
+    else: raise ValueError('unknown statistics class %s'%sclass)
+
+def _rawInts(filename, dtype, recshape):
+    """Number of complete integrations in a raw file, a partial trailing integration is ignored
+    """
+    return os.path.getsize(filename) // (int(np.prod(recshape)) * np.dtype(dtype).itemsize)
+
+def _blockInts(dtype, recshape):
+    """Number of integrations in a streaming block of about BLOCKBYTES
+    """
+    return max(1, BLOCKBYTES // (int(np.prod(recshape)) * np.dtype(dtype).itemsize))
+
+def _readRawRange(filename, dtype, recshape, start=0, stop=None):
+    """Read integrations [start, stop) from a raw file
+
+    returns: (stop - start, ...) numpy array
+    """
+    dtype = np.dtype(dtype)
+    recsize = int(np.prod(recshape))
+    nints = _rawInts(filename, dtype, recshape)
+    if (stop is None) or (stop > nints): stop = nints
+    start = min(max(start, 0), stop)
+    with open(filename, 'rb') as fh:
+        fh.seek(start * recsize * dtype.itemsize)
+        d = np.fromfile(fh, dtype=dtype, count=(stop - start) * recsize)
+    return np.reshape(d, (stop - start,) + tuple(recshape))
+
+def _isBuffer(source):
+    """True if source supports the buffer protocol (bytes, bytearray, memoryview, mmap, numpy array) rather than being a filename"""
+    if isinstance(source, str): return False # py2 str is bytes, a filename
+    try: memoryview(source)
+    except TypeError: return False
+    return True
+
+def _readStream(fp):
+    """Read a binary file object to its end into a bytearray with readinto(), the buffer is preallocated to the rest of
+    the file if its size is known and grows by doubling otherwise (e.g. a pipe)
+    """
+    if not hasattr(fp, 'readinto'): return bytearray(fp.read())
+    try: size = os.fstat(fp.fileno()).st_size - fp.tell()
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation): size = 0
+    buf = bytearray(max(size + 1, 2**16)) # one byte more than the file size detects the end without a resize
+    nread = 0
+    while True:
+        if nread == len(buf): buf += bytearray(len(buf))
+        with memoryview(buf) as view: n = fp.readinto(view[nread:])
+        if not n: break
+        nread += n
+    del buf[nread:]
+    return buf
+
+def _rawArray(source, dtype, recshape, copy=False):
+    """All complete integrations of a raw file, an object supporting the buffer protocol (bytes, bytearray, mmap, numpy
+    array, ...) or a readable binary file object (e.g. sys.stdin.buffer), a partial trailing integration is ignored
+    copy: boolean, if true always return a writable array which does not share memory with source or the block cache,
+        default: False
+
+    returns: (nints, ...) numpy array, like numpy.frombuffer() a buffer is not copied, the array shares its memory with
+        the buffer and is read-only if the buffer is (e.g. bytes), a file object is read into a new writable buffer,
+        a file is read into a writable array (read-only if the block cache is enabled, see enableCache())
+    """
+    dtype = np.dtype(dtype)
+    recsize = int(np.prod(recshape))
+    if hasattr(source, 'read') and not _isBuffer(source): # a file object (mmap also has read())
+        source = _readStream(source)
+        copy = False # the buffer is not shared
+    if _isBuffer(source):
+        nints = memoryview(source).nbytes // (recsize * dtype.itemsize)
+        d = np.frombuffer(source, dtype=dtype, count=nints * recsize)
+    else:
+        def load():
+            nints = _rawInts(source, dtype, recshape)
+            d = np.fromfile(source, dtype=dtype, count=nints * recsize)
+            return np.reshape(d, (nints,) + tuple(recshape))
+        d = _cached(source, None, (dtype.str, tuple(recshape)), load)
+        if copy and not d.flags.writeable: d = d.copy() # a cached array
+        return d
+    if copy: d = d.copy()
+    return np.reshape(d, (nints,) + tuple(recshape))
+
+class RawParser(object):
+    """ Incremental parser of raw statistics data arriving in pieces of any size, e.g. reads from a pipe or a socket
+
+    Every feed() returns the integrations completed by the new data, the bytes of a partial integration are kept
+    until the next feed(). Data fed on integration boundaries is not copied.
+
+    Attributes:
+        dtype, recshape: data type and shape of an integration, see _recordSpec()
+        nints: int, number of integrations returned so far
+    """
+    def __init__(self, sclass, nant=96, npol=2, bitmode=8):
+        """sclass: str, statistics class, ACC, BST, SST or XST
+        nant, npol: int, number of antennas and polarizations (ACC, XST)
+        bitmode: int, beamlet bit-mode (BST)
+        """
+        self.dtype, self.recshape = _recordSpec(sclass, nant, npol, bitmode)
+        self._recbytes = int(np.prod(self.recshape)) * self.dtype.itemsize
+        self._pending = bytearray()
+        self.nints = 0
+
+    @property
+    def pending(self):
+        """number of bytes of a partial integration waiting for more data"""
+        return len(self._pending)
+
+    def feed(self, data):
+        """Add data to the stream
+        data: object supporting the buffer protocol (bytes, bytearray, mmap, numpy array, ...)
+
+        returns: (nints, ...) numpy array of the completed integrations, nints may be 0, an array of data fed on
+            integration boundaries shares its memory with data and is read-only if data is
+        """
+        data = memoryview(data).cast('B') # bytes of any buffer, e.g. a float numpy array
+        if len(self._pending) > 0:
+            self._pending.extend(data)
+            data = self._pending
+            self._pending = bytearray()
+        nbytes = len(data)
+        nints = nbytes // self._recbytes
+        if nints * self._recbytes < nbytes: self._pending.extend(data[nints * self._recbytes:])
+        dd = np.frombuffer(data, dtype=self.dtype, count=nints * int(np.prod(self.recshape)))
+        self.nints += nints
+        return np.reshape(dd, (nints,) + self.recshape)
+
+def iterRaw(fp, sclass, nant=96, npol=2, bitmode=8, nints=None):
+    """Iterate over blocks of integrations read from a readable binary file object (e.g. sys.stdin.buffer or a tarfile
+    member), partial reads from pipes are handled, a partial trailing integration at the end of the stream is ignored
+    fp: readable binary file object
+    sclass, nant, npol, bitmode: see RawParser
+    nints: int, maximum number of integrations per block, a short read yields the integrations completed so far,
+        default: None, blocks of at most about BLOCKBYTES
+
+    returns: generator of (nints, ...) numpy arrays
+    """
+    parser = RawParser(sclass, nant, npol, bitmode)
+    if nints is None: nints = _blockInts(parser.dtype, parser.recshape)
+    nbytes = nints * parser._recbytes
+    while True:
+        data = fp.read(nbytes - parser.pending)
+        if not data: break
+        dd = parser.feed(data)
+        if dd.shape[0] > 0: yield dd
+
+HASHBYTES = 2**22 # target size of the segments of integrations hashed independently by _RawHasher, in bytes
+
+def _hashInts(dtype, recshape):
+    """Number of integrations in a hash segment, the power of two closest below HASHBYTES
+    """
+    nints = max(1, HASHBYTES // (int(np.prod(recshape)) * np.dtype(dtype).itemsize))
+    return 1 << (nints.bit_length() - 1)
+
+class _RawHasher(object):
+    """Block consumer hashing the raw data of the integrations in the order they are streamed, see statData.rawFingerprint()
+
+    The integrations are hashed in segments of _hashInts() integrations and the fingerprint is the hash of the segment
+    digests, so shards starting on segment boundaries hash their own range and are merged in order. A hasher is pickled
+    with its digests, a partial last segment is closed when pickling and can not be extended.
+    """
+    def __init__(self, dtype, recshape):
+        self.segints = _hashInts(dtype, recshape)
+        self.nints = 0
+        self._digests = []
+        self._hash = hashlib.sha256()
+        self._closed = False
+
+    def __getstate__(self):
+        return {'segints': self.segints, 'nints': self.nints, 'digests': self._segmentDigests()}
+
+    def __setstate__(self, state):
+        self.segints = state['segints']
+        self.nints = state['nints']
+        self._digests = list(state['digests'])
+        self._hash = hashlib.sha256()
+        self._closed = (self.nints % self.segints) > 0
+
+    def prime(self, block):
+        pass
+
+    def update(self, block):
+        if self._closed and block.shape[0] > 0: raise ValueError('the last hash segment is closed, it can not be extended')
+        i0 = 0
+        while i0 < block.shape[0]:
+            n = min(block.shape[0] - i0, self.segints - self.nints % self.segints)
+            self._hash.update(np.ascontiguousarray(block[i0:i0 + n]).view(np.uint8))
+            self.nints += n
+            i0 += n
+            if self.nints % self.segints == 0:
+                self._digests.append(self._hash.digest())
+                self._hash = hashlib.sha256()
+
+    def merge(self, other):
+        """Append the segments of a hasher of the integrations following the ones of this hasher"""
+        if self.nints % self.segints > 0 or self.segints != other.segints:
+            raise ValueError('hashers can only be merged on hash segment boundaries')
+        self._digests += other._segmentDigests()
+        self.nints += other.nints
+        self._closed = other._closed or (self.nints % self.segints) > 0
+
+    def writeHDF5(self, h5, dimLabels=()):
+        pass # the fingerprint is written with the metadata
+
+    def _segmentDigests(self):
+        if self.nints % self.segints > 0 and not self._closed: return self._digests + [self._hash.digest()]
+        return list(self._digests)
+
+    def hexdigest(self):
+        return 'sha256t:' + hashlib.sha256(b''.join(self._segmentDigests())).hexdigest()
+
+def _chunkShape(shape, itemsize, target=None):
+    """Chunk shape of about target bytes (default: None, CHUNKBYTES), trailing dimensions are kept whole as long as they fit
+    """
+    if target is None: target = CHUNKBYTES
+    chunks = [1] * len(shape)
+    nbytes = itemsize
+    for ax in range(len(shape) - 1, -1, -1):
+        chunks[ax] = int(min(shape[ax], max(1, target // nbytes)))
+        nbytes *= chunks[ax]
+        if chunks[ax] < shape[ax]: break
+    return tuple(max(1, c) for c in chunks)
+
+def _createDataset(h5, shape, dtype, compression=None, shuffle=False, codec=None, dimLabels=()):
+    """Create the 'data' dataset of an HDF5 file, chunked and gzip compressed if compression (level 0-9) is set,
+    if codec is 'tpc' a variable length uint8 dataset of tpcEncode() blocks, written with _TPCWriter and read with _dataset()
+    """
+    if codec == 'tpc':
+        blockints = _tpcBlockInts(dtype, shape[1:])
+        dset = h5.create_dataset('data', shape=((shape[0] + blockints - 1) // blockints,), dtype=h5py.vlen_dtype(np.uint8))
+        dset.attrs['codec'] = 'tpc'
+        dset.attrs['codecformat'] = TPCFORMAT
+        dset.attrs['shape'] = shape
+        dset.attrs['dtype'] = np.dtype(dtype).str
+        dset.attrs['blockints'] = blockints
+        dset.attrs['dimlabels'] = list(dimLabels)
+        return dset
+    elif not (codec is None): raise ValueError('unknown codec %s, only tpc is supported'%codec)
+    # a data set without integrations can not be chunked, it has no chunks to compress
+    if compression is None or shape[0] == 0: return h5.create_dataset('data', shape=shape, dtype=dtype)
+    return h5.create_dataset('data', shape=shape, dtype=dtype, chunks=_chunkShape(shape, np.dtype(dtype).itemsize),
+                             compression='gzip', compression_opts=compression, shuffle=shuffle)
+
+class _ChunkCompressor(object):
+    """Compress the chunks of a gzip (and shuffle) filtered dataset with a pool of threads and write them with direct
+    chunk writes, bypassing the single threaded HDF5 filter pipeline, zlib releases the GIL so chunks are compressed
+    in parallel, the chunks are written in order by the calling thread so the file is read by any HDF5 reader
+    """
+    def __init__(self, dset, shuffle=False, nthreads=None):
+        from multiprocessing.pool import ThreadPool
+        self.dset = dset
+        self.level = dset.compression_opts
+        self.shuffle = shuffle
+        self.chunks = dset.chunks
+        self.nints = dset.shape[0]
+        self.blockints = dset.chunks[0]
+        self.pool = ThreadPool(nthreads)
+
+    def _encode(self, chunk):
+        # the HDF5 pipeline order: shuffle (group the bytes by position in the element), then deflate
+        if self.shuffle: chunk = np.ascontiguousarray(chunk.view(np.uint8).reshape(-1, chunk.dtype.itemsize).T)
+        return zlib.compress(chunk, self.level)
+
+    def write(self, offset, block):
+        """Write a block of integrations at integration offset of the dataset, offset must be a multiple of the chunk length
+        """
+        positions, chunks = [], []
+        for corner in itertools.product(*[range(0, n, c) for n, c in zip(block.shape, self.chunks)]):
+            chunk = block[tuple(slice(c, c + n) for c, n in zip(corner, self.chunks))]
+            if chunk.shape != self.chunks: # edge chunks are stored full size
+                full = np.zeros(self.chunks, dtype=block.dtype)
+                full[tuple(slice(0, n) for n in chunk.shape)] = chunk
+                chunk = full
+            positions.append((offset + corner[0],) + corner[1:])
+            chunks.append(np.ascontiguousarray(chunk, dtype=self.dset.dtype))
+        for pos, data in zip(positions, self.pool.imap(self._encode, chunks)):
+            self.dset.id.write_direct_chunk(pos, data)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+TPCBLOCKBYTES = 2**22 # target size of the blocks of integrations encoded independently by the time-predictive codec
+TPCFORMAT = ('tpc block: a mode byte and a zlib stream of the byte planes (byte k of every word, k = 0, 1, ... of '
+             'the little-endian words) of the (nints, nwords) block. mode 0: words of the dtype size (8 bytes for complex '
+             'values), integration i XORed with integration i - 1. mode 1: all values are exact integers stored as int64 '
+             '(real and imaginary parts for complex values), differences to integration i - 1, zigzag coded as uint64. '
+             'Decode: decompress, join the planes, undo the zigzag and prefix sum (or XOR) along the integrations')
+
+def _tpcWord(dtype):
+    """Unsigned integer type the codec predicts with, complex values are predicted as their real and imaginary parts"""
+    itemsize = np.dtype(dtype).itemsize
+    if itemsize % 8 == 0: return np.dtype('<u8')
+    return np.dtype('<u%i'%itemsize)
+
+def _tpcFloat(dtype):
+    """Float type of the values (or the real and imaginary parts of the complex values) of a float or complex type"""
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'c': return np.dtype('%sf%i'%(dtype.byteorder if dtype.byteorder in '<>' else '=', dtype.itemsize // 2))
+    return dtype
+
+def _tpcPlanes(x):
+    """Byte planes of an array of unsigned words, the bytes of the same position in each word are grouped"""
+    return np.ascontiguousarray(x.view(np.uint8).reshape(-1, x.dtype.itemsize).T)
+
+def _tpcIntegers(block):
+    """(nints, nvalues) int64 array of a float or complex block if all its values are exact integers, else None"""
+    if not (block.dtype.kind in 'fc'): return None
+    fl = _tpcFloat(block.dtype)
+    vals = block.view(fl).reshape(block.shape[0], int(np.prod(block.shape[1:])) * block.dtype.itemsize // fl.itemsize)
+    with np.errstate(invalid='ignore', over='ignore'):
+        ints = vals.astype(np.int64)
+        exact = np.array_equal(ints.astype(vals.dtype).view(np.uint8), vals.view(np.uint8)) # bit exact, rejects -0. and NaN
+    if exact: return ints
+    return None
+
+def tpcEncode(block, level=6):
+    """Lossless time-predictive encoding of a block of integrations, suited to slowly varying SST/BST power spectra
+    The station statistics are accumulated integer powers stored as floats: if all values of the block are exact
+    integers each integration is predicted by the previous one as integers, the zigzag coded differences have mostly
+    zero high bytes. Otherwise each integration is XORed with the previous one (the sign, exponent and leading
+    mantissa bits of similar values cancel). The words are split into byte planes and zlib compressed.
+    block: (nints, ...) numpy array
+    level: int, zlib compression level (1-9)
+
+    returns: bytes, a mode byte (0: XOR, 1: integer difference) followed by the zlib stream
+    """
+    block = np.ascontiguousarray(block)
+    ints = _tpcIntegers(block)
+    if ints is None:
+        word = _tpcWord(block.dtype)
+        u = block.view(word).reshape(block.shape[0], int(np.prod(block.shape[1:])) * block.dtype.itemsize // word.itemsize)
+        x = u.copy()
+        x[1:] ^= u[:-1]
+        return b'\x00' + zlib.compress(_tpcPlanes(x), level)
+    d = ints.copy()
+    d[1:] -= ints[:-1] # wraps around like the decoding cumulative sum
+    z = ((d << 1) ^ (d >> 63)).view(np.uint64) # zigzag, small negative differences have small codes
+    return b'\x01' + zlib.compress(_tpcPlanes(z.astype('<u8', copy=False)), level)
+
+def tpcDecode(buf, dtype, shape):
+    """Decode a block encoded with tpcEncode()
+    buf: bytes-like object
+    dtype, shape: numpy dtype and shape of the block
+
+    returns: numpy array
+    """
+    buf = memoryview(buf)
+    mode = bytes(buf[:1])
+    if mode == b'\x00':
+        word = _tpcWord(dtype)
+        planes = np.frombuffer(zlib.decompress(buf[1:]), dtype=np.uint8).reshape(word.itemsize, -1)
+        x = np.ascontiguousarray(planes.T).view(word).reshape(shape[0], int(np.prod(shape[1:])) * np.dtype(dtype).itemsize // word.itemsize)
+        np.bitwise_xor.accumulate(x, axis=0, out=x)
+        return x.view(dtype).reshape(shape)
+    elif mode == b'\x01':
+        planes = np.frombuffer(zlib.decompress(buf[1:]), dtype=np.uint8).reshape(8, -1)
+        nvals = int(np.prod(shape[1:])) * np.dtype(dtype).itemsize // _tpcFloat(dtype).itemsize
+        z = np.ascontiguousarray(planes.T).view('<u8').reshape(shape[0], nvals).astype(np.uint64)
+        d = (z >> np.uint64(1)).view(np.int64) ^ -(z & np.uint64(1)).view(np.int64)
+        ints = np.cumsum(d, axis=0, out=d)
+        return np.ascontiguousarray(ints.astype(_tpcFloat(dtype))).view(dtype).reshape(shape)
+    raise ValueError('unknown codec block mode %r'%mode)
+
+def _tpcBlockInts(dtype, recshape):
+    """Number of integrations per codec block"""
+    return max(1, TPCBLOCKBYTES // (int(np.prod(recshape)) * np.dtype(dtype).itemsize))
+
+class _TPCEncoder(object):
+    """Encode blocks of integrations with tpcEncode() in a pool of threads, zlib releases the GIL
+    """
+    def __init__(self, dtype, recshape, level=6, nthreads=None):
+        from multiprocessing.pool import ThreadPool
+        self.blockints = _tpcBlockInts(dtype, recshape)
+        self.level = level
+        self.pool = ThreadPool(nthreads)
+
+    def encode(self, block):
+        """Split block into codec blocks of blockints integrations and encode them, returns a list of bytes"""
+        parts = [block[i0:i0 + self.blockints] for i0 in range(0, block.shape[0], self.blockints)]
+        return self.pool.map(lambda part: tpcEncode(part, self.level), parts)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+class _TPCWriter(_TPCEncoder):
+    """Write blocks of integrations to a codec encoded 'data' dataset created with _createDataset(codec='tpc')
+    """
+    def __init__(self, dset, level=6, nthreads=None):
+        self.dset = dset
+        self.nints = int(dset.attrs['shape'][0])
+        super(_TPCWriter, self).__init__(np.dtype(dset.attrs['dtype']), tuple(dset.attrs['shape'][1:]), level, nthreads)
+
+    def write(self, offset, block):
+        """Write a block of integrations at integration offset, offset must be a multiple of blockints"""
+        for idx, payload in enumerate(self.encode(block)):
+            self.dset[offset // self.blockints + idx] = np.frombuffer(payload, dtype=np.uint8)
+
+_DimLabel = collections.namedtuple('_DimLabel', ['label'])
+
+class _CodedData(object):
+    """ Read access to a codec encoded 'data' dataset with the slicing and read_direct() interface of an h5py dataset,
+    only the blocks overlapping a selection are read, they are decoded by a pool of threads (zlib releases the GIL)
+    """
+    def __init__(self, dset):
+        self.dset = dset
+        self.attrs = dset.attrs
+        self.shape = tuple(int(n) for n in dset.attrs['shape'])
+        self.dtype = np.dtype(dset.attrs['dtype'])
+        self.blockints = int(dset.attrs['blockints'])
+        self.dims = [_DimLabel(label) for label in dset.attrs['dimlabels']]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _read(self, start, stop):
+        dd = np.empty((stop - start,) + self.shape[1:], dtype=self.dtype)
+        if stop <= start: return dd
+        bids = range(start // self.blockints, (stop - 1) // self.blockints + 1)
+        def decode(bid):
+            b0 = bid * self.blockints
+            n = min(self.blockints, self.shape[0] - b0)
+            block = tpcDecode(self.dset[bid], self.dtype, (n,) + self.shape[1:])
+            i0, i1 = max(start, b0), min(stop, b0 + n)
+            dd[i0 - start:i1 - start] = block[i0 - b0:i1 - b0]
+        if len(bids) == 1: decode(bids[0])
+        else:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(min(len(bids), os.cpu_count() or 1))
+            try: pool.map(decode, [bid for bid in bids]) # the blocks are read from HDF5 one at a time, h5py holds a lock
+            finally:
+                pool.close()
+                pool.join()
+        return dd
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple): key = (key,)
+        if len(key) == 0 or key[0] is Ellipsis: return self._read(0, self.shape[0])[key]
+        key, rest = key[0], key[1:]
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.shape[0])
+            if step < 0: dd = self._read(stop + 1, start + 1)[::step]
+            else: dd = self._read(start, stop)[::step]
+            return dd[(slice(None),) + rest]
+        idx = int(key)
+        if idx < 0: idx += self.shape[0]
+        return self._read(idx, idx + 1)[(0,) + rest]
+
+    def read_direct(self, dest, source_sel=None, dest_sel=None):
+        if source_sel is None: source_sel = np.s_[:]
+        if dest_sel is None: dest_sel = np.s_[...]
+        dest[dest_sel] = self[source_sel]
+
+def _dataset(h5):
+    """The 'data' dataset of an HDF5 file, decoded on read if it was written with a codec"""
+    dset = h5['data']
+    if 'codec' in dset.attrs: return _CodedData(dset)
+    return dset
+
+def _copyRawToDataset(filename, dtype, recshape, dset, start=0, consumers=(), compressor=None):
+    """Stream integrations [start, start + len(dset)) of a raw file into an HDF5 dataset block by block
+    consumers: list of block consumers (e.g. StreamStats), each block is passed to their update() method
+    compressor: _ChunkCompressor or _TPCWriter, encode and write each block in parallel, default: None, write with h5py
+    """
+    if compressor is None: stop = start + dset.shape[0]
+    else: stop = start + compressor.nints
+    nblock = _blockInts(dtype, recshape)
+    if not (compressor is None): nblock = max(1, nblock // compressor.blockints) * compressor.blockints # blocks of whole chunks
+    for i0 in range(start, stop, nblock):
+        i1 = min(i0 + nblock, stop)
+        block = _readRawRange(filename, dtype, recshape, i0, i1)
+        if compressor is None: dset[i0 - start:i1 - start] = block
+        else: compressor.write(i0 - start, block)
+        for consumer in consumers: consumer.update(block)
+
+def _writeShard(args):
+    """Pool worker, write integrations [start, stop) of a raw file to the 'data' dataset of an HDF5 shard file
+    """
+    rawfile, shardfile, dtype, recshape, start, stop, consumers, compression, shuffle, nthreads = args
+    with openHDF5(shardfile, 'w') as h5:
+        dset = _createDataset(h5, (stop - start,) + recshape, dtype, compression, shuffle)
+        compressor = None if dset.chunks is None else _ChunkCompressor(dset, shuffle, nthreads)
+        try:
+            _copyRawToDataset(rawfile, dtype, recshape, dset, start, consumers, compressor)
+        finally:
+            if not (compressor is None): compressor.close()
+    return shardfile, start, stop, consumers
+
+def _shardEdges(nints, nworkers, align=1, lastalign=None):
+    """Integration ranges of the shards of a data set, the shards start on multiples of align integrations
+    lastalign: int, the shards start at most at the last multiple of lastalign integrations before nints - lastalign + 1,
+        default: None, e.g. the time window of RFIFlagger which absorbs the left over integrations of the data set
+
+    returns: int array of the shard edges, shard sid covers [edges[sid], edges[sid + 1])
+    """
+    edges = np.round(np.linspace(0, nints, min(nworkers, nints) + 1) / align).astype(np.int64) * align
+    if lastalign is None: last = nints - 1
+    else: last = max(0, nints // lastalign - 1) * lastalign
+    last = last // align * align
+    edges = np.unique(np.clip(edges[:-1], 0, last))
+    return np.append(edges, nints)
+
+def _writeShards(filename, rawfile, dtype, recshape, nints, nworkers, consumers=(), compression=None, shuffle=False,
+                 nthreads=None, align=1, lastalign=None):
+    """Split a raw file by integration range and write each range to an HDF5 shard file with a pool of worker processes
+    filename: str, HDF5 filename the shards belong to, shards are named filename base + .shardNNN.h5
+    consumers: list of primed block consumers, each worker updates its own copy, e.g. a _RawHasher (shard edges on its
+        hash segment boundaries) so the raw file is only read once
+    compression, shuffle, nthreads: shard dataset compression, see statData.writeHDF5()
+    align, lastalign: shard edge alignment, see _shardEdges(), so block consumers which work on windows of
+        integrations (RFIFlagger) give the same result as a single process
+
+    returns: list of (shard filename, start integration, stop integration, worker block consumers)
+    """
+    import multiprocessing
+
+    base = os.path.splitext(filename)[0]
+    edges = _shardEdges(nints, nworkers, align, lastalign)
+    nshards = len(edges) - 1
+    if nshards < nworkers:
+        print('WARNING: shard edges are aligned to %i integrations, %i integrations are written by %i of %i worker processes'%(
+              align, nints, nshards, nworkers))
+    jobs = [(rawfile, '%s.shard%03i.h5'%(base, sid), dtype, recshape, int(edges[sid]), int(edges[sid + 1]), consumers,
+             compression, shuffle, nthreads) for sid in range(len(edges) - 1)]
+
+    pool = multiprocessing.Pool(nshards)
+    try:
+        shards = pool.map(_writeShard, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    return shards
+
+def _removeStaleShards(filename, keep=()):
+    """Remove the shard files of an HDF5 file (filename base + .shardNNN.h5) which are not in keep, e.g. the shards of
+    an earlier write of filename with more worker processes
+    """
+    import glob
+    import re
+
+    base = os.path.splitext(filename)[0]
+    keep = set(os.path.abspath(shardfile) for shardfile in keep)
+    for shardfile in glob.glob(glob.escape(base) + '.shard*.h5'):
+        if re.match(r'\.shard\d{3,}\.h5$', shardfile[len(base):]) and not (os.path.abspath(shardfile) in keep):
+            os.remove(shardfile)
+
+def extractRaw(filename, rawfile, append=False, start=0, stop=None):
+    """Copy the 'data' dataset of an HDF5 file to a raw data file block by block, the blocks are read with read_direct
+    into a single reused buffer so memory use does not depend on the size of the data set
+    filename: str, path to HDF5
+    rawfile: str, path to the output binary data file
+    append: boolean, if true append to rawfile, default: False, overwrite rawfile
+    start: int, first integration to copy, default: 0
+    stop: int, integration to stop at (exclusive), default: None, to the end of the data set
+
+    returns: int, number of integrations written
+    """
+    if not H5SUPPORT:
+        print('ERROR: HDF5 is not supported, you need to install h5py')
+        return 0
+
+    with openHDF5(filename) as h5:
+        dset = _dataset(h5)
+        dtype = dset.dtype.newbyteorder('<') # raw files are little-endian
+        if (stop is None) or (stop > dset.shape[0]): stop = dset.shape[0]
+        start = min(max(start, 0), stop)
+        nints = stop - start
+        nblock = min(max(nints, 1), _blockInts(dtype, dset.shape[1:]))
+        buf = np.empty((nblock,) + dset.shape[1:], dtype=dtype)
+        with open(rawfile, 'ab' if append else 'wb') as fh:
+            for i0 in range(start, stop, nblock):
+                n = min(nblock, stop - i0)
+                dset.read_direct(buf, source_sel=np.s_[i0:i0 + n], dest_sel=np.s_[0:n])
+                buf[:n].tofile(fh)
+
+    return nints
+
+TPCMAGIC = b'ISSTPC2\n' # start and end of a .tpc file
+
+def _tpcFooter(fh):
+    """Read the footer of an open .tpc file"""
+    fh.seek(-(8 + len(TPCMAGIC)), os.SEEK_END)
+    tail = fh.read(8 + len(TPCMAGIC))
+    if tail[8:] != TPCMAGIC: raise ValueError('not a .tpc file, or an incomplete one')
+    nfooter = int(np.frombuffer(tail[:8], dtype='<u8')[0])
+    fh.seek(-(8 + len(TPCMAGIC) + nfooter), os.SEEK_END)
+    return json.loads(fh.read(nfooter).decode('utf-8'))
+
+def tpc2npy(filename, start=0, stop=None):
+    """Read integrations from a .tpc file written with statData.writeTPC(), only the codec blocks overlapping
+    [start, stop) are read and decoded
+    filename: str, path to .tpc file
+    start: int, first integration, default: 0
+    stop: int, integration to stop at (exclusive), default: None, to the last integration
+
+    returns: (nints, ...) numpy array, the same array as the *2npy() reader of the raw data file
+    """
+    with open(filename, 'rb') as fh:
+        footer = _tpcFooter(fh)
+        shape = tuple(footer['shape'])
+        dtype = np.dtype(footer['dtype'])
+        blockints = footer['blockints']
+        if (stop is None) or (stop > shape[0]): stop = shape[0]
+        start = min(max(start, 0), stop)
+        dd = np.empty((stop - start,) + shape[1:], dtype=dtype)
+        if stop > start:
+            for bid in range(start // blockints, (stop - 1) // blockints + 1):
+                b0 = bid * blockints
+                n = min(blockints, shape[0] - b0)
+                fh.seek(footer['offsets'][bid])
+                nbytes = int(np.frombuffer(fh.read(8), dtype='<u8')[0])
+                block = tpcDecode(fh.read(nbytes), dtype, (n,) + shape[1:])
+                i0, i1 = max(start, b0), min(stop, b0 + n)
+                dd[i0 - start:i1 - start] = block[i0 - b0:i1 - b0]
+    return dd
+
+def readTPC(filename, getdata=False):
+    """Read a .tpc file and return a class instance of the meta data and the data (optional)
+    filename: str, path to .tpc file
+    getdata: boolean, if true return the decoded data as a numpy array also
+
+    returns: statData instance, numpy array (optional)
+    """
+    with open(filename, 'rb') as fh:
+        s = _fromDict(_tpcFooter(fh)['meta'])
+    if getdata: return s, _cached(filename, 'tpc', None, lambda: tpc2npy(filename))
+    else: return s
+
+def _writeRaw(dd, filename, dtype, append=False):
+    """Write an array to a binary raw file, the array is only converted (copied) if it is not already of dtype
+    """
+    with open(filename, 'ab' if append else 'wb') as fh:
+        np.asarray(dd, dtype=dtype).tofile(fh)
+
+SHMHEADER = 64 # bytes at the start of a shared memory block holding the reference count, the data is 64 byte aligned
+
+def _shmLockName(name):
+    import tempfile
+    return os.path.join(tempfile.gettempdir(), 'issformat_%s.lock'%name.lstrip('/'))
+
+def _unlinkSharedMemory(shm):
+    """Unlink a shared memory block opened with _openSharedMemory()"""
+    try:
+        from multiprocessing import resource_tracker
+        # python < 3.13 unlink() also unregisters the block from the resource tracker, register it again first
+        if not _SHMTRACKARG: resource_tracker.register(shm._name, 'shared_memory')
+    except (ImportError, AttributeError):
+        pass
+    shm.unlink()
+
+_SHMTRACKARG = None # True if SharedMemory supports track=False (python >= 3.13), set on first use
+
+def _openSharedMemory(name=None, size=0):
+    """Create (name is None) or attach to a shared memory block, the block is not registered with the multiprocessing
+    resource tracker, its lifetime is managed by the SharedData reference count
+    """
+    global _SHMTRACKARG
+    from multiprocessing import shared_memory
+    create = name is None
+    try:
+        shm = shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+        _SHMTRACKARG = True
+        return shm
+    except TypeError: # python < 3.13, unregister from the resource tracker by hand
+        _SHMTRACKARG = False
+        shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except (ImportError, AttributeError):
+            pass
+        return shm
+
+class SharedData(object):
+    """ Statistics data in a shared memory block, handed to other processes as a small descriptor instead of pickling the array
+
+    The block starts with a reference count (SHMHEADER bytes) updated under a file lock, each descriptor() adds a
+    reference which the receiving process takes over with attachShared() and gives back with release(), the block is
+    unlinked when the last reference is released. Create instances with shareData() or attachShared().
+
+    Attributes:
+        name: str, shared memory block name
+        data: numpy array in the shared memory block, drop any other references to it before release()
+        meta: statData instance of the metadata
+    """
+    def __init__(self, shm, shape, dtype, meta):
+        self._shm = shm
+        self.name = shm.name
+        self.data = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=SHMHEADER)
+        self.meta = meta
+
+    def _addRef(self, count):
+        """Add count to the reference count, returns the new count"""
+        with open(_shmLockName(self.name), 'a') as fp:
+            _lockFile(fp)
+            try:
+                ref = np.ndarray((1,), dtype=np.int64, buffer=self._shm.buf)
+                ref[0] += count
+                nref = int(ref[0])
+                del ref
+            finally:
+                _unlockFile(fp)
+        return nref
+
+    def refcount(self):
+        ref = np.ndarray((1,), dtype=np.int64, buffer=self._shm.buf)
+        nref = int(ref[0])
+        del ref
+        return nref
+
+    def descriptor(self):
+        """Descriptor to send to another process, adds a reference which the receiver must attachShared() and release()
+
+        returns: dict with the block name, data shape, dtype and metadata dictionary (JSON serialisable)
+        """
+        self._addRef(1)
+        return {'name': self.name, 'shape': list(self.data.shape), 'dtype': self.data.dtype.str, 'meta': self.meta._buildDict()}
+
+    def release(self):
+        """Give back this process's reference, the block is unlinked when no references remain
+        """
+        if self._shm is None: return
+        nref = self._addRef(-1)
+        self.data = None
+        self._shm.close()
+        if nref <= 0:
+            _unlinkSharedMemory(self._shm)
+            try: os.remove(_shmLockName(self.name))
+            except OSError: pass
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+def shareData(s, start=0, stop=None, filename=None):
+    """Read integrations [start, stop) straight into a new shared memory block, without an intermediate array
+    s: statData instance, the data is read from its raw data file
+    start: int, first integration, default: 0
+    stop: int, integration to stop at (exclusive), default: None, to the last integration
+    filename: str, HDF5 file to read the 'data' dataset from instead of the raw data file, default: None
+
+    returns: SharedData instance holding one reference
+    """
+    dtype, recshape = s._rawRecord()
+    if filename is None: nints = s.rawInts()
+    else:
+        with openHDF5(filename) as h5: nints = _dataset(h5).shape[0]
+    if (stop is None) or (stop > nints): stop = nints
+    start = min(max(start, 0), stop)
+    shape = (stop - start,) + recshape
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+
+    shm = _openSharedMemory(size=SHMHEADER + max(nbytes, 1))
+    sd = SharedData(shm, shape, dtype, s)
+    try:
+        sd._addRef(1)
+        if filename is None:
+            with open(s._pathrawfile, 'rb') as fh:
+                fh.seek(start * int(np.prod(recshape)) * dtype.itemsize)
+                fh.readinto(shm.buf[SHMHEADER:SHMHEADER + nbytes])
+        elif stop > start:
+            with openHDF5(filename) as h5: _dataset(h5).read_direct(sd.data, source_sel=np.s_[start:stop])
+    except Exception:
+        sd.release()
+        raise
+    return sd
+
+def attachShared(descriptor):
+    """Attach to a shared memory block from a SharedData.descriptor(), taking over the reference the descriptor holds
+
+    returns: SharedData instance
+    """
+    shm = _openSharedMemory(name=descriptor['name'])
+    return SharedData(shm, tuple(descriptor['shape']), np.dtype(descriptor['dtype']), _fromDict(descriptor['meta']))
+
+def acc2npy(filename, nant=96, npol=2, copy=False):
     """Read an ACC file and return a numpy array
-    filename: str, path to binary data file
+    filename: str, path to binary data file, or an object supporting the buffer protocol (bytes, mmap, numpy array, ...)
+        or a readable binary file object with the raw data
     nant: int, number of antennas/tiles in the array, 96 for an international station, 48 for KAIRA
     npol: int, number of polarizations, typically 2
+    copy: boolean, if true return a writable copy of a buffer (or of a cached array), default: False, see _rawArray()
 
     returns: (nints, nsb, nant*npol, nant*npol) complex array
     """
-    nantpol = nant * npol
-    nsb = 512 # ACC have 512 subbands
-    nints = 1 # ACC only have a single integration
-    corrMatrix = np.fromfile(filename, dtype='complex') # read in the correlation matrix
-    return np.reshape(corrMatrix, (nints, nsb, nantpol, nantpol))
+    return _rawArray(filename, *_recordSpec('ACC', nant, npol), copy=copy) # ACC have 512 subbands and a single integration
 
-def npy2acc(dd, filename):
+def npy2acc(dd, filename, append=False):
     """Write a correlation matrix numpy array to a binary raw file
     dd: complex numpy array, correlation matrix of shape (1, 512, nantpol, nantpol)
     filename: str, path to binary data file
+    append: boolean, if true append the integrations to filename, default: False, overwrite filename
     """
-    fh = open(filename, 'wb')
-    dd.astype('complex').tofile(fh)
-    fh.close()
+    _writeRaw(dd, filename, '<c16', append)
 
-def bst2npy(filename, bitmode=8):
+def bst2npy(filename, bitmode=8, copy=False):
     """Read an BST file and return a numpy array
-    filename: str, path to binary data file
+    filename: str, path to binary data file, or an object supporting the buffer protocol (bytes, mmap, numpy array, ...)
+        or a readable binary file object with the raw data
     bitmode: int, 16 produces 244 beamlets, 8 produces 488 beamlets, 4 produces 976 beamlets
+    copy: boolean, if true return a writable copy of a buffer (or of a cached array), default: False, see _rawArray()
 
     returns: (nints, nbeamlets) float array
     """
-    if bitmode==16: nbeamlets = 244
-    elif bitmode==8: nbeamlets = 488
-    elif bitmode==4: nbeamlets = 976
-    else:
-        print('WARNING: bit-mode %i not standard, only (16, 8, 4) in use, defaulting to 8 bit.')
-        nbeamlets = 488
-    d = np.fromfile(filename, dtype='float')
-    nints = d.shape[0] / nbeamlets
-    return np.reshape(d, (nints, nbeamlets))
+    return _rawArray(filename, *_recordSpec('BST', bitmode=bitmode), copy=copy)
 
-def npy2bst(dd, filename):
+def npy2bst(dd, filename, append=False):
     """Write a BST numpy array to a binary raw file
     dd: float numpy array of shape (nints, nbeamlets)
     filename: str, path to binary data file
+    append: boolean, if true append the integrations to filename, default: False, overwrite filename
     """
-    fh = open(filename, 'wb')
-    dd.astype('float').tofile(fh)
-    fh.close()
+    _writeRaw(dd, filename, '<f8', append)
 
-def sst2npy(filename):
+def sst2npy(filename, copy=False):
     """Read an SST file and return a numpy array
-    filename: str, path to binary data file
+    filename: str, path to binary data file, or an object supporting the buffer protocol (bytes, mmap, numpy array, ...)
+        or a readable binary file object with the raw data
+    copy: boolean, if true return a writable copy of a buffer (or of a cached array), default: False, see _rawArray()
 
     returns (nints, 512) float array
     """
-    nsb = 512 # SST have 512 subbands
-    d = np.fromfile(filename, dtype='float')
-    nints = d.shape[0] / 512
-    return np.reshape(d, (nints, nsb))
+    return _rawArray(filename, *_recordSpec('SST'), copy=copy) # SST have 512 subbands
 
-def npy2sst(dd, filename):
+def npy2sst(dd, filename, append=False):
     """Write a SST numpy array to a binary raw file
     dd: float numpy array of shape (nints, 512)
     filename: str, path to binary data file
+    append: boolean, if true append the integrations to filename, default: False, overwrite filename
     """
-    fh = open(filename, 'wb')
-    dd.astype('float').tofile(fh)
-    fh.close()
+    _writeRaw(dd, filename, '<f8', append)
 
-def xst2npy(filename, nant=96, npol=2):
+def xst2npy(filename, nant=96, npol=2, copy=False):
     """Read an XST file and return a numpy array
-    filename: str, path to binary data file
+    filename: str, path to binary data file, or an object supporting the buffer protocol (bytes, mmap, numpy array, ...)
+        or a readable binary file object with the raw data
     nant: int, number of antennas/tiles in the array, 96 for an international station, 48 for KAIRA
     npol: int, number of polarizations, typically 2
+    copy: boolean, if true return a writable copy of a buffer (or of a cached array), default: False, see _rawArray()
 
     returns: (nints, nsb, nant*npol, nant*npol) complex array
     """
-    nantpol = nant * npol
-    nsb = 1 # XST only have a single subband
-    corrMatrix = np.fromfile(filename, dtype='complex') # read in the correlation matrix
-    nints = corrMatrix.shape[0]/(nantpol * nantpol) # number of integrations
-    return np.reshape(corrMatrix, (nints, nsb, nantpol, nantpol))
+    return _rawArray(filename, *_recordSpec('XST', nant, npol), copy=copy) # XST only have a single subband
 
-def npy2xst(dd, filename):
+def npy2xst(dd, filename, append=False):
     """Write a correlation matrix numpy array to a binary raw file
     dd: complex numpy array, correlation matrix of shape (nints, 1, nantpol, nantpol)
     filename: str, path to binary data file
+    append: boolean, if true append the integrations to filename, default: False, overwrite filename
     """
-    fh = open(filename, 'wb')
-    dd.astype('complex').tofile(fh)
-    fh.close()
+    _writeRaw(dd, filename, '<c16', append)
 
 
 if __name__ == '__main__':
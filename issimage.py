@@ -0,0 +1,141 @@
+"""
+All-sky quick-look imaging of LOFAR station XST correlation matrices
+
+Images are formed by direct Fourier transform (beamforming) of the XST correlation matrices on a grid of (l, m)
+direction cosines. The steering matrix of a (station, subband, grid) is computed once and kept in a size-bounded
+LRU cache, many integrations are then imaged at once as batched matrix products.
+
+Antenna positions are supplied by the user as local (east, north, up) offsets in metres, in the same order as the
+antennas in the correlation matrix.
+"""
+
+# python 2 and 3 support
+from __future__ import print_function
+
+import collections
+import hashlib
+import numpy as np
+
+import issformat
+
+C = 299792458. # speed of light, m/s
+
+# rcumode: (sampling clock in MHz, Nyquist zone)
+RCUMODE_BANDS = {1: (200., 1), 2: (200., 1), 3: (200., 1), 4: (200., 1), 5: (200., 2), 6: (160., 3), 7: (200., 3)}
+
+def subbandFreq(sb, rcumode=3):
+    """Centre frequency of a subband
+    sb: int, subband ID (0-511)
+    rcumode: int, RCU mode (1-7), a list of RCU modes uses the most common mode
+
+    returns: frequency in Hz
+    """
+    if not (type(rcumode) is int): rcumode = collections.Counter(rcumode).most_common(1)[0][0]
+    clock, zone = RCUMODE_BANDS[rcumode]
+    return ((zone - 1) * clock / 2. + sb * clock / 1024.) * 1e6
+
+def lmGrid(npix):
+    """(l, m) direction cosine grid covering the whole sky
+    npix: int, number of pixels on a side
+
+    returns: l, m (npix, npix) arrays, boolean (npix, npix) array of the pixels above the horizon
+    """
+    lm = np.linspace(-1., 1., npix)
+    m, l = np.meshgrid(lm, lm, indexing='ij')
+    return l, m, (l**2 + m**2) < 1.
+
+class SteeringCache(issformat.BlockCache):
+    """ Size-bounded least recently used cache of steering matrices, see issformat.BlockCache
+    """
+    pass
+
+_steeringCache = SteeringCache() # shared by all XSTImager instances unless they are given their own cache
+
+class XSTImager(object):
+    """ Batched all-sky imager for XST data
+
+    Attributes:
+        antpos: (nant, 3) float array, antenna (east, north, up) positions in metres
+        npix: int, number of image pixels on a side
+        cache: SteeringCache instance
+    """
+    def __init__(self, antpos, npix=64, cache=None):
+        self.antpos = np.asarray(antpos, dtype=float)
+        self.npix = npix
+        if cache is None: self.cache = _steeringCache
+        else: self.cache = cache
+        self.l, self.m, self.sky = lmGrid(npix)
+        self._poskey = hashlib.sha1(self.antpos.tobytes()).hexdigest() # antenna positions are part of the grid key
+
+    def steering(self, freq, station=None, sb=None):
+        """Steering matrix for the pixels above the horizon, computed on a cache miss
+        freq: float, frequency in Hz
+        station, sb: station ID and subband ID, used with freq as the cache key
+
+        returns: (nant, npixsky) complex64 array
+        """
+        key = (station, sb, float(freq), self.npix, self._poskey)
+        return self.cache.get(key, lambda: self._steering(freq))
+
+    def _steering(self, freq):
+        l, m = self.l[self.sky], self.m[self.sky]
+        n = np.sqrt(1. - l**2 - m**2)
+        lmn = np.vstack([l, m, n]) # (3, npixsky)
+        phase = (-2. * np.pi * freq / C) * np.dot(self.antpos, lmn)
+        return np.exp(1j * phase).astype(np.complex64)
+
+    def image(self, dd, freq, station=None, sb=None, npol=2, pol='I', nbatch=64):
+        """Image a set of XST integrations
+        dd: (nints, 1, nant*npol, nant*npol) or (nints, nant*npol, nant*npol) complex array, see issformat.xst2npy()
+        freq: float, frequency in Hz
+        station, sb: station ID and subband ID, used for caching
+        npol: int, number of polarizations, polarizations are interleaved in the correlation matrix
+        pol: str, 'XX', 'YY' or 'I' (XX + YY)
+        nbatch: int, number of integrations imaged per matrix product
+
+        returns: (nints, npix, npix) float32 array of images, NaN below the horizon
+        """
+        dd = np.asarray(dd)
+        dd = dd.reshape((dd.shape[0],) + dd.shape[-2:])
+        if pol == 'XX': pols = [0]
+        elif pol == 'YY': pols = [1]
+        elif pol == 'I': pols = [0, 1]
+        else: raise ValueError('unknown polarization %s, use XX, YY or I'%pol)
+
+        wt = self.steering(freq, station, sb)
+        wconj = wt.conj()
+        imgs = np.full((dd.shape[0], self.npix, self.npix), np.nan, dtype=np.float32)
+        for i0 in range(0, dd.shape[0], nbatch):
+            sky = 0.
+            for p in pols:
+                vis = dd[i0:i0 + nbatch, p::npol, p::npol].astype(np.complex64)
+                # I(p) = Re(w(p)^H V w(p)) for every integration of the batch
+                sky = sky + np.einsum('ap,tap->tp', wconj, np.matmul(vis, wt), optimize=True).real
+            imgs[i0:i0 + nbatch][:, self.sky] = sky
+        return imgs
+
+    def imageXST(self, xst, start=0, stop=None, pol='I', nbatch=64):
+        """Image the integrations [start, stop) of the raw data file of an XST instance, streaming the raw file
+        xst: issformat.XST instance with rawfile, subband and rcumode set
+        start: int, first integration, default: 0
+        stop: int, integration to stop at (exclusive), default: None, to the end of the file
+
+        returns: (nints, npix, npix) float32 array of images, NaN below the horizon
+        """
+        if (xst.sb is None) or (xst.rcumode is None):
+            print('ERROR: the XST subband and rcumode are needed to compute the observing frequency')
+            return None
+        if xst.nants != self.antpos.shape[0]:
+            print('WARNING: %i antennas in the XST data, %i antenna positions'%(xst.nants, self.antpos.shape[0]))
+
+        freq = subbandFreq(xst.sb, xst.rcumode)
+        dtype, recshape = xst._rawRecord()
+        if stop is None: stop = xst.rawInts()
+        nblock = max(nbatch, (issformat._blockInts(dtype, recshape) // nbatch) * nbatch)
+
+        imgs = []
+        for i0 in range(start, stop, nblock):
+            dd = xst.readRawRange(i0, min(i0 + nblock, stop))
+            imgs.append(self.image(dd, freq, xst.station, xst.sb, npol=xst.npol, pol=pol, nbatch=nbatch))
+        if len(imgs) == 0: return np.zeros((0, self.npix, self.npix), dtype=np.float32)
+        return np.concatenate(imgs, axis=0)
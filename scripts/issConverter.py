@@ -14,22 +14,45 @@ Input options override JSON/HDF5 input metadata, to override an option to be typ
 from __future__ import print_function
 
 import sys,os
-import issformat
-import pkg_resources  # part of setuptools, for version
 
-if __name__ == '__main__':
+def buildParser():
+    """Command line option parser"""
     from optparse import OptionParser
     o = OptionParser()
-    o.set_usage('%prog [options] JSON/HDF5/dat files')
+    o.set_usage('%prog [options] JSON/HDF5/TPC/dat files')
     o.set_description(__doc__)
     o.add_option('-o', '--outputtype', dest='outputType', default=None,
-        help = 'Type of file to output, can be multiple with comma separated list: hdf5, json, raw, default: None')
+        help = 'Type of file to output, can be multiple with comma separated list: hdf5, json, jsonl (append to a JSON-lines manifest, see --manifest), raw, tpc (raw data losslessly compressed with the time-predictive codec), default: None')
     o.add_option('--obasename', dest='obasename', default=None,
         help = 'Output filename base, e.g. --outputtype=json --obasename=basename will return basename.json. default: if --rawfile is set, use the same file basename, else \'meta\'')
+    o.add_option('--manifest', dest='manifest', default=None,
+        help = 'JSON-lines manifest file the jsonl output type appends to, default: one manifest per --manifest-per in the directory of --obasename')
+    o.add_option('--manifest-per', dest='manifestPer', default='day', choices=['day', 'station', 'observation'],
+        help = 'Default manifest of the jsonl output type: one per day (YYYYMMDD.jsonl), station and day (STATION_YYYYMMDD.jsonl) or observation (STATION_OBSERVATION_DATATYPE.jsonl, see --observation), default: day')
+    o.add_option('--observation', dest='observation', default=None,
+        help = 'Observation identifier of the per observation manifest (--manifest-per observation), set the same identifier for all raw files of an observation, default: None, the timestamp of the raw file')
     o.add_option('--print', dest='printMeta', action='store_true',
         help = 'Print metadata')
     o.add_option('--force', dest='force', action='store_true',
         help = 'Force overwriting of an already existing metadata file, otherwise skip')
+    o.add_option('--incremental', dest='incremental', action='store_true',
+        help = 'Only convert if the raw data changed: an existing JSON or HDF5 output is skipped if the raw data file matches the fingerprint (hash, size, modification time) stored in it, outputs without a fingerprint are overwritten, metadata option changes alone do not trigger a conversion')
+    o.add_option('--stats', dest='stats', action='store_true',
+        help = '(BST, SST, XST) Compute summary statistics over time (mean, variance, min, max, quantiles) while writing HDF5 output and store them in the HDF5 file')
+    o.add_option('--flags', dest='flags', action='store_true',
+        help = '(BST, SST) Generate bit-packed RFI flags while writing HDF5 output and store them in the HDF5 file')
+    o.add_option('--polproducts', dest='polproducts', default=None, choices=['linear', 'stokes', 'I'],
+        help = '(ACC, XST) Also write the per-baseline polarisation products of the unique baselines to the HDF5 output: linear (XX, XY, YX, YY), stokes (I, Q, U, V) or I (Stokes I only), default: None')
+    o.add_option('--compress', dest='compress', default=None, type=int,
+        help = 'gzip compression level (0-9) of the HDF5 data set, chunks are compressed in parallel by --nthreads threads, default: None (no compression)')
+    o.add_option('--shuffle', dest='shuffle', action='store_true',
+        help = 'Apply the HDF5 byte shuffle filter before compression (--compress), usually improves the compression of float data')
+    o.add_option('--codec', dest='codec', default=None, choices=['tpc'],
+        help = 'Store the HDF5 data set with a lossless codec instead of gzip, tpc: time-predictive codec, the blocks are stored in a variable length uint8 data set with the format described in its attributes, issformat decodes it transparently, default: None')
+    o.add_option('--nthreads', dest='nthreads', default=None, type=int,
+        help = 'Number of compression threads per process, default: None (number of CPUs)')
+    o.add_option('--nworkers', dest='nworkers', default=None, type=int,
+        help = 'Number of worker processes used to write HDF5 output, if greater than 1 the data is written to per-worker shard files (OBASENAME.shardNNN.h5) joined by a virtual dataset in the HDF5 file, shard files of an earlier conversion which are no longer used are removed, shards hold whole hash segments (about 4 MB of raw data) so small files use fewer workers, default: None (single process)')
 
     o.add_option('--standard', dest='standard', action='store_true',
         help = 'Assume the standard filenaming format for the input rawfile, the timestamp and data class can be determined from this. Additional information RCU (SST), pol (BST), subband (XST) is also extracted. Note: this option overrides an input JSON or HDF5 file. Example standard formats: 20120611_124534_acc_512x192x192.dat (ACC) 20170217_111340_bst_00X.dat (BST) 20140430_153356_sst_rcu024.dat (SST) 20170728_184348_sb180_xst.dat (XST) 20170728_184348_xst.dat (XST)')
@@ -65,33 +88,54 @@ if __name__ == '__main__':
         help = 'Timestamp of format YYYY-MM-DD HH:MM:SS or YYYYMMDD_HHMMSS, default: None')
     o.add_option('-v', '--version', action='store_true',
         help = 'Print version and exit')
-    opts, args = o.parse_args(sys.argv[1:])
+    o.add_option('--socket', dest='socket', default=None,
+        help = 'Run the conversion in a conversion daemon (see --serve) listening on this Unix domain socket, avoiding the Python and module start up time, falls back to a local conversion if the daemon is not running, default: None')
+    o.add_option('--serve', dest='serve', default=None,
+        help = 'Start a long-lived conversion daemon listening for jobs on this Unix domain socket, default: None')
+    return o
+
+def main(argv):
+    """Run a conversion
+    argv: list of str, command line arguments without the program name
+
+    returns: int, exit status
+    """
+    import issformat
+
+    o = buildParser()
+    opts, args = o.parse_args(argv)
 
     if opts.version:
+        import pkg_resources  # part of setuptools, for version
         print('Version', pkg_resources.require('issformat')[0].version)
-        exit()
+        return 0
 
     # Parse output types
     if opts.outputType is None: outputTypes = []
     else: outputTypes = opts.outputType.split(',')
     # Check that outputTypes are valid
-    valOutputTypes = ['json', 'hdf5', 'raw']
+    valOutputTypes = ['json', 'jsonl', 'hdf5', 'raw', 'tpc']
     for otype in outputTypes:
         if not (otype in valOutputTypes):
             print('WARNING: %s output type unknown, only valid types are:'%otype, valOutputTypes)
 
     dd = None # extracted data
+    h5in = None # HDF5 input, the raw output is streamed from its data set
     s = None # meta data class instance
 
     # read in inputs
     for fn in args:
         if fn.endswith('.h5'): # HDF5
-            if 'raw' in outputTypes: # extract data
-                s, dd = issformat.read(fn, getdata=True)
-            else:
-                s = issformat.read(fn)
+            s = issformat.read(fn)
+            h5in = fn
+        elif fn.endswith('.tpc'): # codec compressed raw data
+            if 'raw' in outputTypes: s, dd = issformat.read(fn, getdata=True) # decode data
+            else: s = issformat.read(fn)
         elif fn.endswith('.json'): # JSON
             s = issformat.read(fn)
+        elif fn.endswith('.jsonl'): # JSON-lines manifest, the record is selected by --rawfile
+            if opts.rawfile is None: print('WARNING: --rawfile option not set, record in %s unknown, skipping file read'%fn)
+            else: s = issformat.read(fn, record=os.path.basename(opts.rawfile))
         elif fn.endswith('.dat'): # raw statistics file
             if opts.sclass is None:
                 print('WARNING: --sclass option not set, class unknown, skipping file read')
@@ -136,7 +180,7 @@ if __name__ == '__main__':
 
     if (opts.sclass is None) and (s is None):
         print('ERROR: --sclass is nor defined and there is no input metadata file, can not go on.')
-        exit()
+        return 1
 
     elif not(s is None): # check for any options override
         if not(opts.station is None):
@@ -260,26 +304,176 @@ if __name__ == '__main__':
             obasename = os.path.splitext(rawfile)[0] 
     else: obasename = opts.obasename
 
+    def skipOutput(ofile):
+        """True if an existing output file is kept"""
+        if not os.path.exists(ofile) or opts.force: return False
+        if opts.incremental and not (s.rawfile is None) and os.path.exists(s._pathrawfile):
+            old = issformat.read(ofile)
+            stored = (old.rawsize, old.rawmtime)
+            if old.rawUnchanged(s._pathrawfile):
+                # same content with a new modification time, store it so the raw data is not hashed on the next run
+                if (old.rawsize, old.rawmtime) != stored: issformat.writeFingerprint(ofile, old)
+                print('%s is up to date, skipping'%ofile)
+                return True
+            print('%s: raw data changed or no fingerprint stored, converting'%ofile)
+            return False
+        print('WARNING: %s exists, skipping. Use --force option to overwrite'%ofile)
+        return True
+
     if 'raw' in outputTypes:
         oraw = obasename + '.dat'
         if not os.path.exists(oraw) or opts.force:
             print('Writing data to RAW', oraw)
-            if type(s).__name__=='ACC': issformat.npy2acc(oraw)
-            elif type(s).__name__=='BST': issformat.npy2bst(oraw)
-            elif type(s).__name__=='SST': issformat.npy2sst(oraw)
-            elif type(s).__name__=='XST': issformat.npy2xst(oraw)
+            if not (h5in is None): issformat.extractRaw(h5in, oraw)
+            elif dd is None: print('WARNING: no HDF5 or raw data input, no data to write to %s'%oraw)
+            elif type(s).__name__=='ACC': issformat.npy2acc(dd, oraw)
+            elif type(s).__name__=='BST': issformat.npy2bst(dd, oraw)
+            elif type(s).__name__=='SST': issformat.npy2sst(dd, oraw)
+            elif type(s).__name__=='XST': issformat.npy2xst(dd, oraw)
         else: print('WARNING: %s exists, skipping. Use --force option to overwrite'%oraw)
 
+    # HDF5 first, the raw data fingerprint computed while writing it is then also written to the metadata outputs
+    if 'hdf5' in outputTypes:
+        ohdf5 = obasename + '.h5'
+        if not skipOutput(ohdf5):
+            print('Writing data to HDF5', ohdf5)
+            s.writeHDF5(ohdf5, nworkers=opts.nworkers, stats=opts.stats, flags=opts.flags,
+                        compression=opts.compress, shuffle=opts.shuffle, nthreads=opts.nthreads, codec=opts.codec)
+            if not (opts.polproducts is None):
+                if type(s).__name__ in ['ACC', 'XST']: issformat.polProductsHDF5(ohdf5, ohdf5, products=opts.polproducts, compression=opts.compress)
+                else: print('WARNING: polarisation products are only supported for ACC and XST data')
+
+    if 'tpc' in outputTypes:
+        otpc = obasename + '.tpc'
+        if not skipOutput(otpc):
+            print('Writing data to TPC', otpc)
+            s.writeTPC(otpc, nthreads=opts.nthreads)
+
+    def fingerprint():
+        """In incremental mode make sure the metadata outputs carry the raw data fingerprint"""
+        if opts.incremental and (s.rawhash is None) and not (s.rawfile is None) and os.path.exists(s._pathrawfile):
+            s.setFingerprint(*s.rawFingerprint())
+
     if 'json' in outputTypes:
         ojson = obasename + '.json'
-        if not os.path.exists(ojson) or opts.force:
+        if not skipOutput(ojson):
             print('Writing data to JSON', ojson)
+            fingerprint()
             s.writeJSON(ojson)
-        else: print('WARNING: %s exists, skipping. Use --force option to overwrite'%ojson)
-    if 'hdf5' in outputTypes:
-        ohdf5 = obasename + '.h5'
-        if not os.path.exists(ohdf5) or opts.force:
-            print('Writing data to HDF5', ohdf5)
-            s.writeHDF5(ohdf5)
-        else: print('WARNING: %s exists, skipping. Use --force option to overwrite'%ohdf5)
+    if 'jsonl' in outputTypes:
+        if opts.manifest is None: omanifest = issformat.manifestName(s, directory=os.path.dirname(obasename), per=opts.manifestPer,
+                                                          observation=opts.observation)
+        else: omanifest = opts.manifest
+        print('Appending metadata to manifest', omanifest)
+        fingerprint()
+        s.writeManifest(omanifest)
+
+    return 0
+
+def _recvAll(conn):
+    chunks = []
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk: break
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+def serve(socketPath):
+    """Run a conversion daemon accepting jobs on a Unix domain socket, each job is run by main() in a forked child
+    of the daemon so the modules are only imported once
+
+    A job is a JSON object {"argv": [...], "cwd": "..."}, the reply is {"status": int, "output": str}
+    """
+    import json
+    import signal
+    import socket
+    import traceback
+    try:
+        import socketserver
+    except ImportError: # python 2
+        import SocketServer as socketserver
+    try:
+        from StringIO import StringIO # python 2
+    except ImportError:
+        from io import StringIO
+
+    import issformat
+    if issformat.H5SUPPORT: import h5py # issformat imports h5py on first use, load it before forking
+
+    class JobHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            self.request.settimeout(60.)
+            job = json.loads(_recvAll(self.request).decode('utf-8'))
+            stdout, stderr = sys.stdout, sys.stderr
+            sys.stdout = sys.stderr = output = StringIO()
+            try:
+                os.chdir(job['cwd'])
+                status = main(job['argv'])
+            except SystemExit as err: # optparse exits on --help and errors
+                status = err.code if isinstance(err.code, int) else 1
+            except Exception:
+                traceback.print_exc()
+                status = 1
+            finally:
+                sys.stdout, sys.stderr = stdout, stderr
+            self.request.sendall(json.dumps({'status': status, 'output': output.getvalue()}).encode('utf-8'))
+
+    class Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+        pass
+
+    if os.path.exists(socketPath): os.remove(socketPath) # stale socket of a previous daemon
+    server = Server(socketPath, JobHandler)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print('Conversion daemon listening on', socketPath)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socketPath): os.remove(socketPath)
+
+def submit(socketPath, argv):
+    """Send a job to a conversion daemon and print its output
+
+    returns: int, exit status, None if the daemon could not be reached
+    """
+    import json
+    import socket
+
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socketPath)
+    except socket.error:
+        conn.close()
+        return None
+    try:
+        conn.sendall(json.dumps({'argv': argv, 'cwd': os.getcwd()}).encode('utf-8'))
+        conn.shutdown(socket.SHUT_WR)
+        reply = json.loads(_recvAll(conn).decode('utf-8'))
+    finally:
+        conn.close()
+    sys.stdout.write(reply['output'])
+    return reply['status']
+
+def _stripOption(argv, name):
+    """Remove a --name VALUE / --name=VALUE option from an argument list"""
+    out = []
+    skip = False
+    for arg in argv:
+        if skip: skip = False
+        elif arg == name: skip = True
+        elif not arg.startswith(name + '='): out.append(arg)
+    return out
+
+if __name__ == '__main__':
+    opts, args = buildParser().parse_args(sys.argv[1:])
+
+    if not (opts.serve is None):
+        serve(opts.serve)
+        sys.exit(0)
+
+    if not (opts.socket is None):
+        status = submit(opts.socket, _stripOption(sys.argv[1:], '--socket'))
+        if status is None: print('WARNING: no conversion daemon listening on %s, converting locally'%opts.socket)
+        else: sys.exit(status)
 
+    sys.exit(main(_stripOption(sys.argv[1:], '--socket')))
@@ -12,7 +12,7 @@ setup(name = 'issformat',
     platforms = ['*nix'],
     license = 'GPL',
     requires = ['distutils','numpy','json'],
-    py_modules = ['issformat'],
+    py_modules = ['issformat', 'issimage'],
     scripts = ['scripts/issConverter.py'],
     classifiers = [
         'Development Status :: 4 - Beta',
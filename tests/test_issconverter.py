@@ -0,0 +1,93 @@
+"""
+Checks of the issConverter conversion daemon (--serve) and its client (--socket)
+
+Run with: python -m pytest tests
+"""
+
+import importlib.util
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(REPO, 'scripts', 'issConverter.py')
+sys.path.insert(0, REPO)
+import issformat
+
+spec = importlib.util.spec_from_file_location('issConverter', SCRIPT)
+issConverter = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(issConverter)
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='no Unix domain sockets')
+
+SSTARGS = ['--sclass', 'SST', '--station', 'SE607', '--rcumode', '3', '--rcu', '0', '--ts', '2020-01-01 00:00:00']
+
+@pytest.fixture
+def daemon(tmpdir):
+    """Conversion daemon listening on a socket in the test directory, stopped with SIGTERM after the test"""
+    socketPath = str(tmpdir.join('convert.sock'))
+    env = dict(os.environ, PYTHONPATH=REPO + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    proc = subprocess.Popen([sys.executable, SCRIPT, '--serve', socketPath], env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    for _ in range(300):
+        if os.path.exists(socketPath) or proc.poll() is not None: break
+        time.sleep(0.05)
+    assert os.path.exists(socketPath), proc.stdout.read()
+    yield socketPath, proc, env
+    if proc.poll() is None:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=30)
+    proc.stdout.close()
+
+def test_daemon_converts_submitted_jobs(tmpdir, monkeypatch, capsys, daemon):
+    socketPath, proc, env = daemon
+    dd = np.arange(10 * 512.).reshape(10, 512)
+    issformat.npy2sst(dd, str(tmpdir.join('sst.dat')))
+    monkeypatch.chdir(tmpdir) # jobs run in the directory of the client
+
+    outputs = 'json,hdf5' if issformat.H5SUPPORT else 'json'
+    status = issConverter.submit(socketPath, SSTARGS + ['--rawfile', 'sst.dat', '-o', outputs, '--obasename', 'out'])
+    out = capsys.readouterr().out
+    assert status == 0 and 'Writing data to JSON out.json' in out
+    s = issformat.readJSON(str(tmpdir.join('out.json')))
+    assert s.station == 'SE607' and s.rcu == 0 and s.rawfile == 'sst.dat'
+    if issformat.H5SUPPORT:
+        s, data = issformat.readHDF5(str(tmpdir.join('out.h5')), getdata=True)
+        assert np.array_equal(data, dd)
+
+    # an existing output is skipped, a failing job and a parser error give their exit status
+    assert issConverter.submit(socketPath, SSTARGS + ['--rawfile', 'sst.dat', '-o', 'json', '--obasename', 'out']) == 0
+    assert 'out.json exists, skipping' in capsys.readouterr().out
+    if issformat.H5SUPPORT:
+        assert issConverter.submit(socketPath, SSTARGS + ['--rawfile', 'missing.dat', '-o', 'hdf5', '--obasename', 'bad']) == 1
+        assert 'FileNotFoundError' in capsys.readouterr().out
+    assert issConverter.submit(socketPath, ['--bitmode', '3']) == 2
+    assert 'invalid choice' in capsys.readouterr().out
+
+    # the command line client exits with the status of the job
+    client = subprocess.run([sys.executable, SCRIPT, '--socket', socketPath] + SSTARGS + ['--rawfile', 'sst.dat', '-o', 'json',
+                            '--obasename', 'cli'], env=env, capture_output=True, text=True, timeout=120)
+    assert client.returncode == 0 and os.path.exists(str(tmpdir.join('cli.json'))), client.stdout + client.stderr
+    client = subprocess.run([sys.executable, SCRIPT, '--socket', socketPath, '--bitmode', '3'], env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert client.returncode == 2
+
+    proc.send_signal(signal.SIGTERM)
+    assert proc.wait(timeout=30) == 0
+    assert not os.path.exists(socketPath) # removed by the daemon on exit
+    assert issConverter.submit(socketPath, SSTARGS) is None # no daemon listening
+
+def test_client_falls_back_to_local_conversion(tmpdir):
+    issformat.npy2sst(np.ones((4, 512)), str(tmpdir.join('sst.dat')))
+    env = dict(os.environ, PYTHONPATH=REPO + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    client = subprocess.run([sys.executable, SCRIPT, '--socket', str(tmpdir.join('none.sock'))] + SSTARGS +
+                            ['--rawfile', 'sst.dat', '-o', 'json', '--obasename', 'local'], cwd=str(tmpdir), env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert client.returncode == 0 and 'converting locally' in client.stdout
+    assert issformat.readJSON(str(tmpdir.join('local.json'))).rcu == 0
@@ -0,0 +1,715 @@
+"""
+Round trip checks of the issformat writers and readers on small synthetic data sets
+
+Run with: python -m pytest tests
+"""
+
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import issformat
+
+needsHDF5 = pytest.mark.skipif(not issformat.H5SUPPORT, reason='h5py is not installed')
+
+def syntheticSST(nints=300, seed=0):
+    """SST-like power spectra, a smooth bandpass with noise and a few RFI spikes"""
+    rng = np.random.default_rng(seed)
+    bandpass = 1e6 * (1. + np.sin(np.linspace(0., np.pi, 512)))
+    dd = bandpass * (1. + 0.05 * rng.standard_normal((nints, 512)))
+    dd[rng.integers(0, nints, 40), rng.integers(0, 512, 40)] *= 50.
+    return dd
+
+def writeSST(tmpdir, name='sst.dat', nints=300, ts='2020-01-01 00:00:00', integration=1, station='SE607', seed=0, integers=False):
+    dd = syntheticSST(nints, seed)
+    if integers: dd = np.round(dd) # the station statistics are integer powers
+    rawfile = os.path.join(str(tmpdir), name)
+    issformat.npy2sst(dd, rawfile)
+    return issformat.SST(station=station, rcumode=3, ts=ts, rawfile=rawfile, integration=integration, rcu=0), dd
+
+@pytest.fixture(autouse=True)
+def cleanState():
+    issformat.disableCache()
+    yield
+    issformat.disableCache()
+    issformat.configureHDF5Pool(0) # close the pooled files of the test directories
+    issformat.configureHDF5Pool(64)
+
+@needsHDF5
+@pytest.mark.parametrize('blockbytes', [issformat.BLOCKBYTES, 100 * 4096])
+def test_sharded_write_matches_single_process(tmpdir, monkeypatch, blockbytes):
+    monkeypatch.setattr(issformat, 'BLOCKBYTES', blockbytes) # small blocks, time windows span block edges
+    monkeypatch.setattr(issformat, 'HASHBYTES', 32 * 4096) # hash segments shorter than the shards
+    sst, dd = writeSST(tmpdir, nints=1000)
+    single = str(tmpdir.join('single.h5'))
+    sharded = str(tmpdir.join('sharded.h5'))
+    sst.writeHDF5(single, stats=True, flags=True)
+    sst.writeHDF5(sharded, nworkers=3, stats=True, flags=True)
+
+    s1, d1 = issformat.readHDF5(single, getdata=True)
+    s3, d3 = issformat.readHDF5(sharded, getdata=True)
+    assert np.array_equal(d1, dd) and np.array_equal(d3, dd)
+    assert s1.rawhash == s3.rawhash == sst.rawFingerprint()[0]
+
+    flags = issformat.readFlags(single)
+    assert flags.sum() > 0
+    assert np.array_equal(flags, issformat.readFlags(sharded))
+    assert np.array_equal(flags, issformat.rfiFlags(dd))
+
+    st1, st3 = issformat.readStats(single), issformat.readStats(sharded)
+    assert st1['count'] == st3['count'] == 1000
+    for key in ['min', 'max', 'quantiles']: assert np.array_equal(st1[key], st3[key])
+    for key in ['mean', 'var']: assert np.allclose(st1[key], st3[key], rtol=1e-10)
+
+def test_hasher_shards_match_whole_data_set():
+    import pickle
+    dd = syntheticSST(100)
+    whole = issformat._RawHasher(dd.dtype, dd.shape[1:])
+    for i0 in range(0, 100, 7): whole.update(dd[i0:i0 + 7])
+    segints = whole.segints
+    merged = issformat._RawHasher(dd.dtype, dd.shape[1:])
+    for i0 in range(0, 100, 2 * segints):
+        shard = pickle.loads(pickle.dumps(issformat._RawHasher(dd.dtype, dd.shape[1:])))
+        shard.update(dd[i0:i0 + 2 * segints])
+        merged.merge(pickle.loads(pickle.dumps(shard)))
+    assert merged.nints == 100 and merged.hexdigest() == whole.hexdigest()
+    with pytest.raises(ValueError): merged.update(dd[:1])
+
+@pytest.mark.parametrize('ext', ['.json', '.h5', '.tpc'])
+def test_touched_raw_file_is_hashed_once(tmpdir, monkeypatch, ext):
+    if ext == '.h5' and not issformat.H5SUPPORT: pytest.skip('h5py is not installed')
+    sst, dd = writeSST(tmpdir, nints=50)
+    ofile = str(tmpdir.join('sst' + ext))
+    if ext == '.h5': sst.writeHDF5(ofile)
+    elif ext == '.tpc': sst.writeTPC(ofile)
+    else:
+        sst.setFingerprint(*sst.rawFingerprint())
+        sst.writeJSON(ofile)
+    st = os.stat(sst._pathrawfile)
+    os.utime(sst._pathrawfile, (st.st_atime, st.st_mtime + 10.))
+
+    old = issformat.read(ofile)
+    assert old.rawUnchanged(sst._pathrawfile) and old.rawmtime == st.st_mtime + 10.
+    issformat.writeFingerprint(ofile, old)
+    monkeypatch.setattr(issformat.statData, 'rawFingerprint', None) # a second hash fails
+    assert issformat.read(ofile).rawUnchanged(sst._pathrawfile)
+    if ext == '.tpc': assert np.array_equal(issformat.tpc2npy(ofile), dd)
+
+def test_flagger_blocks_match_whole_data_set():
+    dd = syntheticSST(1000)
+    flagger = issformat.RFIFlagger()
+    for i0 in range(0, 1000, 37): flagger.update(dd[i0:i0 + 37])
+    flagger.finish()
+    packed = np.concatenate(flagger.packed, axis=0)
+    assert np.array_equal(np.unpackbits(packed, axis=1, count=512).astype(bool), issformat.rfiFlags(dd))
+
+def test_shard_edges_align_to_windows():
+    for nints in [5, 64, 100, 130, 1000, 10001]:
+        edges = issformat._shardEdges(nints, 3, 64, 64)
+        assert edges[0] == 0 and edges[-1] == nints and np.all(np.diff(edges) > 0)
+        assert np.all(edges[:-1] % 64 == 0)
+        assert np.all(edges[:-1] <= max(0, nints // 64 - 1) * 64)
+
+@needsHDF5
+def test_small_files_use_fewer_workers(tmpdir, monkeypatch, capsys):
+    import glob
+    sst, dd = writeSST(tmpdir, nints=300) # shorter than one 1024 integration hash segment
+    filename = str(tmpdir.join('sst.h5'))
+    sst.writeHDF5(filename, nworkers=3)
+    assert 'written by 1 of 3 worker processes' in capsys.readouterr().out
+    assert len(glob.glob(str(tmpdir.join('sst.shard*.h5')))) == 1
+    assert np.array_equal(issformat.readHDF5(filename, getdata=True)[1], dd)
+
+    monkeypatch.setattr(issformat, 'HASHBYTES', 32 * 4096)
+    sst.writeHDF5(filename, nworkers=3)
+    assert not ('WARNING' in capsys.readouterr().out)
+    assert len(glob.glob(str(tmpdir.join('sst.shard*.h5')))) == 3
+
+@needsHDF5
+def test_acc_has_no_summary_statistics(tmpdir):
+    rawfile = str(tmpdir.join('acc.dat'))
+    issformat.npy2acc(np.ones((1, 512, 4, 4), dtype=complex), rawfile)
+    acc = issformat.ACC(station='SE607', rcumode=3, ts='2020-01-01 00:00:00', rawfile=rawfile, nants=2)
+    acc.writeHDF5(str(tmpdir.join('acc.h5')), stats=True)
+    assert issformat.readStats(str(tmpdir.join('acc.h5'))) is None
+
+@pytest.mark.parametrize('block', [
+    np.round(syntheticSST(100)), # exact integers, integer difference mode
+    syntheticSST(100), # XOR mode
+    np.array([[0., -0., np.nan], [np.inf, 1., -2.**62]]),
+    np.round(syntheticSST(8)).reshape(8, 1, 16, 32) * (1. + 1j),
+    np.zeros((0, 512)),
+])
+def test_tpc_block_round_trip(block):
+    buf = issformat.tpcEncode(block)
+    out = issformat.tpcDecode(buf, block.dtype, block.shape)
+    assert out.dtype == block.dtype and out.shape == block.shape
+    assert np.array_equal(out.view(np.uint8), np.ascontiguousarray(block).view(np.uint8))
+
+def test_tpc_file_round_trip(tmpdir, monkeypatch):
+    monkeypatch.setattr(issformat, 'TPCBLOCKBYTES', 20 * 4096) # several codec blocks
+    sst, dd = writeSST(tmpdir, nints=150, integers=True)
+    tpcfile = str(tmpdir.join('sst.tpc'))
+    sst.writeTPC(tpcfile)
+    assert np.array_equal(issformat.tpc2npy(tpcfile), dd)
+    assert np.array_equal(issformat.tpc2npy(tpcfile, 15, 67), dd[15:67])
+    meta = issformat.readTPC(tpcfile)
+    assert meta.rawhash == sst.rawFingerprint()[0]
+
+def test_beamlet_columns_do_not_depend_on_creation_order(tmpdir):
+    first = issformat.BST(station='SE607')
+    first.setBeamlet(0, 0., 1.5708, 'MYFRAME', 180)
+    second = issformat.BST(station='SE607')
+    second.setBeamlet(0, 1., 0.5, 'SUN', 200, rcus=[0, 1, 2])
+    second.setBeamlet(1, 0., 1.5708, 'AZELGEO', 180, rcus=np.arange(3))
+    assert first.beamlets[0]['coord'] == 'MYFRAME'
+    assert second.beamlets[0]['coord'] == 'SUN' and second.beamlets[1]['coord'] == 'AZELGEO'
+    assert second.beamlets[1]['rcus'] == [0, 1, 2] and len(second._brcusets) == 1
+
+    jsonfile = str(tmpdir.join('bst.json'))
+    second.writeJSON(jsonfile)
+    assert issformat.readJSON(jsonfile).beamlets == second.beamlets
+
+@pytest.mark.parametrize('hba', [['0000', 'ffff', '0f0f'], ['FFFF', 'ffff'], ['fff', 'ffffx', '12345'], 'FFFF0000'])
+def test_hba_elements_keep_their_written_form(tmpdir, hba):
+    s, _ = writeSST(tmpdir)
+    s.hbaElements = hba
+    expect = hba if isinstance(hba, list) else [hba[i:i+4] for i in range(0, len(hba), 4)]
+    assert s.hbaElements == expect
+    assert isinstance(s._hba, np.ndarray) == (hba == ['0000', 'ffff', '0f0f'])
+
+    jsonfile = str(tmpdir.join('sst.json'))
+    s.writeJSON(jsonfile)
+    assert issformat.readJSON(jsonfile).hbaElements == expect
+    if issformat.H5SUPPORT:
+        h5file = str(tmpdir.join('sst.h5'))
+        s.writeHDF5(h5file)
+        assert issformat.readHDF5(h5file).hbaElements == expect
+
+def test_set_array_properties_on_any_statistic():
+    for s in [issformat.BST(station='SE607'), issformat.SST(station='SE607', rcu=0)]:
+        s.setArrayProp(96, 2)
+        assert (s.nants, s.npol) == (96, 2)
+
+@pytest.mark.parametrize('idxtail,collide', [(issformat.IDXTAIL, False), (2, False), (2, True)])
+def test_manifest_index_lookup(tmpdir, monkeypatch, idxtail, collide):
+    monkeypatch.setattr(issformat, 'IDXTAIL', idxtail) # small tails are merged into the sorted entries
+    if collide: monkeypatch.setattr(issformat, '_keyHash', lambda key: 7) # every key has the same hash
+    manifest = str(tmpdir.join('20200101.jsonl'))
+    members = [issformat.SST(station='SE607', rcumode=3, ts='2020-01-01 00:%02i:00'%i, rawfile='sst%i.dat'%i, rcu=i) for i in range(6)]
+    for s in members[:2]: s.writeManifest(manifest)
+    os.remove(manifest + '.idx') # a manifest written before its index
+    for s in members[2:4]: s.writeManifest(manifest)
+    with open(manifest, 'a') as fp: # records appended without the index
+        fp.write(json.dumps(members[4]._buildDict()) + '\n\n')
+    assert issformat.read(manifest, record=members[4].rawfile).rcu == 4 # found before the index is rebuilt
+    for s in [members[5], members[1]]: s.writeManifest(manifest) # a later record replaces the earlier one
+
+    assert issformat._indexSpan(manifest + '.idx') == (0, os.path.getsize(manifest))
+    assert issformat._indexLookup(manifest, members[1].rawfile) is not None
+    for s in members:
+        rec = issformat.read(manifest, record=s.rawfile)
+        assert rec.rcu == s.rcu and rec.ts == s.ts
+    assert issformat.read(manifest, record='missing.dat') is None
+    assert len(issformat.readManifest(manifest)) == 7
+
+    with open(manifest + '.idx', 'w') as fp: fp.write('sst0.dat\t0\t10\n') # a text index of an earlier version
+    assert issformat._indexLookup(manifest, 'sst0.dat') is None and issformat.read(manifest, record='sst3.dat').rcu == 3
+    members[0].writeManifest(manifest)
+    assert issformat._indexSpan(manifest + '.idx') == (0, os.path.getsize(manifest))
+    assert issformat.read(manifest, record='sst0.dat').rcu == 0
+
+def test_manifest_names():
+    s = issformat.SST(station='SE607', rcumode=3, ts='2020-01-01 12:30:00', rawfile='sst.dat', rcu=0)
+    assert issformat.manifestName(s) == './20200101.jsonl'
+    assert issformat.manifestName(s, 'm', per='station') == os.path.join('m', 'SE607_20200101.jsonl')
+    assert issformat.manifestName(s, per='observation') == './SE607_20200101_123000_sst.jsonl'
+    assert issformat.manifestName(s, per='observation', observation='L123') == './SE607_L123_sst.jsonl'
+
+def test_raw_sources_follow_frombuffer(tmpdir):
+    import io
+    import mmap
+    dd = syntheticSST(20)
+    rawfile = str(tmpdir.join('sst.dat'))
+    issformat.npy2sst(dd, rawfile)
+    raw = open(rawfile, 'rb').read() + b'\x00' * 100 # a partial trailing integration
+    with open(rawfile, 'rb') as fh:
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    # (source, writable without copy=True)
+    sources = [(rawfile, True), (raw, False), (bytearray(raw), True), (memoryview(raw), False), (io.BytesIO(raw), True),
+               (mm, False), (np.frombuffer(raw, dtype=np.uint8), False), (dd.copy(), True)]
+    for source, writable in sources:
+        out = issformat.sst2npy(source)
+        assert np.array_equal(out, dd) and out.flags.writeable == writable, type(source)
+        if not isinstance(source, (str, io.BytesIO)): assert np.shares_memory(out, np.frombuffer(source, dtype=np.uint8))
+        if isinstance(source, io.BytesIO): source.seek(0)
+        out = issformat.sst2npy(source, copy=True)
+        assert np.array_equal(out, dd) and out.flags.writeable
+        assert isinstance(source, (str, io.BytesIO)) or not np.shares_memory(out, np.frombuffer(source, dtype=np.uint8))
+    del out
+    mm.close()
+
+    with open(rawfile, 'rb') as fh: # a stream read with readinto into a preallocated buffer
+        fh.seek(8 * 512)
+        assert np.array_equal(issformat.sst2npy(fh), dd[1:])
+    class Pipe(io.RawIOBase): # short reads, no size
+        def __init__(self, data): self.data = io.BytesIO(data)
+        def readable(self): return True
+        def readinto(self, b): return self.data.readinto(memoryview(b)[:1000])
+    assert np.array_equal(issformat.sst2npy(Pipe(raw)), dd)
+    assert len(issformat._readStream(Pipe(raw))) == len(raw)
+
+    parser = issformat.RawParser('SST')
+    parts = [parser.feed(np.frombuffer(raw, dtype=np.uint8)[i0:i0 + 5000]) for i0 in range(0, len(raw), 5000)]
+    assert np.array_equal(np.concatenate(parts), dd) and parser.pending == 100
+
+def test_cached_raw_array_copy(tmpdir):
+    sst, dd = writeSST(tmpdir, nints=10)
+    issformat.enableCache(2**24)
+    assert not issformat.sst2npy(sst._pathrawfile).flags.writeable
+    out = issformat.sst2npy(sst._pathrawfile, copy=True)
+    out[0, 0] = -1.
+    assert np.array_equal(issformat.sst2npy(sst._pathrawfile), dd)
+
+@needsHDF5
+def test_pooled_file_rewritten_in_place_is_reopened(tmpdir):
+    import subprocess
+    filename = str(tmpdir.join('pool.h5'))
+    rewrite = ('import h5py, numpy, sys\n'
+               'with h5py.File(sys.argv[1], "w", locking=False) as h5:\n'
+               '    h5["data"] = numpy.zeros(16)\n'
+               '    h5["data"].attrs["station"] = sys.argv[2]\n')
+    subprocess.check_call([sys.executable, '-c', rewrite, filename, 'SE607'])
+    with issformat.openHDF5(filename) as h5: assert h5['data'].attrs['station'] == 'SE607'
+
+    # same inode and size rewrite by another process, the modification time is restored, only the change time differs
+    st = os.stat(filename)
+    subprocess.check_call([sys.executable, '-c', rewrite, filename, 'DE601'])
+    os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert os.stat(filename).st_ino == st.st_ino and os.path.getsize(filename) == st.st_size
+    with issformat.openHDF5(filename) as h5: assert h5['data'].attrs['station'] == 'DE601'
+
+    with issformat.openHDF5(filename, 'r+') as h5: h5['data'].attrs['station'] = 'FI609' # closes the pooled handle
+    with issformat.openHDF5(filename) as h5: assert h5['data'].attrs['station'] == 'FI609'
+
+@needsHDF5
+def test_rewrite_removes_unused_shards(tmpdir, monkeypatch):
+    import glob
+    monkeypatch.setattr(issformat, 'HASHBYTES', 32 * 4096)
+    sst, dd = writeSST(tmpdir, nints=1000)
+    filename = str(tmpdir.join('sst.h5'))
+    other = str(tmpdir.join('sst.shard.notes.h5'))
+    open(other, 'w').close()
+    shards = lambda: sorted(os.path.basename(f) for f in glob.glob(str(tmpdir.join('sst.shard*.h5'))))
+    for nworkers, expected in [(3, 3), (2, 2), (None, 0)]:
+        sst.writeHDF5(filename, nworkers=nworkers)
+        assert shards() == sorted(['sst.shard%03i.h5'%sid for sid in range(expected)] + ['sst.shard.notes.h5'])
+        assert np.array_equal(issformat.readHDF5(filename, getdata=True)[1], dd)
+
+def randomCorrelations(nints=2, nsb=3, nant=3, npol=2, seed=0):
+    rng = np.random.default_rng(seed)
+    n = nant * npol
+    return rng.standard_normal((nints, nsb, n, n)) + 1j * rng.standard_normal((nints, nsb, n, n))
+
+def test_polproducts_stokes_values():
+    dd = randomCorrelations()
+    baselines = issformat.uniqueBaselines(3)
+    assert len(baselines) == 6 and np.all(baselines[:, 0] <= baselines[:, 1])
+    linear = issformat.polProducts(dd)
+    stokes = issformat.polProducts(dd, products='stokes', unique=True)
+    stokesI = issformat.polProducts(dd, products='I', unique=True)
+    assert np.shares_memory(linear, dd) and stokes.shape == (2, 3, 6, 4) and stokesI.shape == (2, 3, 6)
+    for bl, (a1, a2) in enumerate(baselines):
+        xx, xy = dd[:, :, 2 * a1, 2 * a2], dd[:, :, 2 * a1, 2 * a2 + 1]
+        yx, yy = dd[:, :, 2 * a1 + 1, 2 * a2], dd[:, :, 2 * a1 + 1, 2 * a2 + 1]
+        assert np.array_equal(linear[:, :, a1, a2], np.stack([np.stack([xx, xy], -1), np.stack([yx, yy], -1)], -2))
+        assert np.allclose(stokes[:, :, bl], np.stack([xx + yy, xx - yy, xy + yx, 1j * (yx - xy)], -1))
+    assert np.array_equal(stokesI, stokes[..., 0])
+    with pytest.raises(ValueError): issformat.polProducts(dd, npol=3, products='stokes')
+
+@needsHDF5
+def test_polproducts_hdf5_round_trip(tmpdir):
+    dd = randomCorrelations(nints=5, nsb=1)
+    rawfile = str(tmpdir.join('xst.dat'))
+    issformat.npy2xst(dd, rawfile)
+    xst = issformat.XST(station='SE607', rcumode=3, ts='2020-01-01 00:00:00', rawfile=rawfile, integration=1, sb=100, nants=3)
+    filename = str(tmpdir.join('stokes.h5'))
+    assert issformat.polProductsHDF5(xst, filename, products='stokes') == 5
+    products, baselines = issformat.readPolProducts(filename, 1, 4)
+    assert np.array_equal(baselines, issformat.uniqueBaselines(3))
+    assert np.allclose(products, issformat.polProducts(dd[1:4], products='stokes', unique=True))
+    assert issformat.readHDF5(filename).station == 'SE607'
+
+def test_observation_fills_gaps_and_skips_overlaps(tmpdir):
+    a, da = writeSST(tmpdir, 'a.dat', nints=100, ts='2020-01-01 00:00:00', seed=1)
+    c, dc = writeSST(tmpdir, 'c.dat', nints=30, ts='2020-01-01 00:02:40', seed=3)
+    b, db = writeSST(tmpdir, 'b.dat', nints=50, ts='2020-01-01 00:02:00', seed=2)
+    obs = issformat.Observation([c, a, b]) # ordered by timestamp
+    assert [m.rawfile for m in obs.members] == ['a.dat', 'b.dat', 'c.dat']
+    assert len(obs) == 190 and obs.gaps == [(100, 120)] and obs.overlaps == [(2, 10)]
+
+    expected = np.concatenate([da, np.full((20, 512), np.nan), db, dc[10:]])
+    assert np.array_equal(obs.read(), expected, equal_nan=True)
+    assert np.array_equal(obs.read(95, 175), expected[95:175], equal_nan=True)
+    times, dd = obs.readTimeRange('2020-01-01 00:02:55', '2020-01-01 00:03:00')
+    assert times[0] == np.datetime64('2020-01-01T00:02:55') and np.array_equal(dd, dc[15:20])
+
+def test_station_join_alignment(tmpdir):
+    x, dx = writeSST(tmpdir, 'x.dat', nints=100, ts='2020-01-01 00:00:00', station='SE607', seed=1)
+    y, dy = writeSST(tmpdir, 'y.dat', nints=40, ts='2020-01-01 00:00:10', integration=2, station='DE601', seed=2)
+    join = issformat.StationJoin({'SE607': [x], 'DE601': [y]})
+    assert join.integration == 2 and len(join) == 40 and join.ts == np.datetime64('2020-01-01T00:00:10')
+    assert join.factors == {'SE607': 2, 'DE601': 1} and join.origins == {'SE607': 10, 'DE601': 0}
+    times, block = join.read()
+    assert times[1] == np.datetime64('2020-01-01T00:00:12')
+    assert np.allclose(block['SE607'], dx[10:90].reshape(40, 2, 512).mean(axis=1))
+    assert np.array_equal(block['DE601'], dy)
+
+    union = issformat.StationJoin([[x], [y]], union=True, resample='sum')
+    assert len(union) == 50 and union.origins['DE601'] == -5
+    parts = list(union.blocks(nblock=7))
+    assert sum(len(t) for t, _ in parts) == 50
+    dd = dict((station, np.concatenate([p[station] for _, p in parts])) for station in union.stations)
+    assert np.allclose(dd['SE607'], dx.reshape(50, 2, 512).sum(axis=1))
+    assert np.isnan(dd['DE601'][:5]).all() and np.isnan(dd['DE601'][45:]).all()
+    assert np.array_equal(dd['DE601'][5:45], dy)
+    with pytest.raises(ValueError): issformat.StationJoin([[x], [y]], resample=None)
+
+@needsHDF5
+@pytest.mark.parametrize('integers', [True, False])
+def test_tpc_hdf5_round_trip(tmpdir, monkeypatch, integers):
+    import zlib
+    monkeypatch.setattr(issformat, 'TPCBLOCKBYTES', 20 * 4096) # several codec blocks, a partial last one
+    sst, dd = writeSST(tmpdir, nints=150, integers=integers)
+    filename = str(tmpdir.join('sst.h5'))
+    sst.writeHDF5(filename, codec='tpc', stats=True, flags=True)
+    s, out = issformat.readHDF5(filename, getdata=True)
+    assert np.array_equal(out, dd) and s.rawhash == sst.rawFingerprint()[0]
+    assert np.array_equal(sst.readTimeRange(filename=filename)[1], dd)
+    assert np.array_equal(issformat.readFlags(filename), issformat.rfiFlags(dd))
+    rawfile = str(tmpdir.join('extracted.dat'))
+    assert issformat.extractRaw(filename, rawfile) == 150
+    assert open(rawfile, 'rb').read() == open(sst._pathrawfile, 'rb').read()
+
+    # the layout described by the dataset attributes is decoded without issformat
+    with issformat.openHDF5(filename) as h5:
+        dset = h5['data']
+        assert dset.attrs['codec'] == 'tpc' and 'zlib' in dset.attrs['codecformat']
+        blockints = int(dset.attrs['blockints'])
+        buf = bytes(dset[0])
+    planes = np.frombuffer(zlib.decompress(buf[1:]), dtype=np.uint8).reshape(8, -1)
+    words = np.ascontiguousarray(planes.T).view('<u8').reshape(blockints, 512)
+    if buf[:1] == b'\x01':
+        d = (words >> np.uint64(1)).astype(np.int64) ^ -(words & np.uint64(1)).astype(np.int64)
+        block = np.cumsum(d, axis=0).astype('<f8')
+    else: block = np.bitwise_xor.accumulate(words, axis=0).view('<f8')
+    assert np.array_equal(block, dd[:blockints])
+
+@needsHDF5
+@pytest.mark.parametrize('nworkers', [None, 3])
+def test_empty_raw_file_with_stats_and_flags(tmpdir, nworkers):
+    rawfile = str(tmpdir.join('sst.dat'))
+    open(rawfile, 'wb').close()
+    sst = issformat.SST(station='SE607', rcumode=3, ts='2020-01-01 00:00:00', rawfile=rawfile, integration=1, rcu=0)
+    filename = str(tmpdir.join('sst.h5'))
+    sst.writeHDF5(filename, nworkers=nworkers, stats=True, flags=True)
+    assert issformat.readHDF5(filename, getdata=True)[1].shape == (0, 512)
+    stats = issformat.readStats(filename)
+    assert stats['count'] == 0 and stats['mean'].shape == (512,)
+    for key in ['mean', 'var', 'min', 'max', 'quantiles']: assert np.isnan(stats[key]).all()
+    assert issformat.readFlags(filename).shape == (0, 512)
+    issformat.flagHDF5(filename)
+    assert issformat.readFlags(filename).shape == (0, 512)
+
+@needsHDF5
+@pytest.mark.parametrize('shuffle', [False, True])
+@pytest.mark.parametrize('nthreads', [1, 4])
+@pytest.mark.parametrize('chunkbytes', [48 * 4096, 1000]) # partial edge chunks in time, and in frequency
+def test_chunk_compressor_matches_hdf5_filters(tmpdir, monkeypatch, shuffle, nthreads, chunkbytes):
+    import zlib
+    import h5py
+    monkeypatch.setattr(issformat, 'CHUNKBYTES', chunkbytes)
+    sst, dd = writeSST(tmpdir, nints=1000)
+    filename = str(tmpdir.join('sst.h5'))
+    sst.writeHDF5(filename, compression=4, shuffle=shuffle, nthreads=nthreads)
+    reference = str(tmpdir.join('reference.h5'))
+    with issformat.openHDF5(filename) as h5:
+        dset = h5['data']
+        chunks = dset.chunks
+        assert dset.compression == 'gzip' and dset.compression_opts == 4 and dset.shuffle == shuffle
+        assert (1000 % chunks[0] > 0 or 512 % chunks[1] > 0) and np.array_equal(dset[()], dd)
+        with h5py.File(reference, 'w') as ref:
+            ref.create_dataset('data', data=dd, chunks=chunks, compression='gzip', compression_opts=4, shuffle=shuffle)
+        with h5py.File(reference, 'r') as ref:
+            for corner in [(0, 0), (999 // chunks[0] * chunks[0], 511 // chunks[1] * chunks[1])]: # first and last chunk
+                mask, ours = dset.id.read_direct_chunk(corner)
+                refmask, theirs = ref['data'].id.read_direct_chunk(corner)
+                assert mask == refmask == 0 and zlib.decompress(ours) == zlib.decompress(theirs)
+
+@needsHDF5
+def test_compressed_empty_raw_file(tmpdir):
+    rawfile = str(tmpdir.join('sst.dat'))
+    open(rawfile, 'wb').close()
+    sst = issformat.SST(station='SE607', rcumode=3, ts='2020-01-01 00:00:00', rawfile=rawfile, integration=1, rcu=0)
+    filename = str(tmpdir.join('sst.h5'))
+    sst.writeHDF5(filename, compression=4, shuffle=True, stats=True)
+    assert issformat.readHDF5(filename, getdata=True)[1].shape == (0, 512)
+
+def test_block_cache_hits_invalidation_and_eviction(tmpdir):
+    sst, dd = writeSST(tmpdir, nints=10)
+    cache = issformat.enableCache(2**24)
+    first = sst.readRawRange(0, 10)
+    assert sst.readRawRange(0, 10) is first and cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+    # same size rewrite with the modification time restored, only the change time differs
+    st = os.stat(sst._pathrawfile)
+    issformat.npy2sst(dd[::-1], sst._pathrawfile)
+    os.utime(sst._pathrawfile, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert np.array_equal(sst.readRawRange(0, 10), dd[::-1]) and cache.stats()['misses'] == 2
+
+    # a bound on the bytes held, arrays larger than the cache are not cached
+    nbytes = 2 * 512 * 8
+    cache.clear()
+    cache.resize(3 * nbytes)
+    for i0 in range(0, 10, 2): sst.readRawRange(i0, i0 + 2)
+    assert cache.stats()['entries'] == 3 and cache.nbytes == 3 * nbytes
+    sst.readRawRange(8, 10) # most recently used, a hit
+    sst.readRawRange(0, 2) # evicted, a miss
+    assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 8
+    large = sst.readRawRange(0, 10)
+    assert not large.flags.writeable and cache.nbytes <= cache.maxbytes and cache.stats()['entries'] == 3
+    cache.resize(nbytes // 2)
+    assert cache.nbytes == 0 and cache.stats()['entries'] == 0
+
+SHARECHILD = '''
+import json, os, sys, multiprocessing
+sys.path.insert(0, sys.argv[1])
+import issformat
+
+def child(descriptor, queue):
+    sd = issformat.attachShared(descriptor)
+    queue.put((sd.data.tolist(), sd.refcount()))
+    del queue
+    sd.release()
+
+if __name__ == '__main__':
+    rawfile, method = sys.argv[2:4]
+    s = issformat.SST(station='SE607', rcumode=3, ts='2020-01-01 00:00:00', rawfile=rawfile, rcu=0)
+    sd = issformat.shareData(s, 10, 50)
+    ctx = multiprocessing.get_context(method)
+    queue = ctx.Queue()
+    proc = ctx.Process(target=child, args=(sd.descriptor(), queue))
+    proc.start()
+    data, childref = queue.get()
+    proc.join()
+    out = {'exitcode': proc.exitcode, 'childmatch': data == issformat.sst2npy(rawfile)[10:50].tolist(), 'childref': childref,
+           'parentref': sd.refcount(), 'parentmatch': sd.data.tolist() == data}
+    name = sd.name
+    sd.release()
+    try:
+        issformat._openSharedMemory(name=name).close()
+        out['unlinked'] = False
+    except FileNotFoundError:
+        out['unlinked'] = True
+    out['lockfile'] = os.path.exists(issformat._shmLockName(name))
+    print(json.dumps(out))
+'''
+
+@pytest.mark.parametrize('method', ['fork', 'spawn'])
+def test_shared_data_attached_by_child_process(tmpdir, method):
+    import multiprocessing
+    import subprocess
+    if not (method in multiprocessing.get_all_start_methods()): pytest.skip('no %s start method'%method)
+    s, _ = writeSST(tmpdir, nints=60)
+    script = str(tmpdir.join('share.py'))
+    with open(script, 'w') as fp: fp.write(SHARECHILD)
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.run([sys.executable, script, repo, s._pathrawfile, method], capture_output=True, text=True, timeout=120)
+    assert proc.returncode == 0, proc.stderr
+    out = json.loads(proc.stdout)
+    assert out['exitcode'] == 0 and out['childmatch'] and out['childref'] == 2
+    assert out['parentref'] == 1 and out['parentmatch'] # the block survives the child's release
+    assert out['unlinked'] and not out['lockfile'] # and is unlinked with the last reference
+    assert not ('resource_tracker' in proc.stderr or 'leaked' in proc.stderr), proc.stderr
+
+@pytest.mark.parametrize('start,stop,expect', [
+    (None, None, (0, 300)),
+    ('2020-01-01 00:00:10', '2020-01-01 00:00:10', (10, 10)), # empty range
+    ('2020-01-01 00:00:20', '2020-01-01 00:00:10', (20, 20)), # stop before start
+    ('2019-12-31 23:59:00', '2019-12-31 23:59:30', (0, 0)), # before the first integration
+    ('2019-12-31 23:59:00', '2020-01-01 00:00:05', (0, 5)),
+    ('2020-01-01 00:10:00', '2020-01-01 00:20:00', (300, 300)), # past the last integration
+    ('2020-01-01 00:04:50', '2020-01-01 01:00:00', (290, 300)),
+    ('2020-01-01 00:00:10.500', '2020-01-01 00:00:20.200', (10, 21)), # partial first and last integrations
+    ('2020-01-01 00:00:10', '2020-01-01 00:00:20.000001', (10, 21)),
+    ('2020-01-01 00:04:59.5', None, (299, 300)),
+])
+def test_time_range_boundaries(tmpdir, start, stop, expect):
+    s, dd = writeSST(tmpdir)
+    assert s.timeIndex(start, stop) == expect
+    i0, i1 = expect
+    offset, nbytes = s.rawByteRange(i0, i1)
+    with open(s._pathrawfile, 'rb') as fh:
+        fh.seek(offset)
+        assert fh.read(nbytes) == dd[i0:i1].tobytes()
+
+    times, data = s.readTimeRange(start, stop)
+    assert data.shape == (i1 - i0, 512) and np.array_equal(data, dd[i0:i1])
+    assert np.array_equal(times, np.datetime64('2020-01-01 00:00:00', 'us') + np.arange(i0, i1) * np.timedelta64(1, 's'))
+    if issformat.H5SUPPORT:
+        h5file = str(tmpdir.join('sst.h5'))
+        s.writeHDF5(h5file)
+        h5times, h5data = s.readTimeRange(start, stop, filename=h5file)
+        assert np.array_equal(h5times, times) and h5data.shape == data.shape and np.array_equal(h5data, data)
+
+def test_meta_table_rows_match_read(tmpdir, capsys):
+    sst, dd = writeSST(tmpdir, nints=20, integration=2)
+    xstfile = str(tmpdir.join('xst.dat'))
+    issformat.npy2xst(np.ones((3, 1, 8, 8), dtype=complex), xstfile)
+    xst = issformat.XST(station='DE601', rcumode=5, ts='2020-01-02 03:04:05', rawfile=xstfile, integration=10, sb=300, nants=4)
+    bst = issformat.BST(station='IE613', rcumode=[3, 3, 5], ts='2020-01-03 00:00:00', rawfile='bst.dat', pol='X')
+    acc = issformat.ACC(station='SE607', rawfile='acc.dat') # no timestamp or RCU mode
+
+    files = []
+    for name, s in [('sst', sst), ('xst', xst), ('bst', bst), ('acc', acc)]:
+        files.append(str(tmpdir.join(name + '.json')))
+        s.writeJSON(files[-1])
+    if issformat.H5SUPPORT:
+        for name, s in [('sst', sst), ('xst', xst)]:
+            files.append(str(tmpdir.join(name + '.h5')))
+            s.writeHDF5(files[-1])
+
+    table = issformat.readMetaTable(files, nthreads=3)
+    assert table.dtype == issformat.METATABLE_DTYPE and list(table['filename']) == files
+    for row, filename in zip(table, files):
+        if filename.endswith('.h5'): s, data = issformat.read(filename, getdata=True)
+        else: s, data = issformat.read(filename), None
+        assert row['datatype'] == type(s).__name__ and row['station'] == s.station
+        assert row['rawfile'] == s.rawfile
+        if s.ts is None: assert np.isnat(row['timestamp'])
+        else: assert row['timestamp'] == np.datetime64(s.ts)
+        rcumode = -1 if s.rcumode is None else s.rcumode
+        if isinstance(rcumode, list): assert row['rcumode'] == 3 and row['mixedrcumode']
+        else: assert row['rcumode'] == rcumode and not row['mixedrcumode']
+        assert row['integration'] == (-1 if s.integration is None else s.integration)
+        assert row['subband'] == getattr(s, 'sb', -1) and row['rcu'] == getattr(s, 'rcu', -1)
+        assert row['pol'] == (getattr(s, 'pol', None) or '')
+        assert row['nints'] == (-1 if data is None else data.shape[0])
+    assert issformat.readMetaTable([]).shape == (0,)
+
+    with open(str(tmpdir.join('broken.json')), 'w') as fp: fp.write('{"datatype": "SST", ')
+    with open(str(tmpdir.join('broken.h5')), 'w') as fp: fp.write('not an HDF5 file')
+    bad = [str(tmpdir.join(name)) for name in ['missing.json', 'broken.json', 'sst.dat']]
+    if issformat.H5SUPPORT: bad += [str(tmpdir.join(name)) for name in ['missing.h5', 'broken.h5']]
+    capsys.readouterr()
+    table = issformat.readMetaTable(files[:1] + bad)
+    assert table[0]['datatype'] == 'SST' and list(table['filename']) == files[:1] + bad
+    for row in table[1:]: # unreadable files give an empty row
+        assert row['datatype'] == '' and row['station'] == '' and np.isnat(row['timestamp'])
+        assert row['rcumode'] == -1 and row['nints'] == -1 and row['rawfile'] is None
+    assert capsys.readouterr().out.count('WARNING') == len(bad)
+
+@pytest.mark.parametrize('sclass', ['ACC', 'BST', 'SST', 'XST'])
+def test_raw_writers_append_byte_exact(tmpdir, sclass):
+    rng = np.random.default_rng(3)
+    dtype, recshape = issformat._recordSpec(sclass, nant=2, npol=2)
+    nints = 1 if sclass == 'ACC' else 7
+    dd = rng.standard_normal((2 * nints,) + recshape)
+    if dtype.kind == 'c': dd = dd + 1j * rng.standard_normal(dd.shape)
+    writer = getattr(issformat, 'npy2' + sclass.lower())
+    rawfile = str(tmpdir.join('raw.dat'))
+    writer(dd[:nints], rawfile)
+    writer(dd[nints:].astype(dd.dtype.newbyteorder('>')), rawfile, append=True) # converted to little-endian
+    with open(rawfile, 'rb') as fh: assert fh.read() == np.asarray(dd, dtype=dtype).tobytes()
+    reader = getattr(issformat, sclass.lower() + '2npy')
+    out = reader(rawfile) if sclass in ['BST', 'SST'] else reader(rawfile, nant=2, npol=2)
+    assert np.array_equal(out, dd)
+    writer(dd[:1], rawfile) # overwritten without append
+    with open(rawfile, 'rb') as fh: assert fh.read() == np.asarray(dd[:1], dtype=dtype).tobytes()
+
+@needsHDF5
+@pytest.mark.parametrize('options', [{}, {'compression': 4, 'shuffle': True}, {'codec': 'tpc'}, {'nworkers': 3}])
+def test_extract_raw_byte_exact(tmpdir, monkeypatch, options):
+    monkeypatch.setattr(issformat, 'BLOCKBYTES', 16 * 4096) # several blocks of 4 integrations
+    sst, dd = writeSST(tmpdir, nints=50)
+    with open(sst._pathrawfile, 'rb') as fh: raw = fh.read()
+    recbytes = 512 * 8
+    filename = str(tmpdir.join('sst.h5'))
+    sst.writeHDF5(filename, **options)
+
+    rawfile = str(tmpdir.join('extracted.dat'))
+    assert issformat.extractRaw(filename, rawfile) == 50
+    with open(rawfile, 'rb') as fh: assert fh.read() == raw
+    assert issformat.extractRaw(filename, rawfile, start=7, stop=23) == 16
+    with open(rawfile, 'rb') as fh: assert fh.read() == raw[7 * recbytes:23 * recbytes]
+    assert issformat.extractRaw(filename, rawfile, append=True, start=45, stop=100) == 5 # clipped to the data set
+    with open(rawfile, 'rb') as fh: assert fh.read() == raw[7 * recbytes:23 * recbytes] + raw[45 * recbytes:]
+    assert issformat.extractRaw(filename, rawfile, start=30, stop=30) == 0
+    assert os.path.getsize(rawfile) == 0
+
+def beamletBST(tmpdir, nints=40):
+    """BST with three pointings over a few subbands, the beamlet IDs are not in pointing or subband order"""
+    rng = np.random.default_rng(5)
+    dd = rng.uniform(0., 1e6, (nints, 488))
+    rawfile = str(tmpdir.join('bst.dat'))
+    issformat.npy2bst(dd, rawfile)
+    bst = issformat.BST(station='SE607', rcumode=3, ts='2020-01-01 00:00:00', rawfile=rawfile, pol='X')
+    pointings = [(0., 1.5708, 'AZELGEO'), (1.2, 0.4, 'J2000'), (0.3, 0.2, 'J2000')]
+    for i, bid in enumerate([17, 3, 250, 9, 40, 41, 100, 5, 487]):
+        theta, phi, coord = pointings[i % 3]
+        bst.setBeamlet(bid, theta, phi, coord, [300, 120, 200][i // 3])
+    return bst, dd
+
+def test_beamlet_index_lookups(tmpdir):
+    bst, dd = beamletBST(tmpdir)
+    index = bst.beamletIndex()
+    assert index.pointings == [(0., 1.5708, 'AZELGEO'), (0.3, 0.2, 'J2000'), (1.2, 0.4, 'J2000')] # by coordinate system, theta, phi
+    assert index.pointing((1.2, 0.4, 'J2000')) == index.pointing(1.2, 0.4, 'j2000') == index.pointing([1.2, 0.4, 'J2000'])
+    assert index.pointing(2) == 2 and index.pointing(np.int64(1)) == 1
+    for bad in [(1.2,), (1.2, 0.4)]:
+        with pytest.raises(ValueError): index.pointing(*bad) # a bare theta, or a pointing without coordinate system
+    with pytest.raises(ValueError): index.pointing(np.float64(1.2))
+    with pytest.raises(KeyError): index.pointing(1.2, 0.4, 'SUN')
+
+    cols, sbs = index.beamlets((0., 1.5708, 'AZELGEO'))
+    assert list(cols) == [9, 100, 17] and list(sbs) == [120, 200, 300] # ordered by subband
+    cols, sbs = index.beamlets((1.2, 0.4, 'J2000'))
+    assert list(cols) == [40, 5, 3] and list(sbs) == [120, 200, 300]
+    assert list(index.subband(120)) == [9, 41, 40] and list(index.subband(200)) == [100, 487, 5] # ordered by pointing
+    assert len(index.subband(0)) == 0
+
+    spectra = index.spectra(dd, pointings=[(0.3, 0.2, 'J2000'), 0])
+    assert np.array_equal(spectra[0], dd[:, [41, 487, 250]]) and np.array_equal(spectra[1], dd[:, [9, 100, 17]])
+    assert len(index.spectra(dd)) == 3 and index.spectra(dd, pointings=[]) == []
+
+@needsHDF5
+@pytest.mark.parametrize('withindex', [True, False])
+def test_beamlet_spectra_slices(tmpdir, monkeypatch, withindex):
+    monkeypatch.setattr(issformat, 'BLOCKBYTES', 7 * 488 * 8) # blocks of 7 integrations
+    bst, dd = beamletBST(tmpdir)
+    filename = str(tmpdir.join('bst.h5'))
+    bst.writeHDF5(filename)
+    if not withindex: # a file written before the index, it is built from the beamlet metadata
+        with issformat.openHDF5(filename, 'r+') as h5: del h5['beamletindex']
+    index, spectra = issformat.readBeamletSpectra(filename)
+    assert index.pointings == bst.beamletIndex().pointings
+    for p, sp in enumerate(spectra): assert np.array_equal(sp, dd[:, index.beamlets(p)[0]])
+    for start, stop in [(3, 25), (0, 1), (38, None), (20, 20), (30, 100)]:
+        index, spectra = issformat.readBeamletSpectra(filename, pointings=[(1.2, 0.4, 'J2000')], start=start, stop=stop)
+        assert len(spectra) == 1 and np.array_equal(spectra[0], dd[start:stop][:, [40, 5, 3]])
+
+@pytest.mark.parametrize('integration', [1, 2])
+def test_station_join_time_index_matches_members(tmpdir, integration):
+    s, _ = writeSST(tmpdir, nints=60, integration=integration)
+    join = issformat.StationJoin({'SE607': [s]})
+    obs = join.observations['SE607']
+    assert len(join) == 60 and np.array_equal(join.times(), s.integrationTimes())
+    ts = np.datetime64('2020-01-01 00:00:00', 'us')
+    for start, stop in [(None, None), (-5., 3.), (0., 0.), (4.5, 9.1), (7., 2.), (10., 1000.), (100., 200.), (17.9999, None)]:
+        start = None if start is None else ts + np.timedelta64(int(start * 1e6), 'us')
+        stop = None if stop is None else ts + np.timedelta64(int(stop * 1e6), 'us')
+        assert join.timeIndex(start, stop) == obs.timeIndex(start, stop) == s.timeIndex(start, stop)
@@ -0,0 +1,124 @@
+"""
+Checks of the issimage all-sky imager on synthetic XST correlation matrices
+
+Run with: python -m pytest tests
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import issformat
+import issimage
+
+NPIX = 65 # the grid includes l = m = 0
+
+def antennaPositions(nant=24, seed=0):
+    """Random (east, north, up) positions in a 40 m wide field"""
+    rng = np.random.default_rng(seed)
+    return np.hstack([rng.uniform(-20., 20., (nant, 2)), np.zeros((nant, 1))])
+
+def pointSource(antpos, freq, l0, m0, nints=3, npol=2, flux=(1., 2.)):
+    """XST correlation matrices of a single point source at (l0, m0), the polarizations are interleaved"""
+    n0 = np.sqrt(1. - l0**2 - m0**2)
+    a = np.exp(-2j * np.pi * freq / issimage.C * np.dot(antpos, [l0, m0, n0]))
+    nant = antpos.shape[0]
+    dd = np.zeros((nints, 1, nant * npol, nant * npol), dtype=complex)
+    for p in range(npol):
+        dd[:, 0, p::npol, p::npol] = flux[p] * np.outer(a, a.conj())
+    return dd
+
+@pytest.fixture(autouse=True)
+def cleanState():
+    issformat.disableCache()
+    issimage._steeringCache.clear()
+    yield
+    issimage._steeringCache.clear()
+
+def test_subband_frequencies():
+    assert issimage.subbandFreq(256, 3) == 50e6
+    assert issimage.subbandFreq(0, 5) == 100e6 # second Nyquist zone
+    assert issimage.subbandFreq(512, 6) == 240e6 # 160 MHz clock, third Nyquist zone
+    assert issimage.subbandFreq(100, [3, 3, 5]) == issimage.subbandFreq(100, 3)
+
+def test_lm_grid():
+    l, m, sky = issimage.lmGrid(NPIX)
+    assert l.shape == m.shape == sky.shape == (NPIX, NPIX)
+    assert l[0, -1] == 1. and m[-1, 0] == 1. # l along the columns, m along the rows
+    assert sky[NPIX // 2, NPIX // 2] and not sky[0, 0] and not sky[NPIX // 2, -1]
+
+@pytest.mark.parametrize('pol', ['I', 'XX', 'YY'])
+@pytest.mark.parametrize('row,col', [(32, 32), (20, 45), (50, 28)])
+def test_point_source_peak(row, col, pol):
+    antpos = antennaPositions()
+    imager = issimage.XSTImager(antpos, npix=NPIX, cache=issimage.SteeringCache())
+    freq = issimage.subbandFreq(300, 3)
+    dd = pointSource(antpos, freq, imager.l[row, col], imager.m[row, col])
+    imgs = imager.image(dd, freq, 'SE607', 300, pol=pol, nbatch=2) # batches span the integrations
+    assert imgs.shape == (3, NPIX, NPIX)
+    assert np.all(np.isnan(imgs[:, ~imager.sky])) and not np.any(np.isnan(imgs[:, imager.sky]))
+    flux = {'I': 3., 'XX': 1., 'YY': 2.}[pol]
+    nant = antpos.shape[0]
+    for img in imgs:
+        assert np.unravel_index(np.nanargmax(img), img.shape) == (row, col)
+        assert np.isclose(img[row, col], flux * nant**2, rtol=1e-4) # all antennas add in phase
+
+def test_image_xst_raw_file(tmpdir):
+    antpos = antennaPositions(nant=8)
+    imager = issimage.XSTImager(antpos, npix=NPIX, cache=issimage.SteeringCache())
+    freq = issimage.subbandFreq(200, 3)
+    dd = pointSource(antpos, freq, imager.l[40, 24], imager.m[40, 24], nints=5)
+    rawfile = str(tmpdir.join('xst.dat'))
+    issformat.npy2xst(dd, rawfile)
+    xst = issformat.XST(station='SE607', rcumode=3, ts='2020-01-01 00:00:00', rawfile=rawfile, integration=1, sb=200, nants=8)
+    imgs = imager.imageXST(xst, start=1, stop=4)
+    assert imgs.shape == (3, NPIX, NPIX)
+    assert np.array_equal(imgs, imager.image(dd[1:4], freq), equal_nan=True)
+    assert imager.imageXST(xst, start=5).shape == (0, NPIX, NPIX)
+
+    xst.sb = None
+    assert imager.imageXST(xst) is None
+
+def test_steering_cache_reuse_and_invalidation():
+    cache = issimage.SteeringCache(maxbytes=2**30)
+    antpos = antennaPositions()
+    imager = issimage.XSTImager(antpos, npix=NPIX, cache=cache)
+    freq = issimage.subbandFreq(300, 3)
+    first = imager.steering(freq, 'SE607', 300)
+    assert imager.steering(freq, 'SE607', 300) is first # reused
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+    imager.image(pointSource(antpos, freq, 0., 0.), freq, 'SE607', 300)
+    assert cache.stats()['hits'] == 2 and cache.stats()['entries'] == 1
+
+    # another subband, station, grid size or set of antenna positions is a different steering matrix
+    other = imager.steering(issimage.subbandFreq(301, 3), 'SE607', 301)
+    assert not np.array_equal(other, first)
+    imager.steering(freq, 'DE601', 300)
+    issimage.XSTImager(antpos, npix=33, cache=cache).steering(freq, 'SE607', 300)
+    moved = antpos.copy()
+    moved[0, 0] += 1.
+    shifted = issimage.XSTImager(moved, npix=NPIX, cache=cache).steering(freq, 'SE607', 300)
+    assert not np.array_equal(shifted, first)
+    assert cache.stats()['misses'] == 5 and cache.stats()['entries'] == 5
+    assert issimage.XSTImager(antpos.copy(), npix=NPIX, cache=cache).steering(freq, 'SE607', 300) is first
+
+    # the least recently used matrices are evicted when the cache is resized
+    cache.resize(2 * first.nbytes)
+    assert cache.stats()['entries'] == 2 and cache.nbytes <= 2 * first.nbytes
+    assert imager.steering(freq, 'SE607', 300) is first # the most recently used is kept
+    assert not first.flags.writeable
+
+def test_imagers_share_the_default_cache():
+    antpos = antennaPositions()
+    freq = issimage.subbandFreq(300, 3)
+    first = issimage.XSTImager(antpos, npix=NPIX).steering(freq, 'SE607', 300)
+    assert issimage.XSTImager(antpos, npix=NPIX).steering(freq, 'SE607', 300) is first
+    assert issimage._steeringCache.stats()['entries'] == 1
+
+def test_unknown_polarization():
+    imager = issimage.XSTImager(antennaPositions(), npix=NPIX, cache=issimage.SteeringCache())
+    with pytest.raises(ValueError):
+        imager.image(np.zeros((1, 48, 48), dtype=complex), 50e6, pol='XY')